@@ -24,6 +24,19 @@ for dataset, datafiles in DATASETS.items():
 			)
 		)
 
+# once downloaded, load all the files into the cache in one
+# parallel batch. fail_ok as any of the downloads may have failed
+actions.append(
+	dict(
+		type="python_action",
+		function="add_csv_group_to_cache",
+		group="quandl",
+		csvs=[action["target"] for action in actions],
+		row_key="Date",
+		fail_ok=True
+	)
+)
+
 # one cmd line option: the file path for dumping results
 output_file_name = sys.argv[0]
 output_json = json.dumps(dict(actions=actions), indent=4)
@@ -0,0 +1,5 @@
+setlocal
+:: Load test the BizDeck HTTP API. Pass eg --start --setup load_quandl_yield --concurrency 1,32 --json api.json
+set PYTHONPATH=%BDROOT%\src\py\core
+%VPYTHON% %BDROOT%\src\py\tests\bench\api_bench.py %*
+endlocal
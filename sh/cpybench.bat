@@ -0,0 +1,5 @@
+setlocal
+:: Benchmark the actions.py loaders under CPython. Pass eg --rows 1000,10000 --json bench.json
+set PYTHONPATH=%BDROOT%\src\py\core;%BDROOT%\src\py\mock
+%VPYTHON% %BDROOT%\src\py\tests\bench\actions_bench.py %*
+endlocal
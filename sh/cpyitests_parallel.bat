@@ -0,0 +1,10 @@
+:: Run the int test suite across several workers, each with
+:: its own copy of BDTREE, ports and browser user data dir.
+:: Worker logs are merged into %BDROOT%\logs at the end.
+setlocal
+:: BDSTARTSTOP should be 0 or 1
+set BDSTARTSTOP=1
+:: Tornado AsyncTestCase timeout
+set ASYNC_TEST_TIMEOUT=20
+%VPYTHON% %BDROOT%\src\py\tests\int\parallel_runner.py --workers 4
+endlocal
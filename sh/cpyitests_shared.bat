@@ -0,0 +1,12 @@
+:: Run the int test suite in one interpreter against one
+:: BizDeckServer.exe, reset via /api/reset between tests,
+:: rather than launching and stopping it for every test
+setlocal
+:: BDSTARTSTOP should be 0 or 1
+set BDSTARTSTOP=1
+:: BDSHARED should be session or module
+set BDSHARED=session
+:: Tornado AsyncTestCase timeout
+set ASYNC_TEST_TIMEOUT=20
+%VPYTHON% -m unittest discover -s %BDROOT%\src\py\tests\int -p "*_test*.py"
+endlocal
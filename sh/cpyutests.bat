@@ -0,0 +1,7 @@
+setlocal
+:: actions.py falls back to src/py/mock/mock_containers.py under CPython
+set PYTHONPATH=%BDROOT%\src\py\core;%BDROOT%\src\py\mock
+%VPYTHON% %BDROOT%\src\py\tests\unit\actions_test.py
+%VPYTHON% %BDROOT%\src\py\tests\unit\mock_cache_test.py
+%VPYTHON% %BDROOT%\src\py\tests\unit\upstream_stand_in_test.py
+endlocal
@@ -0,0 +1,5 @@
+setlocal
+:: Stress test websocket broadcasts. Pass eg --start --setup quandl_rates --clients 10,100,500 --json ws.json
+set PYTHONPATH=%BDROOT%\src\py\core;%BDROOT%\src\py\tests\bench
+%VPYTHON% %BDROOT%\src\py\tests\bench\websock_bench.py %*
+endlocal
@@ -94,12 +94,57 @@ namespace BizDeck {
             }
         }
 
+        // Press a button as the StreamDeck does, running its ButtonAction with
+        // the websock module, so it notifies the GUI as a deck press would.
+        // Lets benchmarks and tests press buttons without a deck.
+        [Route(HttpVerbs.Get, "/run/button/{button_name}")]
+        public async Task<string> RunButton(string button_name) {
+            ButtonAction button_action = Server.Instance.GetButtonAction(button_name);
+            if (button_action == null) {
+                string error = $"/api/run/button/{button_name}: no such button";
+                logger.Error(error);
+                throw HttpException.NotFound(error);
+            }
+            BizDeckResult action_result = await button_action.RunAsync().ConfigureAwait(false);
+            if (!action_result.OK) {
+                await Server.Instance.SendNotification("Button action failed", action_result.Message);
+                throw HttpException.BadRequest(action_result.Message);
+            }
+            return JsonConvert.SerializeObject(action_result);
+        }
+
         [Route(HttpVerbs.Get, "/shutdown")]
         public string Shutdown() {
             Server.Instance.Shutdown();
             return JsonConvert.SerializeObject(BizDeckResult.Success);
         }
 
+        // Reload config from disk, rebuild the button maps, and empty the
+        // cache and the actions.py state that refers to it, so int tests can
+        // reset a shared server between tests instead of relaunching it. No
+        // deck connected is not a failure here.
+        [Route(HttpVerbs.Get, "/reset")]
+        public string Reset() {
+            BizDeckResult load_result = config_helper.LoadConfig();
+            if (!load_result.OK) {
+                logger.Error($"Reset: LoadConfig failed: {load_result.Message}");
+                throw HttpException.InternalServerError(load_result.Message);
+            }
+            BizDeckResult python_result = BizDeckPython.Instance.ResetModuleState();
+            if (!python_result.OK) {
+                logger.Error($"Reset: ResetModuleState failed: {python_result.Message}");
+                throw HttpException.InternalServerError(python_result.Message);
+            }
+            DataCache.Instance.Clear();
+            BizDeckResult rebuild_result = Server.Instance.RebuildButtonMaps();
+            if (!rebuild_result.OK && rebuild_result != BizDeckResult.StreamDeckNotConnected) {
+                logger.Error($"Reset: RebuildButtonMaps failed: {rebuild_result.Message}");
+                throw HttpException.InternalServerError(rebuild_result.Message);
+            }
+            logger.Info("Reset: config reloaded and cache cleared");
+            return JsonConvert.SerializeObject(BizDeckResult.Success);
+        }
+
         [Route(HttpVerbs.Post, "/add_button")]
         public async Task<string> AddButton([BizDeckData] JObject button_defn) {
             JToken script = null;
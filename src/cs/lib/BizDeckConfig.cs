@@ -75,5 +75,10 @@ namespace BizDeck
 
         [JsonProperty("background_default")]
         public string BackgroundDefault { get; set; }
+
+        // Optional actions script to play at startup, eg warm_start
+        // to restore the cache from a snapshot
+        [JsonProperty("startup_actions")]
+        public string StartupActions { get; set; }
     }
 }
@@ -38,6 +38,9 @@ namespace BizDeck {
                 // Set global vars in bizdeck.py
                 action_scope.SetVariable("BDRoot", config_helper.BDRoot);
                 action_scope.SetVariable("Logger", logger);
+                // http_formats.json and secrets for python_action downloads
+                action_scope.SetVariable("HttpFormatMap", config_helper.HttpFormatMap);
+                action_scope.SetVariable("Secrets", config_helper.Secrets);
                 return BizDeckResult.Success;
             }
             catch (Exception ex) {
@@ -65,6 +68,21 @@ namespace BizDeck {
             return new BizDeckResult(error);
         }
 
+        // Drop the incremental load, key index and derived entry state that
+        // actions.py keeps between actions, eg when /api/reset clears the cache
+        public BizDeckResult ResetModuleState() {
+            try {
+                dynamic func = action_scope.GetVariable("reset_module_state");
+                func();
+                return BizDeckResult.Success;
+            }
+            catch (Exception ex) {
+                string error = $"reset_module_state failed {ex}";
+                logger.Error($"ResetModuleState: {error}");
+                return new BizDeckResult(error);
+            }
+        }
+
         // Run batch script creates an instance of the Python runtime for the
         // script execution, just as if we'd run a script at the command line.
         // The options parameter allows us to pass in cmd line params and env vars.
@@ -0,0 +1,162 @@
+﻿using System;
+using System.Collections.Generic;
+using System.Globalization;
+using System.IO;
+using System.Linq;
+using Apache.Arrow;
+using Apache.Arrow.Ipc;
+using Parquet;
+using Parquet.Schema;
+
+namespace BizDeck {
+
+    // Reads Parquet and Arrow IPC files into the column layout of a ColumnarCSV
+    // cache entry: a double[] for each numeric column, with NaN for nulls, and
+    // a string[] for everything else, with dates as ISO yyyy-MM-dd. Only the
+    // requested columns and row groups are read; for Arrow IPC files the
+    // record batches are the row groups. actions.py calls this from the
+    // add_columnar_file_to_cache python_action.
+    public static class ColumnarFileReader {
+        private static readonly HashSet<Type> numeric_types = new() {
+            typeof(double), typeof(float), typeof(decimal), typeof(long), typeof(int),
+            typeof(short), typeof(sbyte), typeof(ulong), typeof(uint), typeof(ushort), typeof(byte)
+        };
+
+        // columns null or empty means all columns, and row_groups null
+        // or empty means all row groups
+        public static Dictionary<string, Array> ReadParquet(string path, List<string> columns, List<int> row_groups) {
+            using Stream stream = File.OpenRead(path);
+            using ParquetReader reader = ParquetReader.CreateAsync(stream).GetAwaiter().GetResult();
+            DataField[] fields = reader.Schema.GetDataFields();
+            List<DataField> selected = Select(fields, f => f.Name, columns, path);
+            var parts = selected.ToDictionary(f => f.Name, f => new List<Array>());
+            foreach (int group in Groups(row_groups, reader.RowGroupCount, path)) {
+                using ParquetRowGroupReader group_reader = reader.OpenRowGroupReader(group);
+                foreach (DataField field in selected) {
+                    Parquet.Data.DataColumn column = group_reader.ReadColumnAsync(field).GetAwaiter().GetResult();
+                    parts[field.Name].Add(ToCacheArray(column.Data, field.ClrType));
+                }
+            }
+            return Concat(selected.Select(f => f.Name), parts);
+        }
+
+        public static Dictionary<string, Array> ReadArrow(string path, List<string> columns, List<int> batches) {
+            using Stream stream = File.OpenRead(path);
+            using ArrowFileReader reader = new(stream);
+            int batch_count = reader.RecordBatchCountAsync().GetAwaiter().GetResult();
+            List<Field> selected = Select(reader.Schema.FieldsList, f => f.Name, columns, path);
+            var parts = selected.ToDictionary(f => f.Name, f => new List<Array>());
+            foreach (int batch_index in Groups(batches, batch_count, path)) {
+                RecordBatch batch = reader.ReadRecordBatchAsync(batch_index).GetAwaiter().GetResult();
+                foreach (Field field in selected) {
+                    parts[field.Name].Add(ToCacheArray(batch.Column(field.Name)));
+                }
+            }
+            return Concat(selected.Select(f => f.Name), parts);
+        }
+
+        // The requested fields in requested order, or all fields in file order
+        private static List<T> Select<T>(IEnumerable<T> fields, Func<T, string> name_of, List<string> columns, string path) {
+            if (columns == null || columns.Count == 0) {
+                return fields.ToList();
+            }
+            var by_name = fields.ToDictionary(name_of);
+            var missing = columns.Where(c => !by_name.ContainsKey(c)).ToList();
+            if (missing.Count > 0) {
+                throw new ArgumentException($"{path} has no columns {String.Join(",", missing)}");
+            }
+            return columns.Select(c => by_name[c]).ToList();
+        }
+
+        private static IEnumerable<int> Groups(List<int> groups, int count, string path) {
+            if (groups == null || groups.Count == 0) {
+                return Enumerable.Range(0, count);
+            }
+            foreach (int group in groups) {
+                if (group < 0 || group >= count) {
+                    throw new ArgumentException($"{path} has no row group {group} of {count}");
+                }
+            }
+            return groups;
+        }
+
+        private static Dictionary<string, Array> Concat(IEnumerable<string> names, Dictionary<string, List<Array>> parts) {
+            var result = new Dictionary<string, Array>();
+            foreach (string name in names) {
+                List<Array> arrays = parts[name];
+                if (arrays.Count == 1) {
+                    result.Add(name, arrays[0]);
+                    continue;
+                }
+                Type element_type = arrays.Count > 0 ? arrays[0].GetType().GetElementType() : typeof(string);
+                Array column = Array.CreateInstance(element_type, arrays.Sum(a => a.Length));
+                int offset = 0;
+                foreach (Array part in arrays) {
+                    Array.Copy(part, 0, column, offset, part.Length);
+                    offset += part.Length;
+                }
+                result.Add(name, column);
+            }
+            return result;
+        }
+
+        // Parquet.Net gives us a typed CLR array, eg double?[], per column chunk
+        private static Array ToCacheArray(Array data, Type clr_type) {
+            if (data is double[] doubles) {
+                return doubles;
+            }
+            Type element_type = Nullable.GetUnderlyingType(clr_type) ?? clr_type;
+            if (numeric_types.Contains(element_type)) {
+                var values = new double[data.Length];
+                for (int index = 0; index < data.Length; index++) {
+                    object cell = data.GetValue(index);
+                    values[index] = cell == null ? Double.NaN : Convert.ToDouble(cell, CultureInfo.InvariantCulture);
+                }
+                return values;
+            }
+            var strings = new string[data.Length];
+            for (int index = 0; index < data.Length; index++) {
+                strings[index] = FormatCell(data.GetValue(index));
+            }
+            return strings;
+        }
+
+        private static Array ToCacheArray(IArrowArray array) {
+            int length = array.Length;
+            switch (array) {
+                case DoubleArray a:
+                    return Enumerable.Range(0, length).Select(i => a.GetValue(i) ?? Double.NaN).ToArray();
+                case FloatArray a:
+                    return Enumerable.Range(0, length).Select(i => (double?)a.GetValue(i) ?? Double.NaN).ToArray();
+                case Int64Array a:
+                    return Enumerable.Range(0, length).Select(i => (double?)a.GetValue(i) ?? Double.NaN).ToArray();
+                case Int32Array a:
+                    return Enumerable.Range(0, length).Select(i => (double?)a.GetValue(i) ?? Double.NaN).ToArray();
+                case StringArray a:
+                    return Enumerable.Range(0, length).Select(i => a.IsNull(i) ? null : a.GetString(i)).ToArray();
+                case Date32Array a:
+                    return Enumerable.Range(0, length).Select(i => FormatCell(a.GetDateTime(i))).ToArray();
+                case Date64Array a:
+                    return Enumerable.Range(0, length).Select(i => FormatCell(a.GetDateTime(i))).ToArray();
+                case TimestampArray a:
+                    return Enumerable.Range(0, length).Select(i => FormatCell(a.GetTimestamp(i))).ToArray();
+                default:
+                    throw new NotSupportedException($"ColumnarFileReader: unsupported Arrow type {array.Data.DataType.Name}");
+            }
+        }
+
+        // Dates as ISO dates, so they key and sort like csv dates
+        private static string FormatCell(object cell) {
+            switch (cell) {
+                case null:
+                    return null;
+                case DateTime dt:
+                    return dt.TimeOfDay == TimeSpan.Zero ? dt.ToString("yyyy-MM-dd") : dt.ToString("o");
+                case DateTimeOffset dto:
+                    return dto.TimeOfDay == TimeSpan.Zero ? dto.ToString("yyyy-MM-dd") : dto.ToString("o");
+                default:
+                    return Convert.ToString(cell, CultureInfo.InvariantCulture);
+            }
+        }
+    }
+}
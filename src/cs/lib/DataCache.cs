@@ -1,6 +1,7 @@
 ﻿using System;
 using System.Collections;
 using System.Collections.Generic;
+using System.Globalization;
 using System.IO;
 using System.Linq;
 using System.Text;
@@ -37,6 +38,7 @@ namespace BizDeck {
     public enum CacheEntryType {
         PrimaryKeyCSV,
         RegularCSV,
+        ColumnarCSV,
     }
 
     // [JsonObject] to signal to Newtonsoft.Json to ignore IEnumerable base,
@@ -89,6 +91,12 @@ namespace BizDeck {
         [JsonIgnore]
         public Dictionary<string, Dictionary<string, string>> AsDict { get => as_dict; }
         private Dictionary<string, Dictionary<string, string>> as_dict = null;
+        // ColumnarCSV entries hold one typed array per column: double[] for
+        // numeric columns with NaN for missing, string[] for the rest with
+        // null for missing. Rows are only materialised on demand.
+        [JsonIgnore]
+        public Dictionary<string, Array> AsColumns { get => as_columns; }
+        private Dictionary<string, Array> as_columns = null;
 
         // The ctor have type knowledge of Value, so set the helper
         // accessors for Enumerator here. For the List ctor we expect
@@ -115,6 +123,46 @@ namespace BizDeck {
             }
         }
 
+        // Columnar ctor: val maps column name to a double[] or string[], all of
+        // the same length. row_key is optional; if supplied the key column
+        // values are used as row keys, as for PrimaryKeyCSV.
+        public CacheEntry(Dictionary<string, Array> val, string row_key, List<string> column_names) {
+            Type = CacheEntryType.ColumnarCSV;
+            CacheValue = val;
+            this.row_key = row_key ?? "";
+            as_columns = val;
+            headers = column_names;
+            count = val.Count > 0 ? val.Values.First().Length : 0;
+            if (!String.IsNullOrEmpty(row_key) && val.ContainsKey(row_key)) {
+                row_keys = new List<string>(count);
+                foreach (object key_value in val[row_key]) {
+                    row_keys.Add(FormatCell(key_value));
+                }
+            }
+        }
+
+        // Render one columnar cell in the same string form the CSV held
+        public static string FormatCell(object cell) {
+            switch (cell) {
+                case null:
+                    return "";
+                case double d:
+                    return Double.IsNaN(d) ? "" : d.ToString(CultureInfo.InvariantCulture);
+                default:
+                    return cell.ToString();
+            }
+        }
+
+        // Build a row dict from the column arrays, so columnar entries
+        // can be rendered and iterated just like the row based types
+        private Dictionary<string, string> MaterialiseRow(int index) {
+            Dictionary<string, string> row = new(as_columns.Count);
+            foreach (KeyValuePair<string, Array> column in as_columns) {
+                row[column.Key] = FormatCell(column.Value.GetValue(index));
+            }
+            return row;
+        }
+
         public string GetRowKey(int index) {
             if (index > Count - 1) {
                 return null;
@@ -124,6 +172,8 @@ namespace BizDeck {
                     return index.ToString();
                 case CacheEntryType.PrimaryKeyCSV:
                     return RowKeys[index];
+                case CacheEntryType.ColumnarCSV:
+                    return row_keys != null ? row_keys[index] : index.ToString();
                 default:
                     throw new NotImplementedException();
             }
@@ -140,6 +190,8 @@ namespace BizDeck {
                 case CacheEntryType.PrimaryKeyCSV:
                     key = RowKeys[index];
                     return new CacheEntryRow(AsDict[key], key);
+                case CacheEntryType.ColumnarCSV:
+                    return new CacheEntryRow(MaterialiseRow(index), GetRowKey(index));
                 default:
                     throw new NotImplementedException();
             }
@@ -151,6 +203,8 @@ namespace BizDeck {
                     return HTMLHelpers.IndexColumnName;
                 case CacheEntryType.PrimaryKeyCSV:
                     return HTMLHelpers.KeyColumnName;
+                case CacheEntryType.ColumnarCSV:
+                    return RowKeys != null ? HTMLHelpers.KeyColumnName : HTMLHelpers.IndexColumnName;
                 default:
                     return HTMLHelpers.EmptyString;
             }
@@ -197,6 +251,9 @@ namespace BizDeck {
                 case CacheEntryType.PrimaryKeyCSV:
                     current_row.Row = cache_entry.AsDict[current_row.KeyValue];
                     return true;
+                case CacheEntryType.ColumnarCSV:
+                    current_row.Row = cache_entry.GetRow(index).Row;
+                    return true;
                 default:
                     throw new NotImplementedException();
             }
@@ -250,6 +307,12 @@ namespace BizDeck {
             ConfigHelper.Instance.SaveExcelQuery(group, cache_key);
         }
 
+        // IronPython callers pass row_key for every layout, so accept and ignore it
+        // for lists. Without this overload Python inserts of unkeyed csvs can't bind.
+        public void Insert(string group, string cache_key, List<Dictionary<string, string>> val, string row_key, List<string> column_names) {
+            Insert(group, cache_key, val, column_names);
+        }
+
         public void Insert(string group, string cache_key, Dictionary<string, Dictionary<string, string>> val, string row_key, List<string> column_names) {
             logger.Info($"Insert: inserting {group}/{cache_key} with row_key:{row_key} and cols:{column_names}");
             lock (cache_lock) {
@@ -267,6 +330,27 @@ namespace BizDeck {
             logger.Info($"Insert: inserted {group}/{cache_key} with row_key:{row_key}");
             ConfigHelper.Instance.SaveExcelQuery(group, cache_key);
         }
+
+        // Columnar entries get their own name rather than another Insert
+        // overload, as IronPython can't always pick between the overloads
+        // when row_key is None
+        public void InsertColumns(string group, string cache_key, Dictionary<string, Array> val, string row_key, List<string> column_names) {
+            logger.Info($"InsertColumns: inserting {group}/{cache_key} with row_key:{row_key} and cols:{String.Join(",", column_names)}");
+            lock (cache_lock) {
+                Dictionary<string, CacheEntry> cache_group = null;
+                if (cache.ContainsKey(group)) {
+                    cache_group = cache[group];
+                }
+                else {
+                    cache_group = new();
+                    cache.Add(group, cache_group);
+                }
+                cache_group[cache_key] = new CacheEntry(val, row_key, column_names);
+                changed = true;
+            }
+            logger.Info($"InsertColumns: inserted {group}/{cache_key} with row_key:{row_key}");
+            ConfigHelper.Instance.SaveExcelQuery(group, cache_key);
+        }
         #endregion InsertMethods
 
         // The ActionsDriver uses DataCache.HasChanged to figure out if we
@@ -292,6 +376,49 @@ namespace BizDeck {
         }
 
 
+        // Enumeration for python actions that work across the whole cache,
+        // eg snapshots. We return copies so callers don't need the lock.
+        public List<string> GetGroupNames() {
+            lock (cache_lock) {
+                return cache.Keys.ToList();
+            }
+        }
+
+        public List<string> GetCacheKeys(string group) {
+            lock (cache_lock) {
+                if (cache.ContainsKey(group)) {
+                    return cache[group].Keys.ToList();
+                }
+            }
+            return new List<string>();
+        }
+
+        // Drop every entry. Used by /api/reset so int tests can share one
+        // server process and still start each test with an empty cache.
+        public void Clear() {
+            lock (cache_lock) {
+                cache.Clear();
+                changed = true;
+            }
+            logger.Info("Clear: cache cleared");
+        }
+
+        // Drop one entry, returning it, or null if there was none. Used by
+        // actions.py to withdraw derived entries whose sources have changed.
+        public CacheEntry Remove(string group, string cache_key) {
+            CacheEntry entry = null;
+            lock (cache_lock) {
+                if (cache.ContainsKey(group) && cache[group].Remove(cache_key, out entry)) {
+                    if (cache[group].Count == 0) {
+                        cache.Remove(group);
+                    }
+                    changed = true;
+                }
+            }
+            logger.Info($"Remove: {group}/{cache_key} {(entry == null ? "unknown" : "removed")}");
+            return entry;
+        }
+
         public CacheEntry GetCacheEntry(string group, string cache_key) {
             logger.Info($"GetCacheEntry: getting {group}/{cache_key}");
             lock (cache_lock) {
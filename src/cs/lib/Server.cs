@@ -7,6 +7,7 @@ using EmbedIO.WebApi;
 using EmbedIO.Files;
 using EmbedIO.Actions;
 using EmbedIO.Cors;
+using Newtonsoft.Json.Linq;
 
 namespace BizDeck {
     public class Server {
@@ -73,6 +74,9 @@ namespace BizDeck {
             BizDeckStatus.Instance.MyURL = $"http://{config_helper.BizDeckConfig.HTTPHostName}:{config_helper.BizDeckConfig.HTTPServerPort}";
             // Create our IronPython executor
             BizDeckPython.Instance.Init(config_helper);
+            // Play any startup actions, eg a cache warm start from snapshot,
+            // before the web server starts so the first GUI gets the data
+            PlayStartupActions();
             // Create websock here so that ConnectStreamDeck and CreateWebServer can get from
             // the member var, and we can pass it to button actions enabling them to send
             // notifications to the GUI on fails
@@ -98,6 +102,21 @@ namespace BizDeck {
                                 config_helper.BizDeckConfig.BlinkInterval);
         }
 
+        protected void PlayStartupActions() {
+            string startup_actions = config_helper.BizDeckConfig.StartupActions;
+            if (String.IsNullOrWhiteSpace(startup_actions)) {
+                return;
+            }
+            ActionsDriver actions_driver = new();
+            JObject actions = actions_driver.LoadAndParseActionScript(startup_actions);
+            if (actions == null) {
+                logger.Error($"PlayStartupActions: cannot load {startup_actions}");
+                return;
+            }
+            BizDeckResult result = actions_driver.PlayActions(startup_actions, actions).GetAwaiter().GetResult();
+            logger.Info($"PlayStartupActions: {startup_actions} result[{result}]");
+        }
+
         protected bool ConnectStreamDeck() {
             // TODO: make this reentrant, so a bounce is not necessary to handle
             // the "deck not plugged in scenario". Will likely need some cleaning
@@ -210,13 +229,17 @@ namespace BizDeck {
             // before rebuilding the action map because ConnectedDeck.SetupDeviceButtons()
             // relies on the length difference between the ButtonDefnList and
             // ButtonActionMap to figure out which buttons need clearing.
+            // With no deck we still rebuild the action map, so buttons added
+            // or deleted take effect for the GUI and /api/run, but report the
+            // missing deck as before.
             if (stream_deck != null) {
                 stream_deck.SetupDeviceButtons();
             }
-            else {
+            BizDeckResult rebuild_result = RebuildButtonActionMap();
+            if (stream_deck == null && rebuild_result.OK) {
                 return BizDeckResult.StreamDeckNotConnected;
             }
-            return RebuildButtonActionMap();
+            return rebuild_result;
         }
 
         private BizDeckResult RebuildButtonActionMap( )  {
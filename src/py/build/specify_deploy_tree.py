@@ -42,6 +42,9 @@ DEPLOY_TREE = {
         'actions/': {
             'quandl_rates.json': 'scripts/actions/quandl_rates.json',
             'load_quandl_yield.json': 'scripts/actions/load_quandl_yield.json',
+            'quandl_rates_to_cache.json': 'scripts/actions/quandl_rates_to_cache.json',
+            'warm_start.json': 'scripts/actions/warm_start.json',
+            'save_cache_snapshot.json': 'scripts/actions/save_cache_snapshot.json',
         },
         'apps/': {
             'excel.json': 'scripts/apps/excel.json',
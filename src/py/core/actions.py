@@ -1,24 +1,60 @@
 # This is an IronPython module that uses .Net types
-# It will not work on the CPython runtime
+# Under CPython it falls back to the plain Python containers
+# in src/py/mock/mock_containers.py, for unit testing and
+# benchmarking the loaders. See set_container_types below.
 # std py pkgs provided by IronPython
-from csv import DictReader
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from csv import DictReader, reader as csv_reader
+import datetime
 import functools
+import glob
+import hashlib
+from heapq import merge as heap_merge
+import io
+from itertools import islice
 import json
+import math
 import os
 import os.path
+import re
+import struct
 import sys
+import threading
+import time
+import http.client
+from urllib.parse import urljoin, urlsplit
 # std .Net packages
 # We're running under IronPython: import .Net generic
 # collections so we can pass back native C# types.
 # https://stackoverflow.com/questions/5209675/passing-lists-from-ironpython-to-c-sharp
 # https://ironpython.net/documentation/dotnet/dotnet.html#accessing-generic-types
-from System.Collections.Generic import List, Dictionary
+try:
+    from System import Array
+    from System.Collections.Generic import List, Dictionary
+except ImportError:
+    # CPython: src/py/mock must be on PYTHONPATH
+    from mock_containers import Array, List, Dictionary
+
+
+# Container factory seam: all the marshalling code below looks up List,
+# Dictionary and Array as module globals at call time, so benchmarks and
+# tests can swap in their own implementations, eg instrumented containers
+# that count allocations. The types must support the generic subscript
+# idiom eg Dictionary[str, str]().
+def set_container_types(list_type, dictionary_type, array_type):
+    global List, Dictionary, Array
+    List, Dictionary, Array = list_type, dictionary_type, array_type
 
 # BizDeck utilities
 
 # Global variables set by BizDeckPython.cs
 BDRoot = None
 Logger = None
+# cfg/http_formats.json as loaded by ConfigHelper, and the secrets
+HttpFormatMap = None
+Secrets = None
 
 
 # ActionFunctions: base class for an action with type:python_action
@@ -78,6 +114,134 @@ class ActionFunction(object):
         return param_dict, param_errors
 
 
+# Block size used by tail_lines when seeking back from the end of a file
+TAIL_BLOCK_SIZE = 8192
+
+
+# Return the last count data lines of the file at path without reading
+# the whole file. We seek back from the end a block at a time until we've
+# seen more than count line breaks, or we hit the start of the file, in
+# which case we drop the header line. NB this assumes no quoted fields
+# with embedded line breaks, which holds for the vendor files we load.
+def tail_lines(path, count, block_size=TAIL_BLOCK_SIZE):
+    data = b''
+    with open(path, "rb") as tail_file:
+        tail_file.seek(0, os.SEEK_END)
+        pos = tail_file.tell()
+        while pos > 0 and data.count(b'\n') <= count:
+            step = min(block_size, pos)
+            pos -= step
+            tail_file.seek(pos)
+            data = tail_file.read(step) + data
+    lines = [line for line in data.decode('utf-8').splitlines() if line]
+    if pos == 0:
+        # we read back to the start, so the first line is the header
+        lines = lines[1:]
+    return lines[-count:] if count > 0 else []
+
+
+# Read just the header line of a csv, so tail mode can build a DictReader
+# over lines that don't include the header
+def read_csv_header(path):
+    with open(path, "rt") as csv_file:
+        line = csv_file.readline()
+    return next(csv_reader([line]), [])
+
+
+# Build a DictReader over a csv file honouring max_lines. In head mode we
+# stream from the top and stop after max_lines rows, which suits files
+# with the latest rows first, like quandl's yield.csv. In tail mode we
+# seek back from the end of the file for files with latest rows last.
+# The caller owns csv_file; it's only read in head mode.
+def make_dict_reader(csv_file, csv_path, headers, max_lines, read_mode):
+    if read_mode == "tail" and max_lines is not None:
+        field_names = headers or read_csv_header(csv_path)
+        return DictReader(tail_lines(csv_path, max_lines), field_names)
+    reader = DictReader(csv_file, headers)
+    if max_lines is not None:
+        return LimitedDictReader(reader, max_lines)
+    return reader
+
+
+# Wrap a DictReader so iteration stops after max_lines rows, while
+# preserving the fieldnames attribute the loaders rely on
+class LimitedDictReader(object):
+    def __init__(self, reader, max_lines):
+        self.reader = reader
+        self.max_lines = max_lines
+
+    @property
+    def fieldnames(self):
+        return self.reader.fieldnames
+
+    def __iter__(self):
+        return islice(self.reader, self.max_lines)
+
+
+# Dictionary encoding for low cardinality string columns. Vendor and
+# scraped csvs repeat the same few values down a column: tenor labels,
+# statuses, id prefixes and blanks. csv.DictReader gives us a new string
+# for every cell, so an entry holds thousands of copies of each value. A
+# StringEncoder keeps a pool of distinct values per column, and hands back
+# the pooled instance for repeats, so all the cells with the same value
+# share one string. Consumers see exactly the same values. A column whose
+# distinct count passes max_distinct isn't low cardinality, so we stop
+# pooling it rather than grow a pool as big as the column.
+DICT_ENCODE_MAX_DISTINCT = 1024
+
+
+# Approximate size of a .Net string on x64: 8 byte header, 8 byte method
+# table pointer, 4 byte length, UTF-16 chars and a null, rounded up to 8
+def cs_string_bytes(value):
+    return (22 + 2 * len(value) + 7) & ~7
+
+
+class StringEncoder(object):
+    def __init__(self, max_distinct=DICT_ENCODE_MAX_DISTINCT):
+        self.max_distinct = max_distinct
+        # column name to pool dict, or None once the column is abandoned
+        self.pools = dict()
+        self.cells = 0
+        self.shared = 0
+        self.saved_bytes = 0
+
+    def encode(self, column, value):
+        if value is None:
+            return value
+        self.cells += 1
+        pool = self.pools.get(column, False)
+        if pool is False:
+            pool = self.pools[column] = dict()
+        elif pool is None:
+            return value
+        pooled = pool.get(value)
+        if pooled is not None:
+            self.shared += 1
+            self.saved_bytes += cs_string_bytes(value)
+            return pooled
+        if len(pool) >= self.max_distinct:
+            self.pools[column] = None
+            return value
+        pool[value] = value
+        return value
+
+    def encoded_columns(self):
+        return [column for column, pool in self.pools.items() if pool is not None]
+
+    def __repr__(self):
+        return "StringEncoder(cells:%d, shared:%d, saved_bytes:%d, encoded_columns:%d of %d)" % (
+            self.cells, self.shared, self.saved_bytes, len(self.encoded_columns()), len(self.pools))
+
+
+# The StringEncoder stats from the last encoded load of each entry, keyed
+# on (group, cache_key), and the public accessor for them
+encoding_stats = dict()
+
+
+def last_encoding_stats(group, cache_key):
+    return encoding_stats.get((group, cache_key))
+
+
 # A pair of csv reader helper functions
 
 # Python's CSVReader returned ordered dicts, so the KV pair are in the same
@@ -85,12 +249,15 @@ class ActionFunction(object):
 # appear disordered in the /excel table views, because the code below 
 # marshals into C# dicts. 
 
-def read_unique_key_rows(reader, key):
+# Pass a StringEncoder as encoder to dictionary encode the cell values.
+def read_unique_key_rows(reader, key, encoder=None):
     cs_cache_entry = Dictionary[str, Dictionary[str, str]]()
     for py_row_dict in reader:
         key_value = py_row_dict[key]
         cs_row_dict = Dictionary[str, str]()
         for k,v in py_row_dict.items():
+            if encoder:
+                v = encoder.encode(k, v)
             cs_row_dict.Add(k.replace(' ', ''), v)
         if cs_cache_entry.ContainsKey(key_value):
             Logger.Error('read_unique_key_row: duplicate key[%s]' % key_value)
@@ -99,18 +266,545 @@ def read_unique_key_rows(reader, key):
     return cs_cache_entry
 
 
-def read_non_unique_key_rows(reader):
+def read_non_unique_key_rows(reader, encoder=None):
     cs_cache_entry = List[Dictionary[str, str]]()
     for py_row_dict in reader:
         # Create the C# dict that will hold the row contents
         cs_row_dict = Dictionary[str, str]()
         for k,v in py_row_dict.items():
+            if encoder:
+                v = encoder.encode(k, v)
             # remove whitespace from keys before caching
             cs_row_dict.Add(k.replace(' ', ''), v)
         cs_cache_entry.Add(cs_row_dict)
     return cs_cache_entry
 
 
+# Typed columnar reader. We collect the raw strings for each column,
+# infer a type per column, and then convert each column into a single
+# contiguous .Net array: double[] for numeric columns, with NaN marking
+# missing values, and string[] for everything else, with null for missing.
+# Columns are keyed on whitespace stripped names, as for the row readers.
+COLUMN_TYPE_FLOAT = "float"
+COLUMN_TYPE_STR = "str"
+MISSING_FLOAT = float('nan')
+
+
+def infer_column_type(values):
+    for value in values:
+        if not value:
+            continue    # blanks are missing, and don't vote
+        try:
+            float(value)
+        except ValueError:
+            return COLUMN_TYPE_STR
+    return COLUMN_TYPE_FLOAT
+
+
+def to_cs_column(values, column_type):
+    if column_type == COLUMN_TYPE_FLOAT:
+        return Array[float]([float(v) if v else MISSING_FLOAT for v in values])
+    return Array[str]([v if v else None for v in values])
+
+
+# Only str columns are dictionary encoded, as double[] cells aren't objects.
+# Given a CsvSchema we take the column types from it rather than inferring
+# them, and check each cell against it.
+def read_columns(reader, field_names, encoder=None, schema=None):
+    raw_columns = [[] for name in field_names]
+    for py_row_dict in reader:
+        for name, raw_column in zip(field_names, raw_columns):
+            raw_column.append(py_row_dict.get(name))
+    return make_cs_columns(field_names, raw_columns, encoder, schema)
+
+
+def make_cs_columns(field_names, raw_columns, encoder=None, schema=None):
+    cs_cache_entry = Dictionary[str, Array]()
+    column_types = dict()
+    for name, raw_column in zip(field_names, raw_columns):
+        cs_name = name.replace(' ', '')
+        if schema:
+            column = schema.column(name)
+            column_types[cs_name] = column["type"]
+            if column["type"] == COLUMN_TYPE_FLOAT:
+                # checked and converted in one pass
+                cs_cache_entry.Add(cs_name, Array[float](check_float_column(raw_column, column)))
+                continue
+            check_str_column(raw_column, column)
+        else:
+            column_types[cs_name] = infer_column_type(raw_column)
+        if encoder and column_types[cs_name] == COLUMN_TYPE_STR:
+            raw_column = [encoder.encode(cs_name, v or None) for v in raw_column]
+        cs_cache_entry.Add(cs_name, to_cs_column(raw_column, column_types[cs_name]))
+    return cs_cache_entry, column_types
+
+
+# Sidecar schemas: the column names in file order, types and nullability
+# of a csv, saved as JSON next to it, eg data/csv/yield.schema.json for
+# data/csv/yield.csv. Loaders with the schema param set to "use" infer and
+# save the schema on the first load. Later loads read it instead, check the
+# csv header against it, and fail fast on drift, ie when the vendor has
+# added, removed or reordered columns. The columnar loader also takes its
+# column types from the schema with no guessing, and fails on the first
+# cell that doesn't fit. schema "refresh" reinfers and resaves, eg after
+# accepting a layout change.
+SCHEMA_SUFFIX = ".schema.json"
+SCHEMA_VERSION = 1
+
+
+class CsvSchema(object):
+    # columns: list of dicts with name, type and nullable
+    def __init__(self, columns):
+        self.columns = columns
+        self.by_name = dict((column["name"], column) for column in columns)
+
+    @property
+    def names(self):
+        return [column["name"] for column in self.columns]
+
+    def column(self, name):
+        return self.by_name[name]
+
+    # A description of how header differs from the schema, or None
+    def drift(self, header):
+        if header == self.names:
+            return None
+        added = [name for name in header if name not in self.by_name]
+        removed = [name for name in self.names if name not in header]
+        if added or removed:
+            return "added%s removed%s" % (added, removed)
+        return "columns reordered to %s" % header
+
+    def save(self, path):
+        with open(path, "wt") as schema_file:
+            schema_file.write(json.dumps(dict(version=SCHEMA_VERSION, columns=self.columns), indent=4))
+
+    @staticmethod
+    def load(path):
+        with open(path, "rt") as schema_file:
+            schema_json = json.loads(schema_file.read())
+        if schema_json.get("version") != SCHEMA_VERSION:
+            raise ValueError("%s has schema version %s" % (path, schema_json.get("version")))
+        return CsvSchema(schema_json["columns"])
+
+
+def schema_path(csv_path):
+    return os.path.splitext(csv_path)[0] + SCHEMA_SUFFIX
+
+
+def infer_csv_schema(csv_path):
+    with open(csv_path, "rt") as csv_file:
+        reader = DictReader(csv_file)
+        field_names = reader.fieldnames or []
+        raw_columns = [[] for name in field_names]
+        for py_row_dict in reader:
+            for name, raw_column in zip(field_names, raw_columns):
+                raw_column.append(py_row_dict.get(name))
+    return CsvSchema([dict(name=name, type=infer_column_type(raw_column),
+                           nullable=any(not value for value in raw_column))
+                      for name, raw_column in zip(field_names, raw_columns)])
+
+
+# The schema for csv_path per the schema param of a loader, or None if
+# schema is not set. Raises ValueError on drift, so the load fails before
+# any parsing.
+def get_csv_schema(csv_path, schema):
+    if not schema:
+        return None
+    if schema not in ("use", "refresh"):
+        raise ValueError("bad schema(%s)" % schema)
+    path = schema_path(csv_path)
+    if schema == "use" and os.path.exists(path):
+        csv_schema = CsvSchema.load(path)
+        drift = csv_schema.drift(read_csv_header(csv_path))
+        if drift:
+            raise ValueError("schema drift in %s: %s" % (os.path.basename(csv_path), drift))
+        return csv_schema
+    csv_schema = infer_csv_schema(csv_path)
+    csv_schema.save(path)
+    Logger.Info("get_csv_schema: saved %s" % path)
+    return csv_schema
+
+
+# Check the raw cells of a column against its schema entry. Float columns
+# are returned converted, with NaN for blanks. We convert with a tight
+# comprehension, and only go looking for the bad row when it fails.
+def check_float_column(raw_column, column):
+    check_str_column(raw_column, column)
+    try:
+        return [float(v) if v else MISSING_FLOAT for v in raw_column]
+    except ValueError:
+        for row, value in enumerate(raw_column):
+            try:
+                float(value or 0)
+            except ValueError:
+                raise ValueError("row %d: %s(%s) is not a float" % (row + 1, column["name"], value))
+        raise
+
+
+def check_str_column(raw_column, column):
+    if not column["nullable"] and not all(raw_column):
+        row = [bool(value) for value in raw_column].index(False)
+        raise ValueError("row %d: %s is blank" % (row + 1, column["name"]))
+
+
+# All inserts from this module go through insert_rows and insert_columns,
+# so we know which file each entry was loaded from. source is the csv
+# path, or None for entries that don't come straight from a file. Cache
+# snapshots use the sources to check a snapshot entry is still current.
+# Each insert also recomputes the derived entries that depend on the
+# inserted entry.
+entry_sources = dict()
+
+
+def insert_rows(cache, group, cache_key, cs_cache_entry, row_key, column_names, source=None):
+    cache.Insert(group, cache_key, cs_cache_entry, row_key, column_names)
+    entry_sources[(group, cache_key)] = source
+    invalidate_dependents(cache, group, cache_key)
+
+
+def insert_columns(cache, group, cache_key, cs_cache_entry, row_key, column_names, source=None):
+    cache.InsertColumns(group, cache_key, cs_cache_entry, row_key, column_names)
+    entry_sources[(group, cache_key)] = source
+    invalidate_dependents(cache, group, cache_key)
+
+
+# Helpers shared by the csv loading actions
+
+# Parse a csv file into a dict of dicts if row_key is set, or a list of
+# dicts otherwise. Returns the entry and the csv field names.
+# A schema gives the field names in file order.
+def load_csv_as_dict(csv_path, row_key, headers, max_lines, read_mode, encoder=None, schema=None):
+    with open(csv_path, "rt") as csv_file:
+        reader = make_dict_reader(csv_file, csv_path, headers, max_lines, read_mode)
+        field_names = schema.names if schema else reader.fieldnames
+        if row_key:
+            cs_cache_entry = read_unique_key_rows(reader, row_key, encoder)
+        else:
+            cs_cache_entry = read_non_unique_key_rows(reader, encoder)
+    return cs_cache_entry, field_names
+
+
+# Schema fast path for head mode reads: the header has been checked against
+# the schema, so we skip it, use a plain csv reader rather than building a
+# dict per row, and transpose the rows into columns. Rows with the wrong
+# field count fail.
+def read_schema_columns(csv_file, schema, max_lines, encoder=None):
+    rows = csv_reader(csv_file)
+    next(rows, None)
+    if max_lines is not None:
+        rows = islice(rows, max_lines)
+    rows = list(rows)
+    width = len(schema.columns)
+    for row_number, row in enumerate(rows):
+        if len(row) != width:
+            raise ValueError("row %d has %d fields not %d" % (row_number + 1, len(row), width))
+    raw_columns = [list(column) for column in zip(*rows)] if rows else [[] for name in schema.names]
+    return make_cs_columns(schema.names, raw_columns, encoder, schema)
+
+
+# Parse a csv file into typed columns. Returns the entry, the csv
+# field names and the inferred column types.
+def load_csv_as_columns(csv_path, headers, max_lines, read_mode, encoder=None, schema=None):
+    with open(csv_path, "rt") as csv_file:
+        if schema and read_mode == "head":
+            cs_cache_entry, column_types = read_schema_columns(csv_file, schema, max_lines, encoder)
+            return cs_cache_entry, schema.names, column_types
+        reader = make_dict_reader(csv_file, csv_path, headers, max_lines, read_mode)
+        field_names = schema.names if schema else reader.fieldnames or headers
+        cs_cache_entry, column_types = read_columns(reader, field_names, encoder, schema)
+    return cs_cache_entry, field_names, column_types
+
+
+# csv_file_name will be eg yield.csv; no good as a JSON
+# property name as it looks like a member reference. So
+# change the . to _
+def csv_cache_key(csv):
+    return csv.replace('.', '_')
+
+
+def make_column_names(py_column_names):
+    column_names = List[str]()
+    for name in py_column_names:
+        # some csv files have spaces in field names
+        column_names.Add(name.replace(' ', ''))
+    return column_names
+
+
+# ActionsDriver passes JSON true as the string "True"
+def as_bool(value):
+    if isinstance(value, str):
+        return value.lower() in ("true", "1", "yes")
+    return bool(value)
+
+
+# A StringEncoder if the encode_strings param of a loader is set, else None
+def make_encoder(encode_strings):
+    return StringEncoder() if as_bool(encode_strings) else None
+
+
+# Record and log the stats of an encoded load
+def report_encoding(action, group, cache_key, encoder):
+    if encoder:
+        encoding_stats[(group, cache_key)] = encoder
+        Logger.Info("%s: %s/%s %s" % (action.__class__.__name__, group, cache_key, encoder))
+
+
+# The CsvSchema for a loader's schema param, and an error if the schema is
+# bad or the csv has drifted from it
+def check_schema(action, csv_path, schema):
+    try:
+        return get_csv_schema(csv_path, schema), None
+    except (IOError, ValueError, KeyError) as ex:
+        error = "%s: %s" % (action.__class__.__name__, ex)
+        Logger.Error(error)
+        return None, error
+
+
+def check_read_mode(action, read_mode):
+    if read_mode in ("head", "tail"):
+        return None
+    error = "%s: bad read_mode(%s)" % (action.__class__.__name__, read_mode)
+    Logger.Error(error)
+    return error
+
+
+# Incremental reload support for keyed csv entries. A CsvFingerprint
+# captures enough of a file to tell if a later version of it only has
+# rows prepended (newest first files like yield.csv) or appended (newest
+# last): the header line, the size and mtime, and a digest of all the
+# data after the header. Hashing the file is a lot cheaper than parsing
+# it into the cache, and checking the whole of the old data region means
+# a row revised in place always forces a full reparse.
+FINGERPRINT_BLOCK = 65536
+
+
+# sha1 of the bytes from start to end of the file at path
+def digest_byte_range(path, start, end):
+    digest = hashlib.sha1()
+    with open(path, "rb") as csv_file:
+        csv_file.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = csv_file.read(min(FINGERPRINT_BLOCK, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return digest.digest()
+
+
+class CsvFingerprint(object):
+    def __init__(self, path):
+        stat = os.stat(path)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        with open(path, "rb") as csv_file:
+            self.header = csv_file.readline()
+            # the data must end in a complete line for a clean join
+            csv_file.seek(max(len(self.header), self.size - 1))
+            self.ends_with_newline = csv_file.read(1) in (b'\n', b'')
+        self.data_digest = digest_byte_range(path, len(self.header), self.size)
+
+    def unchanged(self, other):
+        return (self.size == other.size and self.header == other.header and
+                self.data_digest == other.data_digest)
+
+    def data_size(self):
+        return self.size - len(self.header)
+
+
+# Figure out where the new rows are in the file at path, given the
+# fingerprint of the previously loaded version. Returns the byte range
+# of the new rows, or None if the file wasn't simply prepended or
+# appended to, and so needs a full reparse.
+def find_new_rows_range(path, old_fp, new_fp):
+    if new_fp.header != old_fp.header or new_fp.size <= old_fp.size:
+        return None
+    if not old_fp.ends_with_newline:
+        return None
+    header_size = len(new_fp.header)
+    # appended: the old file is a prefix of the new one
+    if digest_byte_range(path, header_size, old_fp.size) == old_fp.data_digest:
+        return old_fp.size, new_fp.size
+    # prepended: the old data is a suffix of the new file, starting
+    # on a line boundary
+    old_data_start = new_fp.size - old_fp.data_size()
+    if (read_byte_range(path, old_data_start - 1, old_data_start) == b'\n' and
+            digest_byte_range(path, old_data_start, new_fp.size) == old_fp.data_digest):
+        return header_size, old_data_start
+    return None
+
+
+def read_byte_range(path, start, end):
+    with open(path, "rb") as csv_file:
+        csv_file.seek(start)
+        return csv_file.read(end - start)
+
+
+def read_byte_range_lines(path, start, end):
+    data = read_byte_range(path, start, end)
+    return [line for line in data.decode('utf-8').splitlines() if line]
+
+
+def cs_rows_equal(row1, row2):
+    if row1.Count != row2.Count:
+        return False
+    for k in row1.Keys:
+        if not row2.ContainsKey(k) or row2[k] != row1[k]:
+            return False
+    return True
+
+
+# The keys added, changed and removed by the last load of a keyed entry.
+# Downstream code can use these to push just the delta to clients.
+class ChangeSet(object):
+    def __init__(self, added=None, changed=None, removed=None, incremental=False):
+        self.added = added or []
+        self.changed = changed or []
+        self.removed = removed or []
+        self.incremental = incremental
+
+    def is_empty(self):
+        return not (self.added or self.changed or self.removed)
+
+    def __repr__(self):
+        return "ChangeSet(added:%d, changed:%d, removed:%d, incremental:%s)" % (
+            len(self.added), len(self.changed), len(self.removed), self.incremental)
+
+
+# Merge new_rows into a copy of old_entry, returning the merged entry and
+# the ChangeSet. We copy rather than update old_entry in place as the
+# cache may be rendering it on another thread.
+def merge_keyed_rows(old_entry, new_rows):
+    merged = Dictionary[str, Dictionary[str, str]](old_entry)
+    change_set = ChangeSet(incremental=True)
+    for key_value in new_rows.Keys:
+        new_row = new_rows[key_value]
+        if not merged.ContainsKey(key_value):
+            change_set.added.append(key_value)
+        elif not cs_rows_equal(merged[key_value], new_row):
+            change_set.changed.append(key_value)
+        else:
+            continue
+        merged[key_value] = new_row
+    return merged, change_set
+
+
+def diff_keyed_rows(old_entry, new_entry):
+    change_set = ChangeSet()
+    for key_value in new_entry.Keys:
+        if not old_entry.ContainsKey(key_value):
+            change_set.added.append(key_value)
+        elif not cs_rows_equal(old_entry[key_value], new_entry[key_value]):
+            change_set.changed.append(key_value)
+    change_set.removed = [k for k in old_entry.Keys if not new_entry.ContainsKey(k)]
+    return change_set
+
+
+# What we remember about each incrementally loaded entry, keyed on
+# (group, cache_key). BizDeckPython.cs keeps this module loaded for
+# the life of the server, so this state persists between actions.
+class IncrementalLoadState(object):
+    def __init__(self, fingerprint, row_key, field_names, cs_cache_entry):
+        self.fingerprint = fingerprint
+        self.row_key = row_key
+        self.field_names = field_names
+        self.cs_cache_entry = cs_cache_entry
+
+    # True if the cache still holds the entry this state was built for
+    def in_cache(self, cache, group, cache_key):
+        entry = cache.GetCacheEntry(group, cache_key)
+        return entry is not None and entry.CacheValue is self.cs_cache_entry
+
+
+incremental_loads = dict()
+change_sets = dict()
+
+
+def drop_incremental_state(group, cache_key):
+    incremental_loads.pop((group, cache_key), None)
+    change_sets.pop((group, cache_key), None)
+    key_indexes.pop((group, cache_key), None)
+
+
+# Public accessor for downstream code: the ChangeSet from the last
+# incremental load of group/cache_key, or None
+def last_change_set(group, cache_key):
+    return change_sets.get((group, cache_key))
+
+
+# Sorted key indexes for keyed cache entries. A KeyIndex holds the row
+# keys of an entry in sorted order, with a parallel list of row refs: the
+# key itself for dict entries, or the row index for columnar entries. Range,
+# as-of and last-N queries are then binary searches rather than scans of an
+# unordered hash map. Keys keep their native type: str keys, like yield.csv's
+# ISO dates, sort lexically, which is chronologically for ISO dates, and keys
+# from a double[] column sort numerically. Query bounds arrive as str from
+# ActionsDriver, so they're converted to the key type before comparing.
+# Rows with a missing key, null or NaN, can't be looked up so aren't indexed.
+# Indexes are built at load time by the csv loaders, and rebuilt lazily if the
+# cache entry has since been replaced.
+class KeyIndex(object):
+    def __init__(self, cs_cache_entry, keys, refs, key_type=str):
+        self.cs_cache_entry = cs_cache_entry
+        self.key_type = key_type
+        pairs = sorted((k, r) for k, r in zip(keys, refs) if k is not None and k == k)
+        self.keys = [k for k, r in pairs]
+        self.refs = [r for k, r in pairs]
+
+    # raises ValueError for a bound that isn't a valid key, eg "abc" for float keys
+    def key(self, bound):
+        return self.key_type(bound)
+
+    # refs for start <= key <= end; None means unbounded
+    def range(self, start=None, end=None):
+        lo = bisect_left(self.keys, self.key(start)) if start is not None else 0
+        hi = bisect_right(self.keys, self.key(end)) if end is not None else len(self.keys)
+        return self.refs[lo:hi]
+
+    # ref of the latest row with key <= as_of, or None
+    def as_of(self, as_of):
+        pos = bisect_right(self.keys, self.key(as_of))
+        return self.refs[pos - 1] if pos > 0 else None
+
+    def last(self, count):
+        return self.refs[-count:] if count > 0 else []
+
+
+key_indexes = dict()
+
+
+def make_key_index(cs_cache_entry, row_key, columnar):
+    if columnar:
+        cs_column = cs_cache_entry[row_key]
+        key_type = float if column_type_of(cs_column) == COLUMN_TYPE_FLOAT else str
+        return KeyIndex(cs_cache_entry, list(cs_column), range(len(cs_column)), key_type)
+    keys = list(cs_cache_entry.Keys)
+    return KeyIndex(cs_cache_entry, keys, keys)
+
+
+# Called by the loaders after inserting an entry; a no op for unkeyed entries
+def index_keyed_entry(group, cache_key, cs_cache_entry, row_key, columnar=False):
+    if row_key:
+        key_indexes[(group, cache_key)] = make_key_index(cs_cache_entry, row_key, columnar)
+
+
+# The KeyIndex and CacheEntry for group/cache_key, rebuilding the index if
+# the entry in the cache isn't the one it was built for. Returns None, None
+# if there's no keyed entry.
+def get_key_index(cache, group, cache_key):
+    entry = get_cache_entry(cache, group, cache_key)
+    if entry is None or not entry.RowKey:
+        return None, None
+    index = key_indexes.get((group, cache_key))
+    if index is None or index.cs_cache_entry is not entry.CacheValue:
+        columnar = str(entry.Type) == "ColumnarCSV"
+        index = make_key_index(entry.CacheValue, entry.RowKey, columnar)
+        key_indexes[(group, cache_key)] = index
+    return index, entry
+
+
 # Insert a CSV into the BizDeck cache as a dict
 # cache: supplied by ActionsDriver.RunPythonAction
 # group: supplied by json action object in action script eg "quandl"
@@ -118,33 +812,99 @@ def read_non_unique_key_rows(reader):
 # row_key: which field is used as the key field
 # headers: specify column order as IronPython DictReader doesn't maintain order from csv
 # max_lines: cap the number of lines to read, handy if latest at top
+# read_mode: "head" (default) reads max_lines from the top of the file,
+#            "tail" reads max_lines from the bottom, handy if latest at end
+# incremental: if true, and row_key is set, fingerprint the file so the
+#            next load only parses prepended or appended rows. The keys
+#            added, changed and removed are available from last_change_set
+# encode_strings: if true, dictionary encode low cardinality columns so
+#            repeated values share one string. Memory saved is logged, and
+#            available from last_encoding_stats
+# schema: "use" to save a sidecar schema on first load and check the csv
+#            header against it on later loads, failing on drift. "refresh"
+#            to reinfer the schema. Only for csvs with a header row.
 class AddCsvToCacheAsDict(ActionFunction):
-    def implementation(self, cache, group, csv, row_key=None, headers=None):
-        print("enter impl")
+    def implementation(self, cache, group, csv, row_key=None, headers=None, max_lines=None,
+                       read_mode="head", incremental=False, encode_strings=False, schema=None):
         csv_path = os.path.join(BDRoot, 'data', 'csv', csv)
         cs_cache_entry = None
         field_names = None
-        with open(csv_path, "rt") as csv_file:
-            reader = DictReader(csv_file, headers)
-            field_names = reader.fieldnames
-            if row_key:
-                cs_cache_entry = read_unique_key_rows(reader, row_key)
+        # ActionsDriver.RunPythonAction passes all params as strings
+        if max_lines is not None:
+            max_lines = int(max_lines)
+        error = check_read_mode(self, read_mode)
+        if error:
+            return error
+        csv_schema, error = check_schema(self, csv_path, schema)
+        if error:
+            return error
+        if as_bool(incremental) and row_key:
+            if csv_schema or read_mode != "head":
+                # merged rows would skip the schema checks, so full load
+                Logger.Warn("%s: incremental ignored with schema or read_mode(%s) for %s" % (
+                    self.__class__.__name__, read_mode, csv))
+                drop_incremental_state(group, csv_cache_key(csv))
             else:
-                cs_cache_entry = read_non_unique_key_rows(reader)
-        # csv_file_name will be eg yield.csv; no good as a JSON
-        # property name as it looks like a member reference. So
-        # change the . to _
-        cache_key = csv.replace('.', '_')
+                if max_lines is not None:
+                    Logger.Warn("%s: max_lines ignored for incremental load of %s" % (self.__class__.__name__, csv))
+                return self.incremental_load(cache, group, csv, csv_path, row_key, headers,
+                                             make_encoder(encode_strings))
+        encoder = make_encoder(encode_strings)
+        cs_cache_entry, field_names = load_csv_as_dict(csv_path, row_key, headers, max_lines, read_mode,
+                                                       encoder, csv_schema)
         # Return correctly ordered column names as last parameter
         # Prefer the DictReader field_names to headers, which may
         # not be provided. If the csv has no headers field_names
         # will be [] or None, and headers should have been supplied
-        py_column_names = field_names or headers
-        column_names = List[str]()
-        for name in py_column_names:
-            # some csv files have spaces in field names
-            column_names.Add(name.replace(' ', ''))
-        cache.Insert(group, cache_key, cs_cache_entry, row_key, column_names)
+        column_names = make_column_names(field_names or headers)
+        insert_rows(cache, group, csv_cache_key(csv), cs_cache_entry, row_key, column_names, csv_path)
+        index_keyed_entry(group, csv_cache_key(csv), cs_cache_entry, row_key)
+        report_encoding(self, group, csv_cache_key(csv), encoder)
+        return ""
+
+    def incremental_load(self, cache, group, csv, csv_path, row_key, headers, encoder=None):
+        cache_key = csv_cache_key(csv)
+        new_fp = CsvFingerprint(csv_path)
+        old_state = incremental_loads.get((group, cache_key))
+        if old_state and not old_state.in_cache(cache, group, cache_key):
+            # evicted, reset or replaced by another load since, so the
+            # state no longer describes what clients see
+            Logger.Info("%s: %s no longer cached, full load" % (self.__class__.__name__, csv))
+            drop_incremental_state(group, cache_key)
+            old_state = None
+        if old_state and old_state.row_key == row_key:
+            if new_fp.unchanged(old_state.fingerprint):
+                # nothing to do, and no need to broadcast an Insert
+                change_sets[(group, cache_key)] = ChangeSet(incremental=True)
+                Logger.Info("%s: %s unchanged" % (self.__class__.__name__, csv))
+                return ""
+            new_range = find_new_rows_range(csv_path, old_state.fingerprint, new_fp)
+        else:
+            new_range = None
+        if new_range:
+            field_names = old_state.field_names
+            lines = read_byte_range_lines(csv_path, new_range[0], new_range[1])
+            new_rows = read_unique_key_rows(DictReader(lines, field_names), row_key, encoder)
+            cs_cache_entry, change_set = merge_keyed_rows(old_state.cs_cache_entry, new_rows)
+        else:
+            with open(csv_path, "rt") as csv_file:
+                reader = DictReader(csv_file, headers)
+                field_names = reader.fieldnames or headers
+                cs_cache_entry = read_unique_key_rows(reader, row_key, encoder)
+            if old_state:
+                change_set = diff_keyed_rows(old_state.cs_cache_entry, cs_cache_entry)
+            else:
+                change_set = ChangeSet(added=list(cs_cache_entry.Keys))
+        if change_set.is_empty() and old_state:
+            # same rows, so keep the entry that's in the cache
+            cs_cache_entry = old_state.cs_cache_entry
+        incremental_loads[(group, cache_key)] = IncrementalLoadState(new_fp, row_key, field_names, cs_cache_entry)
+        change_sets[(group, cache_key)] = change_set
+        Logger.Info("%s: %s %s" % (self.__class__.__name__, csv, change_set))
+        if not change_set.is_empty() or not old_state:
+            insert_rows(cache, group, cache_key, cs_cache_entry, row_key, make_column_names(field_names), csv_path)
+            index_keyed_entry(group, cache_key, cs_cache_entry, row_key)
+            report_encoding(self, group, cache_key, encoder)
         return ""
 
 
@@ -153,6 +913,2007 @@ param_specs1 = [
     ('group', str, False),
     ('csv', str, False),
     ('row_key', str, True),
-    ('headers', List, True)
+    ('headers', List, True),
+    # no type check as max_lines arrives as str from
+    # ActionsDriver, but as int from unit tests
+    ('max_lines', None, True),
+    ('read_mode', str, True),
+    ('incremental', None, True),
+    ('encode_strings', None, True),
+    ('schema', str, True)
 ]
 add_csv_to_cache_as_dict = AddCsvToCacheAsDict(param_specs1)
+
+
+# Insert a CSV into the BizDeck cache as typed columns, alongside the
+# dict of dicts entries AddCsvToCacheAsDict creates. Params are the same
+# as for AddCsvToCacheAsDict. row_key is optional, and is recorded so the
+# C# CacheEntry can use the key column values as row keys. With a schema
+# the column types come from it, and cells are checked against it.
+class AddCsvToCacheAsColumns(ActionFunction):
+    def implementation(self, cache, group, csv, row_key=None, headers=None, max_lines=None,
+                       read_mode="head", encode_strings=False, schema=None):
+        csv_path = os.path.join(BDRoot, 'data', 'csv', csv)
+        if max_lines is not None:
+            max_lines = int(max_lines)
+        error = check_read_mode(self, read_mode)
+        if error:
+            return error
+        csv_schema, error = check_schema(self, csv_path, schema)
+        if error:
+            return error
+        encoder = make_encoder(encode_strings)
+        try:
+            cs_cache_entry, field_names, column_types = load_csv_as_columns(
+                csv_path, headers, max_lines, read_mode, encoder, csv_schema)
+        except ValueError as ex:
+            # cells that don't fit the schema
+            error = "%s: %s %s" % (self.__class__.__name__, csv, ex)
+            Logger.Error(error)
+            return error
+        # the key column is named as the cache names it: no whitespace
+        if row_key:
+            row_key = row_key.replace(' ', '')
+            if row_key not in column_types:
+                error = "%s: row_key(%s) not in %s" % (self.__class__.__name__, row_key, csv)
+                Logger.Error(error)
+                return error
+        Logger.Info("%s: %s column types %s" % (self.__class__.__name__, csv, column_types))
+        column_names = make_column_names(field_names)
+        insert_columns(cache, group, csv_cache_key(csv), cs_cache_entry, row_key, column_names, csv_path)
+        index_keyed_entry(group, csv_cache_key(csv), cs_cache_entry, row_key, True)
+        report_encoding(self, group, csv_cache_key(csv), encoder)
+        return ""
+
+
+param_specs2 = [
+    ('cache', None, False),
+    ('group', str, False),
+    ('csv', str, False),
+    ('row_key', str, True),
+    ('headers', List, True),
+    ('max_lines', None, True),
+    ('read_mode', str, True),
+    ('encode_strings', None, True),
+    ('schema', str, True)
+]
+add_csv_to_cache_as_columns = AddCsvToCacheAsColumns(param_specs2)
+
+
+# Resolve the csvs param of AddCsvGroupToCache to a list of file names in
+# data/csv. ActionsDriver passes a JSON array param as its JSON text, so
+# csvs may be that text, a list, or a glob pattern like "ds*.csv"
+def resolve_csv_names(csvs):
+    if isinstance(csvs, str):
+        text = csvs.strip()
+        if not text.startswith('['):
+            csv_dir = os.path.join(BDRoot, 'data', 'csv')
+            return sorted(os.path.basename(p) for p in glob.glob(os.path.join(csv_dir, text)))
+        csvs = json.loads(text)
+    return [str(csv) for csv in csvs]
+
+
+# Load several csvs from data/csv into one cache group. The files are parsed
+# concurrently on a thread pool; IronPython has no GIL so the parses really
+# do run in parallel. Successfully parsed files are inserted in one batch
+# once all parsing is done, so the GUI sees one cache update, and errors
+# are reported per file. Cache keys are derived from file names as usual.
+# csvs: list of csv file names, or a glob pattern, eg "d*.csv"
+# entry_type: "dict" (default) for AddCsvToCacheAsDict style entries, or
+#             "columns" for AddCsvToCacheAsColumns style entries
+# max_workers: thread pool size, defaults to one per file up to cpu count
+# row_key, max_lines, read_mode, encode_strings: as for AddCsvToCacheAsDict,
+#            applied to all
+class AddCsvGroupToCache(ActionFunction):
+    def implementation(self, cache, group, csvs, row_key=None, entry_type="dict",
+                       max_workers=None, max_lines=None, read_mode="head", encode_strings=False):
+        csv_names = resolve_csv_names(csvs)
+        if not csv_names:
+            error = "%s: no csvs match %s" % (self.__class__.__name__, csvs)
+            Logger.Error(error)
+            return error
+        if entry_type not in ("dict", "columns"):
+            error = "%s: bad entry_type(%s)" % (self.__class__.__name__, entry_type)
+            Logger.Error(error)
+            return error
+        error = check_read_mode(self, read_mode)
+        if error:
+            return error
+        if max_lines is not None:
+            max_lines = int(max_lines)
+        if max_workers is not None:
+            max_workers = int(max_workers)
+        else:
+            max_workers = min(len(csv_names), os.cpu_count() or 4)
+        # the key column is named as the cache names it: no whitespace
+        if row_key and entry_type == "columns":
+            row_key = row_key.replace(' ', '')
+
+        # an encoder per file, as the pools aren't thread safe
+        def parse_csv(csv):
+            csv_path = os.path.join(BDRoot, 'data', 'csv', csv)
+            encoder = make_encoder(encode_strings)
+            if entry_type == "columns":
+                cs_cache_entry, field_names, column_types = load_csv_as_columns(
+                    csv_path, None, max_lines, read_mode, encoder)
+                if row_key and row_key not in column_types:
+                    raise KeyError("row_key(%s) not in columns" % row_key)
+            else:
+                cs_cache_entry, field_names = load_csv_as_dict(csv_path, row_key, None, max_lines, read_mode, encoder)
+            return cs_cache_entry, field_names, encoder
+
+        start = time.time()
+        parsed = []
+        errors = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [(csv, executor.submit(parse_csv, csv)) for csv in csv_names]
+            for csv, future in futures:
+                try:
+                    parsed.append((csv, future.result()))
+                except Exception as ex:
+                    errors.append("%s: %s" % (csv, ex))
+                    Logger.Error("%s: %s failed %s" % (self.__class__.__name__, csv, ex))
+        for csv, (cs_cache_entry, field_names, encoder) in parsed:
+            column_names = make_column_names(field_names)
+            csv_path = os.path.join(BDRoot, 'data', 'csv', csv)
+            if entry_type == "columns":
+                insert_columns(cache, group, csv_cache_key(csv), cs_cache_entry, row_key, column_names, csv_path)
+            else:
+                insert_rows(cache, group, csv_cache_key(csv), cs_cache_entry, row_key, column_names, csv_path)
+            index_keyed_entry(group, csv_cache_key(csv), cs_cache_entry, row_key, entry_type == "columns")
+            report_encoding(self, group, csv_cache_key(csv), encoder)
+        Logger.Info("%s: loaded %d of %d csvs into %s with %d workers in %.3fs" % (
+            self.__class__.__name__, len(parsed), len(csv_names), group, max_workers, time.time() - start))
+        if errors:
+            return "%s: %s" % (self.__class__.__name__, "; ".join(errors))
+        return ""
+
+
+param_specs3 = [
+    ('cache', None, False),
+    ('group', str, False),
+    # no type check: csvs may be a list, JSON text or a glob
+    ('csvs', None, False),
+    ('row_key', str, True),
+    ('entry_type', str, True),
+    ('max_workers', None, True),
+    ('max_lines', None, True),
+    ('read_mode', str, True),
+    ('encode_strings', None, True)
+]
+add_csv_group_to_cache = AddCsvGroupToCache(param_specs3)
+
+
+# Parquet and Arrow IPC loading. Wide numeric tables are much smaller and
+# faster to read as columnar files than as csv, and we only need to read
+# the columns and row groups we want. Under IronPython the files are
+# decoded by BizDeck.ColumnarFileReader in BizDeckLib, with the Parquet.Net
+# and Apache.Arrow packages, straight into the .Net arrays of a columnar
+# entry. Under CPython we use pyarrow, if it's installed.
+PARQUET_SUFFIXES = (".parquet", ".pq")
+ARROW_SUFFIXES = (".arrow", ".feather", ".ipc")
+
+try:
+    import clr
+    clr.AddReference("BizDeckLib")
+    from BizDeck import ColumnarFileReader
+except Exception:
+    # CPython, or no BizDeckLib
+    ColumnarFileReader = None
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+def read_columnar_file_dotnet(path, columns, row_groups):
+    cs_columns = List[str]()
+    for name in columns or []:
+        cs_columns.Add(name)
+    cs_row_groups = List[int]()
+    for group in row_groups or []:
+        cs_row_groups.Add(group)
+    if path.lower().endswith(PARQUET_SUFFIXES):
+        return ColumnarFileReader.ReadParquet(path, cs_columns, cs_row_groups)
+    return ColumnarFileReader.ReadArrow(path, cs_columns, cs_row_groups)
+
+
+def read_columnar_file_pyarrow(path, columns, row_groups):
+    if path.lower().endswith(PARQUET_SUFFIXES):
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        groups = row_groups if row_groups else range(parquet_file.num_row_groups)
+        table = parquet_file.read_row_groups(list(groups), columns=columns or None)
+    else:
+        reader = pyarrow.ipc.open_file(path)
+        batches = row_groups if row_groups else range(reader.num_record_batches)
+        table = pyarrow.Table.from_batches([reader.get_batch(b) for b in batches], schema=reader.schema)
+        if columns:
+            table = table.select(columns)
+    cs_cache_entry = Dictionary[str, Array]()
+    for name in table.column_names:
+        arrow_type = table.schema.field(name).type
+        values = table.column(name).to_pylist()
+        if pyarrow.types.is_floating(arrow_type) or pyarrow.types.is_integer(arrow_type):
+            cs_cache_entry.Add(name, Array[float]([MISSING_FLOAT if v is None else float(v) for v in values]))
+        elif pyarrow.types.is_date(arrow_type):
+            cs_cache_entry.Add(name, Array[str]([None if v is None else v.isoformat() for v in values]))
+        else:
+            cs_cache_entry.Add(name, Array[str]([None if v is None else str(v) for v in values]))
+    return cs_cache_entry
+
+
+def read_columnar_file(path, columns, row_groups):
+    if not path.lower().endswith(PARQUET_SUFFIXES + ARROW_SUFFIXES):
+        raise ValueError("%s is not a Parquet or Arrow IPC file" % path)
+    if ColumnarFileReader is not None:
+        return read_columnar_file_dotnet(path, columns, row_groups)
+    if pyarrow is not None:
+        return read_columnar_file_pyarrow(path, columns, row_groups)
+    raise ImportError("no Parquet/Arrow reader: needs BizDeckLib under IronPython, or pyarrow under CPython")
+
+
+# Convert a columnar entry to the dict of dicts or list of dicts layouts
+# AddCsvToCacheAsDict makes, with cells as csv style strings
+def columns_to_rows(cs_columns, names, row_key):
+    count = cs_columns[names[0]].Length if names else 0
+    text_columns = []
+    for name in names:
+        cs_column = cs_columns[name]
+        if column_type_of(cs_column) == COLUMN_TYPE_FLOAT:
+            text_columns.append([repr(v) if not math.isnan(v) else "" for v in cs_column])
+        else:
+            text_columns.append([v if v is not None else "" for v in cs_column])
+    rows = []
+    for index in range(count):
+        cs_row_dict = Dictionary[str, str]()
+        for name, text_column in zip(names, text_columns):
+            cs_row_dict.Add(name.replace(' ', ''), text_column[index])
+        rows.append(cs_row_dict)
+    if row_key:
+        cs_cache_entry = Dictionary[str, Dictionary[str, str]]()
+        for cs_row_dict in rows:
+            key_value = cs_row_dict[row_key.replace(' ', '')]
+            if cs_cache_entry.ContainsKey(key_value):
+                Logger.Error('columns_to_rows: duplicate key[%s]' % key_value)
+            else:
+                cs_cache_entry.Add(key_value, cs_row_dict)
+        return cs_cache_entry
+    cs_cache_entry = List[Dictionary[str, str]]()
+    for cs_row_dict in rows:
+        cs_cache_entry.Add(cs_row_dict)
+    return cs_cache_entry
+
+
+# Load a Parquet or Arrow IPC file from data into the cache. The sibling of
+# AddCsvToCacheAsDict and AddCsvToCacheAsColumns, with the same semantics
+# for group, cache keys derived from the file name, and row_key.
+# file: path relative to data, eg parquet/yield.parquet
+# headers: the columns to read, in the order wanted; all by default. The
+#          row_key column is always read.
+# row_groups: the Parquet row groups, or Arrow record batches, to read as
+#          a list or JSON text; all by default
+# entry_type: "columns" (default) for a columnar entry, which needs no
+#          marshalling, or "dict" for AddCsvToCacheAsDict style rows
+class AddColumnarFileToCache(ActionFunction):
+    def implementation(self, cache, group, file, row_key=None, headers=None,
+                       row_groups=None, entry_type="columns"):
+        path = os.path.join(BDRoot, 'data', file)
+        if entry_type not in ("dict", "columns"):
+            error = "%s: bad entry_type(%s)" % (self.__class__.__name__, entry_type)
+            Logger.Error(error)
+            return error
+        if isinstance(headers, str):
+            headers = json.loads(headers)
+        if isinstance(row_groups, str):
+            row_groups = json.loads(row_groups)
+        columns = [str(h) for h in headers] if headers else None
+        if columns and row_key and row_key not in columns:
+            columns.insert(0, row_key)
+        start = time.time()
+        try:
+            cs_columns = read_columnar_file(path, columns, [int(g) for g in row_groups or []])
+        except Exception as ex:
+            error = "%s: %s" % (self.__class__.__name__, ex)
+            Logger.Error(error)
+            return error
+        names = [name for name in cs_columns.Keys]
+        if columns:
+            names = columns
+        if row_key and row_key not in names:
+            error = "%s: row_key(%s) not in %s" % (self.__class__.__name__, row_key, file)
+            Logger.Error(error)
+            return error
+        cache_key = csv_cache_key(os.path.basename(file))
+        column_names = make_column_names(names)
+        if entry_type == "columns":
+            cs_cache_entry = Dictionary[str, Array]()
+            for name in names:
+                cs_cache_entry.Add(name.replace(' ', ''), cs_columns[name])
+            row_key = row_key and row_key.replace(' ', '')
+            insert_columns(cache, group, cache_key, cs_cache_entry, row_key, column_names, path)
+        else:
+            cs_cache_entry = columns_to_rows(cs_columns, names, row_key)
+            row_key = row_key and row_key.replace(' ', '')
+            insert_rows(cache, group, cache_key, cs_cache_entry, row_key, column_names, path)
+        index_keyed_entry(group, cache_key, cs_cache_entry, row_key, entry_type == "columns")
+        Logger.Info("%s: loaded %d columns of %s into %s/%s in %.3fs" % (
+            self.__class__.__name__, len(names), file, group, cache_key, time.time() - start))
+        return ""
+
+
+param_specs9 = [
+    ('cache', None, False),
+    ('group', str, False),
+    ('file', str, False),
+    ('row_key', str, True),
+    # no type check: headers and row_groups may be lists or JSON text
+    ('headers', None, True),
+    ('row_groups', None, True),
+    ('entry_type', str, True)
+]
+add_columnar_file_to_cache = AddColumnarFileToCache(param_specs9)
+
+
+# Streaming JSON loading from data/json. Upstream APIs return big JSON
+# arrays of records, or NDJSON with one record per line. We decode one
+# record at a time from a buffer that's topped up a chunk at a time, and
+# flatten each record into a C# row dict as soon as it's decoded, so only
+# one parsed record is held at once, and peak memory is the cache entry
+# plus a chunk, however big the file.
+JSON_CHUNK_SIZE = 65536
+JSON_WHITESPACE = " \t\r\n"
+
+
+class JsonRecordStream(object):
+    def __init__(self, json_file, chunk_size=None):
+        self.json_file = json_file
+        self.chunk_size = chunk_size or JSON_CHUNK_SIZE
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    # Top up the buffer, dropping what's been consumed. False at EOF.
+    def fill(self):
+        if self.eof:
+            return False
+        chunk = self.json_file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    # The next non whitespace char, without consuming it, or None at EOF
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in JSON_WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return None
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError("expected %s at %s" % (char, self.where()))
+        self.pos += 1
+
+    def where(self):
+        return repr(self.buffer[self.pos:self.pos + 20])
+
+    # Decode the value at pos. A value that ends at the end of the buffer
+    # may be truncated, eg a number, so unless we're at EOF we top up and
+    # decode again.
+    def decode(self):
+        # raw_decode doesn't skip leading whitespace
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise ValueError("bad JSON at %s" % self.where())
+            self.fill()
+
+    def array_records(self):
+        self.expect('[')
+        if self.peek() == ']':
+            return
+        while True:
+            yield self.decode()
+            char = self.peek()
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError("expected , or ] at %s" % self.where())
+            self.pos += 1
+
+    def ndjson_records(self):
+        while self.peek() is not None:
+            yield self.decode()
+
+    def records(self):
+        if self.peek() == '[':
+            return self.array_records()
+        return self.ndjson_records()
+
+
+# Text for a JSON value in a row dict, as it would be in a csv
+def json_cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float):
+        return repr(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+
+# fields maps column names to paths of keys into a record, eg
+# {"Close": ["price", "close"]}. Without fields, nested objects are
+# flattened with _ joined names, eg price_close, and all are taken.
+def flatten_record(record, fields, prefix=""):
+    if fields is not None:
+        flat = []
+        for name, path in fields:
+            value = record
+            for key in path:
+                value = value.get(key) if isinstance(value, dict) else None
+            flat.append((name, value))
+        return flat
+    flat = []
+    for key, value in record.items():
+        name = prefix + key
+        if isinstance(value, dict):
+            flat.extend(flatten_record(value, None, name + "_"))
+        else:
+            flat.append((name, value))
+    return flat
+
+
+# fields param: a list of dotted paths, or an object of column name to
+# dotted path, as a list, dict or JSON text. Returns (name, path) pairs.
+def parse_json_fields(fields):
+    if fields is None:
+        return None
+    if isinstance(fields, str):
+        fields = json.loads(fields)
+    if isinstance(fields, dict):
+        pairs = list(fields.items())
+    else:
+        pairs = [(path.replace('.', '_'), path) for path in fields]
+    return [(name, path.split('.')) for name, path in pairs]
+
+
+def read_json_rows(records, fields, row_key, encoder=None):
+    if row_key:
+        cs_cache_entry = Dictionary[str, Dictionary[str, str]]()
+    else:
+        cs_cache_entry = List[Dictionary[str, str]]()
+    # column names in first seen order
+    names = dict((name.replace(' ', ''), None) for name, path in fields) if fields else dict()
+    for record in records:
+        if not isinstance(record, dict):
+            raise ValueError("record %s is not an object" % json_cell(record)[:40])
+        cs_row_dict = Dictionary[str, str]()
+        for name, value in flatten_record(record, fields):
+            # remove whitespace from names, as for csv field names
+            name = name.replace(' ', '')
+            cell = json_cell(value)
+            if encoder:
+                cell = encoder.encode(name, cell)
+            if name not in names:
+                names[name] = None
+            cs_row_dict[name] = cell
+        if not row_key:
+            cs_cache_entry.Add(cs_row_dict)
+            continue
+        key_value = cs_row_dict[row_key] if cs_row_dict.ContainsKey(row_key) else ""
+        if cs_cache_entry.ContainsKey(key_value):
+            Logger.Error('read_json_rows: duplicate key[%s]' % key_value)
+        else:
+            cs_cache_entry.Add(key_value, cs_row_dict)
+    return cs_cache_entry, list(names)
+
+
+# Load a JSON array of records, or NDJSON, from data/json into the cache,
+# as the same keyed or list entries AddCsvToCacheAsDict makes from a csv.
+# file: name of the file in data/json. Used to derive the cache_key
+# row_key: which field is used as the key field
+# fields: the columns to take, as a list of dotted paths into each record,
+#         eg ["date", "price.close"], named date and price_close, or an
+#         object of column name to path, eg {"Close": "price.close"}. By
+#         default all fields are taken, with nested objects flattened.
+# encode_strings: as for AddCsvToCacheAsDict
+class AddJsonToCache(ActionFunction):
+    def implementation(self, cache, group, file, row_key=None, fields=None, encode_strings=False):
+        json_path = os.path.join(BDRoot, 'data', 'json', file)
+        start = time.time()
+        encoder = make_encoder(encode_strings)
+        try:
+            json_fields = parse_json_fields(fields)
+            with io.open(json_path, "rt", encoding="utf-8") as json_file:
+                records = JsonRecordStream(json_file).records()
+                cs_cache_entry, names = read_json_rows(records, json_fields, row_key, encoder)
+        except (IOError, ValueError) as ex:
+            error = "%s: %s %s" % (self.__class__.__name__, file, ex)
+            Logger.Error(error)
+            return error
+        if row_key and row_key not in names:
+            error = "%s: row_key(%s) not in %s" % (self.__class__.__name__, row_key, file)
+            Logger.Error(error)
+            return error
+        cache_key = csv_cache_key(file)
+        insert_rows(cache, group, cache_key, cs_cache_entry, row_key, make_column_names(names), json_path)
+        index_keyed_entry(group, cache_key, cs_cache_entry, row_key)
+        report_encoding(self, group, cache_key, encoder)
+        Logger.Info("%s: loaded %d records from %s into %s/%s in %.3fs" % (
+            self.__class__.__name__, cs_cache_entry.Count, file, group, cache_key, time.time() - start))
+        return ""
+
+
+param_specs10 = [
+    ('cache', None, False),
+    ('group', str, False),
+    ('file', str, False),
+    ('row_key', str, True),
+    # no type check: fields may be a list, dict or JSON text
+    ('fields', None, True),
+    ('encode_strings', None, True)
+]
+add_json_to_cache = AddJsonToCache(param_specs10)
+
+
+# Concurrent streaming downloads into the cache
+
+SECRETS_PREFIX = "secrets."
+
+
+# Expand a download url with the url template from http_formats.json whose
+# key occurs in it, as ActionsDriver.BuildHttpRequest does for http_get.
+# Template values are resolved from the download spec, eg "url", or from
+# the secrets, eg "secrets.quandl.auth_token". Returns url, error.
+def expand_http_url(url, download):
+    if not HttpFormatMap:
+        return url, None
+    for url_sub_string in HttpFormatMap.Keys:
+        spec_map = HttpFormatMap[url_sub_string]
+        if url_sub_string not in url or not spec_map.ContainsKey("url"):
+            continue
+        http_format = spec_map["url"]
+        values = []
+        for val_ref in http_format.Values:
+            secret_key = val_ref[len(SECRETS_PREFIX):]
+            if val_ref in download:
+                values.append(download[val_ref])
+            elif val_ref.startswith(SECRETS_PREFIX) and Secrets and Secrets.ContainsKey(secret_key):
+                values.append(Secrets[secret_key])
+            else:
+                return None, "unresolved %s in %s" % (val_ref, url_sub_string)
+        return http_format.Format.format(*values), None
+    return url, None
+
+
+# Hands out one semaphore per host, so we can cap concurrent
+# connections to any one host below the overall pool size
+class HostLimiter(object):
+    def __init__(self, max_per_host):
+        self.max_per_host = max_per_host
+        self.lock = threading.Lock()
+        self.semaphores = dict()
+
+    def semaphore(self, host):
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self.semaphores[host]
+
+
+# Iterate the text lines of a streaming response, optionally copying
+# each line to a file as it goes past, so we parse while downloading
+class TeeLineReader(object):
+    def __init__(self, text_stream, tee_file=None):
+        self.text_stream = text_stream
+        self.tee_file = tee_file
+
+    def __iter__(self):
+        for line in self.text_stream:
+            if self.tee_file:
+                self.tee_file.write(line)
+            yield line
+
+
+HTTP_REDIRECTS = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+
+
+# Keep alive HTTP connections for DownloadCsvsToCache. Each worker thread
+# keeps one connection per host, and reuses it for all the downloads it
+# runs from that host, so we pay the TCP and TLS handshakes once per host
+# per worker rather than once per download. HostLimiter bounds how many
+# workers use a host at once, so at most max_per_host connections to any
+# host are busy.
+class ConnectionPool(object):
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+        self.requests = 0
+
+    def connection(self, scheme, netloc):
+        by_host = getattr(self.local, "by_host", None)
+        if by_host is None:
+            by_host = self.local.by_host = dict()
+        conn = by_host.get((scheme, netloc))
+        if conn is None:
+            conn_type = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            conn = by_host[(scheme, netloc)] = conn_type(netloc, timeout=self.timeout)
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    # GET url, following redirects, and return the response for the
+    # caller to read to the end, which frees the connection for reuse.
+    # Raises IOError for anything but a 200.
+    def get(self, url):
+        for redirect in range(MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            conn = self.connection(parts.scheme, parts.netloc)
+            path = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+            response = self.request(conn, path)
+            if response.status in HTTP_REDIRECTS and response.getheader("Location"):
+                response.read()
+                url = urljoin(url, response.getheader("Location"))
+                continue
+            if response.status != 200:
+                response.read()
+                raise IOError("HTTP Error %d: %s" % (response.status, response.reason))
+            return response
+        raise IOError("more than %d redirects" % MAX_REDIRECTS)
+
+    def request(self, conn, path):
+        with self.lock:
+            self.requests += 1
+        # the server may have closed a kept alive connection since we last
+        # used it, so retry those once on a fresh connection
+        reused = conn.sock is not None
+        try:
+            conn.request("GET", path)
+            return conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            if not reused:
+                raise
+            conn.request("GET", path)
+            return conn.getresponse()
+
+    def close(self):
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+
+
+# requests and connections opened by the last download_csvs_to_cache run
+# into each group, and the public accessor for them
+download_stats = dict()
+
+
+def last_download_stats(group):
+    return download_stats.get(group)
+
+
+# Download one csv, parsing it as it streams in. If save_path is set the
+# csv is also written there, via a .part file so a failed download never
+# leaves a truncated csv behind for other actions to load.
+def stream_csv_to_entry(pool, url, row_key, save_path=None):
+    response = pool.get(url)
+    tee_file = None
+    try:
+        if save_path:
+            tee_file = open(save_path + ".part", "wt", newline='')
+        text_stream = io.TextIOWrapper(response, encoding='utf-8', newline='')
+        reader = DictReader(TeeLineReader(text_stream, tee_file))
+        if row_key:
+            cs_cache_entry = read_unique_key_rows(reader, row_key)
+        else:
+            cs_cache_entry = read_non_unique_key_rows(reader)
+        field_names = reader.fieldnames
+    finally:
+        response.close()
+        if tee_file:
+            tee_file.close()
+    if save_path:
+        os.replace(save_path + ".part", save_path)
+    return cs_cache_entry, field_names
+
+
+# Download a set of csvs concurrently, parsing each response into a cache
+# entry as it streams in, rather than saving to disk with http_get and
+# rereading with add_csv_to_cache_as_dict. Entries are inserted into the
+# cache in one batch when all downloads are done, and errors are reported
+# per download.
+# downloads: list of objects with url and target fields, as for http_get.
+#            target names the cache key, and the saved file if save_files.
+#            urls are expanded with cfg/http_formats.json, as for http_get
+# row_key: as for AddCsvToCacheAsDict
+# max_connections: worker threads, so the cap on concurrent downloads,
+#            default 8. Each worker keeps a keep alive connection per host,
+#            reused for its later downloads from that host
+# max_per_host: cap on concurrent downloads from one host, default 4
+# timeout: socket timeout in seconds, default 30
+# save_files: if true also save each csv to data/csv/<target>
+class DownloadCsvsToCache(ActionFunction):
+    def implementation(self, cache, group, downloads, row_key=None, max_connections=8,
+                       max_per_host=4, timeout=30, save_files=False):
+        if isinstance(downloads, str):
+            downloads = json.loads(downloads)
+        save_files = as_bool(save_files)
+        pool = ConnectionPool(float(timeout))
+        host_limiter = HostLimiter(int(max_per_host))
+        csv_dir = os.path.join(BDRoot, 'data', 'csv')
+        if save_files and not os.path.exists(csv_dir):
+            os.makedirs(csv_dir)
+
+        def download_csv(download):
+            url, error = expand_http_url(download["url"].strip(), download)
+            if error:
+                raise ValueError(error)
+            save_path = os.path.join(csv_dir, download["target"]) if save_files else None
+            with host_limiter.semaphore(urlsplit(url).netloc):
+                return stream_csv_to_entry(pool, url, row_key, save_path)
+
+        start = time.time()
+        loaded = []
+        errors = []
+        with ThreadPoolExecutor(max_workers=int(max_connections)) as executor:
+            futures = [(d, executor.submit(download_csv, d)) for d in downloads]
+            for download, future in futures:
+                try:
+                    loaded.append((download["target"], future.result()))
+                except Exception as ex:
+                    # NB log the unexpanded url, as the expanded one may hold secrets
+                    errors.append("%s: %s" % (download.get("url"), ex))
+                    Logger.Error("%s: %s failed %s" % (self.__class__.__name__, download.get("url"), ex))
+        pool.close()
+        download_stats[group] = dict(requests=pool.requests, connections=len(pool.connections))
+        for target, (cs_cache_entry, field_names) in loaded:
+            # saved files are the source for snapshot fingerprints
+            source = os.path.join(csv_dir, target) if save_files else None
+            insert_rows(cache, group, csv_cache_key(target), cs_cache_entry, row_key,
+                        make_column_names(field_names), source)
+            index_keyed_entry(group, csv_cache_key(target), cs_cache_entry, row_key)
+        Logger.Info("%s: loaded %d of %d downloads into %s in %.3fs, %d requests on %d connections" % (
+            self.__class__.__name__, len(loaded), len(downloads), group, time.time() - start,
+            pool.requests, len(pool.connections)))
+        if errors:
+            return "%s: %s" % (self.__class__.__name__, "; ".join(errors))
+        return ""
+
+
+param_specs4 = [
+    ('cache', None, False),
+    ('group', str, False),
+    # no type check: downloads may be a list, or JSON text from ActionsDriver
+    ('downloads', None, False),
+    ('row_key', str, True),
+    ('max_connections', None, True),
+    ('max_per_host', None, True),
+    ('timeout', None, True),
+    ('save_files', None, True)
+]
+download_csvs_to_cache = DownloadCsvsToCache(param_specs4)
+
+
+# Reading cache entries back as typed columns
+
+# Fetch a cache entry as typed columns, whatever layout it was loaded with.
+# Columnar entries are returned as is; dict and list entries are converted
+# with the same type inference as AddCsvToCacheAsColumns. Returns columns,
+# row_key and headers, or None, None, None if the entry doesn't exist.
+def get_entry_columns(cache, group, cache_key):
+    entry = get_cache_entry(cache, group, cache_key)
+    if entry is None:
+        return None, None, None
+    headers = [h for h in entry.Headers]
+    entry_type = str(entry.Type)
+    if entry_type == "ColumnarCSV":
+        return entry.AsColumns, entry.RowKey, headers
+    rows = entry.AsDict.Values if entry_type == "PrimaryKeyCSV" else entry.AsList
+    columns = Dictionary[str, Array]()
+    for name in headers:
+        raw_column = [row[name] if row.ContainsKey(name) else None for row in rows]
+        columns.Add(name, to_cs_column(raw_column, infer_column_type(raw_column)))
+    return columns, entry.RowKey, headers
+
+
+# Yield curve bootstrapping
+
+TENOR_PATTERN = re.compile(r'^(\d+)(MO|YR)$')
+COUPON_FREQUENCY = 2    # US treasuries pay semi annual coupons
+
+
+# Map a treasury tenor column name like 1MO or 10YR to years
+def tenor_years(name):
+    match = TENOR_PATTERN.match(name.replace(' ', '').upper())
+    if not match:
+        return None
+    count = int(match.group(1))
+    return count / 12.0 if match.group(2) == "MO" else float(count)
+
+
+# Linear interpolation weights, with flat extrapolation, for time t given
+# sorted known_times. Returns k0, k1, w so that the interpolated value is
+# v[k0] + w * (v[k1] - v[k0])
+def interpolation_weights(known_times, t):
+    if t <= known_times[0]:
+        return 0, 0, 0.0
+    if t >= known_times[-1]:
+        last = len(known_times) - 1
+        return last, last, 0.0
+    k = 0
+    while known_times[k + 1] < t:
+        k += 1
+    t0, t1 = known_times[k], known_times[k + 1]
+    return k, k + 1, (t - t0) / (t1 - t0)
+
+
+# Interpolate par yields, in percent, onto target_times for every date.
+# Each date may quote a different set of tenors, eg no 30YR from 2002 to
+# 2006, so we group dates by the set of tenors they quote, work out the
+# interpolation weights once per group, and then apply them a target time
+# at a time across all the dates in the group. Returns one yield list per
+# target time, as decimals, with NaN for dates that quote nothing.
+def interpolate_par_yields(tenor_columns, target_times):
+    dates = len(tenor_columns[0][1])
+    quoted_groups = dict()
+    for d in range(dates):
+        quoted = tuple(i for i, (t, ys) in enumerate(tenor_columns) if not math.isnan(ys[d]))
+        quoted_groups.setdefault(quoted, []).append(d)
+    target_yields = [[MISSING_FLOAT] * dates for t in target_times]
+    for quoted, date_indices in quoted_groups.items():
+        if not quoted:
+            continue
+        quoted_times = [tenor_columns[i][0] for i in quoted]
+        for n, t in enumerate(target_times):
+            k0, k1, w = interpolation_weights(quoted_times, t)
+            ys0, ys1 = tenor_columns[quoted[k0]][1], tenor_columns[quoted[k1]][1]
+            yields = target_yields[n]
+            for d in date_indices:
+                yields[d] = (ys0[d] + w * (ys1[d] - ys0[d])) / 100.0
+    return target_yields
+
+
+# Bootstrap discount factors from treasury CMT par yields, in percent, for
+# every date at once. tenor_columns is a list of (years, yields) with one
+# yields array per tenor, sorted by years. Tenors under one coupon period
+# are bills, so DF = 1 / (1 + y * t). Longer tenors are par bonds paying
+# semi annual coupons, bootstrapped on a semi annual grid with par yields
+# interpolated linearly between the quoted tenors for each date:
+#   DF(t_n) = (1 - c_n / 2 * sum(DF(t_i), i < n)) / (1 + c_n / 2)
+# The bootstrap runs a grid point at a time across all dates, carrying a
+# running sum of DFs per date, so it's one pass over the grid with array
+# sized steps. Returns one DF list per tenor. Dates with no yields at all
+# get NaN throughout.
+def bootstrap_discount_factors(tenor_columns):
+    period = 1.0 / COUPON_FREQUENCY
+    grid_count = max(int(round(tenor_columns[-1][0] / period)), 1)
+    grid_times = [period * (n + 1) for n in range(grid_count)]
+    bill_times = [t for t, ys in tenor_columns if t < period]
+    target_yields = interpolate_par_yields(tenor_columns, grid_times + bill_times)
+    grid_yields, bill_yields = target_yields[:grid_count], target_yields[grid_count:]
+    # bootstrap a grid point at a time across all dates
+    grid_dfs = []
+    running = [0.0] * len(tenor_columns[0][1])
+    for yields in grid_yields:
+        half_coupons = [c * period for c in yields]
+        dfs = [(1.0 - h * r) / (1.0 + h) for h, r in zip(half_coupons, running)]
+        running = [r + df for r, df in zip(running, dfs)]
+        grid_dfs.append(dfs)
+    # pick out the quoted tenors: bills by formula, the rest off the grid
+    tenor_dfs = []
+    for t, ys in tenor_columns:
+        if t < period:
+            dfs = [1.0 / (1.0 + y * t) for y in bill_yields[bill_times.index(t)]]
+        else:
+            dfs = grid_dfs[int(round(t / period)) - 1]
+        tenor_dfs.append(dfs)
+    return tenor_dfs
+
+
+# Continuously compounded zero rates, in percent, from discount factors
+def zero_rates(times, tenor_dfs):
+    return [[-math.log(df) / t * 100.0 if df > 0.0 else MISSING_FLOAT for df in dfs]
+            for t, dfs in zip(times, tenor_dfs)]
+
+
+# Continuously compounded forward rates, in percent, between each tenor and
+# the one before. The first tenor's forward is its zero rate.
+def forward_rates(times, tenor_dfs):
+    forwards = []
+    prev_t, prev_dfs = 0.0, [1.0] * (len(tenor_dfs[0]) if tenor_dfs else 0)
+    for t, dfs in zip(times, tenor_dfs):
+        forwards.append([math.log(p / df) / (t - prev_t) * 100.0 if df > 0.0 and p > 0.0 else MISSING_FLOAT
+                         for p, df in zip(prev_dfs, dfs)])
+        prev_t, prev_dfs = t, dfs
+    return forwards
+
+
+# Bootstrap discount factors, zero and forward rates from a cached treasury
+# par yield entry, like quandl/yield_csv, for every date in the entry. The
+# results go back into the cache as three columnar entries keyed like the
+# source: <cache_key>_discount, <cache_key>_zero and <cache_key>_forward.
+# group, cache_key: the source entry, as loaded by any of the csv loaders
+# target_group: group for the results, defaults to group
+class BootstrapYieldCurves(ActionFunction):
+    def implementation(self, cache, group, cache_key, target_group=None):
+        start = time.time()
+        columns, row_key, headers = get_entry_columns(cache, group, cache_key)
+        if columns is None:
+            error = "%s: no cache entry %s/%s" % (self.__class__.__name__, group, cache_key)
+            Logger.Error(error)
+            return error
+        tenors = [(tenor_years(name), name) for name in headers if tenor_years(name)]
+        tenors.sort()
+        if not tenors:
+            error = "%s: no tenor columns in %s/%s" % (self.__class__.__name__, group, cache_key)
+            Logger.Error(error)
+            return error
+        times = [t for t, name in tenors]
+        tenor_columns = [(t, columns[name]) for t, name in tenors]
+        tenor_dfs = bootstrap_discount_factors(tenor_columns)
+        results = [
+            ("discount", tenor_dfs),
+            ("zero", zero_rates(times, tenor_dfs)),
+            ("forward", forward_rates(times, tenor_dfs)),
+        ]
+        target_group = target_group or group
+        for suffix, tenor_values in results:
+            cs_cache_entry = Dictionary[str, Array]()
+            column_names = List[str]()
+            if row_key:
+                # the key column is shared with the source entry
+                cs_cache_entry.Add(row_key, columns[row_key])
+                column_names.Add(row_key)
+            for (t, name), values in zip(tenors, tenor_values):
+                cs_cache_entry.Add(name, Array[float](values))
+                column_names.Add(name)
+            target_key = "%s_%s" % (cache_key, suffix)
+            insert_columns(cache, target_group, target_key, cs_cache_entry, row_key, column_names)
+            index_keyed_entry(target_group, target_key, cs_cache_entry, row_key, True)
+        Logger.Info("%s: bootstrapped %d dates from %s/%s in %.3fs" % (
+            self.__class__.__name__, len(tenor_dfs[0]), group, cache_key, time.time() - start))
+        return ""
+
+
+param_specs5 = [
+    ('cache', None, False),
+    ('group', str, False),
+    ('cache_key', str, False),
+    ('target_group', str, True)
+]
+bootstrap_yield_curves = BootstrapYieldCurves(param_specs5)
+
+
+# Key index queries: range slices, as-of lookups and last N rows of a keyed
+# cache entry, by binary search on its KeyIndex. Each query writes its
+# result to one fixed cache entry, <cache_key>_<query_name> unless target_key
+# is given, with the same layout as the source, so it can be viewed in the
+# GUI and Excel like any other entry. Rerunning a query replaces that entry
+# rather than growing the cache. And if it selects the same rows of the same
+# source entry as last time, the result entry is left as is: no insert, so
+# no cache update broadcast to every websock client.
+
+# The element type of a columnar array: double[] cells come back as floats
+def column_type_of(cs_column):
+    for cell in cs_column:
+        return COLUMN_TYPE_FLOAT if isinstance(cell, float) else COLUMN_TYPE_STR
+    return COLUMN_TYPE_STR
+
+
+# Copy the rows named by refs out of entry, in refs order
+def slice_entry(entry, refs):
+    if str(entry.Type) == "ColumnarCSV":
+        cs_cache_entry = Dictionary[str, Array]()
+        for name in entry.Headers:
+            cs_column = entry.AsColumns[name]
+            values = [cs_column[r] for r in refs]
+            if column_type_of(cs_column) == COLUMN_TYPE_FLOAT:
+                cs_cache_entry.Add(name, Array[float](values))
+            else:
+                cs_cache_entry.Add(name, Array[str](values))
+        return cs_cache_entry
+    cs_cache_entry = Dictionary[str, Dictionary[str, str]]()
+    for key_value in refs:
+        cs_cache_entry.Add(key_value, entry.AsDict[key_value])
+    return cs_cache_entry
+
+
+# The last result written to each query target: the source CacheValue, the
+# selected refs and the result CacheValue, keyed on (target_group, target_key)
+query_results = dict()
+
+
+# True if the rows in refs of entry are already in the target entry
+def query_result_current(cache, target_group, target_key, entry, refs):
+    last = query_results.get((target_group, target_key))
+    if last is None or last[0] is not entry.CacheValue or last[1] != refs:
+        return False
+    # the target may since have been replaced or removed
+    target = cache.GetCacheEntry(target_group, target_key)
+    return target is not None and target.CacheValue is last[2]
+
+
+# Base for the query actions: subclasses implement select(index, **query)
+# to pick row refs from the index, taking their query params as keyword
+# args. Results go to target_group/target_key, which default to the source
+# group and <cache_key>_<query_name>
+class KeyIndexQuery(ActionFunction):
+    query_name = None
+
+    def implementation(self, cache, group, cache_key, target_group=None, target_key=None, **query):
+        index, entry = get_key_index(cache, group, cache_key)
+        if index is None:
+            error = "%s: no keyed cache entry %s/%s" % (self.__class__.__name__, group, cache_key)
+            Logger.Error(error)
+            return error
+        try:
+            refs = list(self.select(index, **query))
+        except ValueError as ex:
+            error = "%s: bad query %s for %s/%s: %s" % (self.__class__.__name__, query, group, cache_key, ex)
+            Logger.Error(error)
+            return error
+        target_group = target_group or group
+        target_key = target_key or "%s_%s" % (cache_key, self.query_name)
+        if query_result_current(cache, target_group, target_key, entry, refs):
+            Logger.Info("%s: %d rows from %s/%s unchanged in %s/%s" % (
+                self.__class__.__name__, len(refs), group, cache_key, target_group, target_key))
+            return ""
+        cs_cache_entry = slice_entry(entry, refs)
+        column_names = make_column_names(entry.Headers)
+        if str(entry.Type) == "ColumnarCSV":
+            insert_columns(cache, target_group, target_key, cs_cache_entry, entry.RowKey, column_names)
+        else:
+            insert_rows(cache, target_group, target_key, cs_cache_entry, entry.RowKey, column_names)
+        query_results[(target_group, target_key)] = (entry.CacheValue, refs, cs_cache_entry)
+        Logger.Info("%s: %d rows from %s/%s to %s/%s" % (
+            self.__class__.__name__, len(refs), group, cache_key, target_group, target_key))
+        return ""
+
+
+# start, end: inclusive key bounds, either may be omitted
+class QueryCacheRange(KeyIndexQuery):
+    query_name = "range"
+
+    def select(self, index, start=None, end=None):
+        return index.range(start, end)
+
+
+# as_of: the latest row with key <= as_of
+class QueryCacheAsOf(KeyIndexQuery):
+    query_name = "as_of"
+
+    def select(self, index, as_of):
+        ref = index.as_of(as_of)
+        return [ref] if ref is not None else []
+
+
+# count: the last count rows in key order
+class QueryCacheLast(KeyIndexQuery):
+    query_name = "last"
+
+    def select(self, index, count):
+        return index.last(int(count))
+
+
+query_param_specs = [
+    ('cache', None, False),
+    ('group', str, False),
+    ('cache_key', str, False),
+    ('target_group', str, True),
+    ('target_key', str, True)
+]
+query_cache_range = QueryCacheRange(query_param_specs + [('start', str, True), ('end', str, True)])
+query_cache_as_of = QueryCacheAsOf(query_param_specs + [('as_of', str, False)])
+# no type check as count arrives as str from ActionsDriver
+query_cache_last = QueryCacheLast(query_param_specs + [('count', None, False)])
+
+
+# Time series resampling: aggregate the rows of a keyed cache entry with
+# ISO date keys, like yield.csv's, into weekly, monthly or quarterly
+# buckets. Rows are sorted by key once, and each row mapped to its bucket
+# label, so each bucket is a contiguous run of rows. Then each numeric
+# column is aggregated a run at a time. Result rows are keyed on the last
+# date seen in each bucket, so they sort, chart and as-of query like the
+# source. Missing cells are skipped, and an all missing bucket gives NaN.
+
+ISO_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}')
+
+
+# Bucket labels for an ISO date string yyyy-mm-dd
+def week_bucket(key):
+    year, week, weekday = datetime.date(int(key[0:4]), int(key[5:7]), int(key[8:10])).isocalendar()
+    return (year, week)
+
+
+def month_bucket(key):
+    return key[0:7]
+
+
+def quarter_bucket(key):
+    return (key[0:4], (int(key[5:7]) - 1) // 3)
+
+
+RESAMPLE_FREQUENCIES = {
+    "weekly": week_bucket,
+    "monthly": month_bucket,
+    "quarterly": quarter_bucket,
+}
+
+
+def present(values):
+    return [v for v in values if not math.isnan(v)]
+
+
+def aggregate_last(values):
+    values = present(values)
+    return values[-1] if values else MISSING_FLOAT
+
+
+def aggregate_mean(values):
+    values = present(values)
+    return math.fsum(values) / len(values) if values else MISSING_FLOAT
+
+
+def aggregate_min(values):
+    values = present(values)
+    return min(values) if values else MISSING_FLOAT
+
+
+def aggregate_max(values):
+    values = present(values)
+    return max(values) if values else MISSING_FLOAT
+
+
+RESAMPLE_AGGREGATIONS = {
+    "last": aggregate_last,
+    "mean": aggregate_mean,
+    "min": aggregate_min,
+    "max": aggregate_max,
+}
+
+
+# Sort row positions by key and split them into runs of the same bucket.
+# Returns the sorted positions and a list of (start, end) runs into them.
+def bucket_runs(keys, bucket_of):
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    runs = []
+    start = 0
+    current = None
+    for pos, row in enumerate(order):
+        bucket = bucket_of(keys[row])
+        if pos and bucket != current:
+            runs.append((start, pos))
+            start = pos
+        current = bucket
+    if order:
+        runs.append((start, len(order)))
+    return order, runs
+
+
+# Resample a keyed cache entry of daily rows into a new columnar entry
+# group, cache_key: source entry, eg quandl/yield_csv. Keys must be ISO dates.
+# frequency: "weekly", "monthly" or "quarterly"
+# aggregation: "last" (default), "mean", "min" or "max"
+# target_group, target_key: default to group and <cache_key>_<frequency>_<aggregation>
+class ResampleCacheEntry(ActionFunction):
+    def implementation(self, cache, group, cache_key, frequency, aggregation="last",
+                       target_group=None, target_key=None):
+        bucket_of = RESAMPLE_FREQUENCIES.get(frequency)
+        aggregate = RESAMPLE_AGGREGATIONS.get(aggregation)
+        if not bucket_of or not aggregate:
+            error = "%s: bad frequency(%s) or aggregation(%s)" % (self.__class__.__name__, frequency, aggregation)
+            Logger.Error(error)
+            return error
+        start = time.time()
+        columns, row_key, headers = get_entry_columns(cache, group, cache_key)
+        if columns is None or not row_key:
+            error = "%s: no keyed cache entry %s/%s" % (self.__class__.__name__, group, cache_key)
+            Logger.Error(error)
+            return error
+        keys = list(columns[row_key])
+        # a key column inferred as float has no dates to bucket
+        if not all(isinstance(key, str) and ISO_DATE.match(key) for key in keys):
+            error = "%s: %s/%s keys aren't ISO dates" % (self.__class__.__name__, group, cache_key)
+            Logger.Error(error)
+            return error
+        order, runs = bucket_runs(keys, bucket_of)
+        cs_cache_entry = Dictionary[str, Array]()
+        column_names = List[str]()
+        cs_cache_entry.Add(row_key, Array[str]([keys[order[end - 1]] for begin, end in runs]))
+        column_names.Add(row_key)
+        for name in headers:
+            if name == row_key or column_type_of(columns[name]) != COLUMN_TYPE_FLOAT:
+                continue
+            # gather the column in key order once, then slice per bucket
+            values = [columns[name][row] for row in order]
+            cs_cache_entry.Add(name, Array[float]([aggregate(values[begin:end]) for begin, end in runs]))
+            column_names.Add(name)
+        target_group = target_group or group
+        target_key = target_key or "%s_%s_%s" % (cache_key, frequency, aggregation)
+        insert_columns(cache, target_group, target_key, cs_cache_entry, row_key, column_names)
+        index_keyed_entry(target_group, target_key, cs_cache_entry, row_key, True)
+        Logger.Info("%s: %d rows of %s/%s to %d %s rows in %s/%s in %.3fs" % (
+            self.__class__.__name__, len(keys), group, cache_key, len(runs), frequency,
+            target_group, target_key, time.time() - start))
+        return ""
+
+
+param_specs7 = [
+    ('cache', None, False),
+    ('group', str, False),
+    ('cache_key', str, False),
+    ('frequency', str, False),
+    ('aggregation', str, True),
+    ('target_group', str, True),
+    ('target_key', str, True)
+]
+resample_cache_entry = ResampleCacheEntry(param_specs7)
+
+
+# Sorted merge joins: combine several date keyed cache entries, eg the
+# DED, DSWP and YIELD quandl downloads, into one wide columnar entry. Each
+# source's rows are put in key order, which is a near linear sort as vendor
+# files are already in date order one way or the other. Then a k way
+# streaming merge walks all the sources in one pass, rather than looking
+# up every date in every source. Sources with different holiday calendars
+# are handled by the join:
+#   outer: a row for every date in any source, NaN or null where a source
+#          has no row for the date
+#   asof:  a row for every date of the first source, with the latest row
+#          at or before that date from each other source
+# Column names that clash across sources, eg FRED's VALUE, are prefixed
+# with their source cache key.
+MERGE_JOINS = ("outer", "asof")
+
+
+# A source entry ready for merging: sorted keys and row positions, and
+# its columns
+class MergeSource(object):
+    def __init__(self, name, columns, row_key, headers):
+        self.name = name
+        self.columns = columns
+        self.headers = [h for h in headers if h != row_key]
+        keys = list(columns[row_key])
+        self.order = sorted(range(len(keys)), key=keys.__getitem__)
+        self.keys = [keys[row] for row in self.order]
+
+    # (key, source index, row) in key order, for heap_merge
+    def stream(self, index):
+        return ((key, index, row) for key, row in zip(self.keys, self.order))
+
+
+def merge_output_names(sources):
+    counts = dict()
+    for source in sources:
+        for name in source.headers:
+            counts[name] = counts.get(name, 0) + 1
+    return [[name if counts[name] == 1 else "%s_%s" % (source.name, name) for name in source.headers]
+            for source in sources]
+
+
+# One linear pass over the merged streams. Returns the output keys, and for
+# each source the row to take for each output key, or None.
+def merge_rows(sources, join):
+    output_keys = []
+    output_rows = [[] for source in sources]
+    current = [None] * len(sources)
+    streams = [source.stream(index) for index, source in enumerate(sources)]
+    pending_key = None
+    # in outer joins current only holds rows for the pending key, in asof
+    # joins it holds the latest row seen of each source
+    for key, index, row in heap_merge(*streams):
+        if key != pending_key:
+            emit_merged_row(pending_key, current, output_keys, output_rows, join)
+            pending_key = key
+        current[index] = (key, row)
+    emit_merged_row(pending_key, current, output_keys, output_rows, join)
+    return output_keys, output_rows
+
+
+def emit_merged_row(key, current, output_keys, output_rows, join):
+    if key is None:
+        return
+    if join == "asof":
+        # only the first source's dates make rows
+        spine = current[0]
+        if spine is None or spine[0] != key:
+            return
+        output_keys.append(key)
+        for rows, latest in zip(output_rows, current):
+            rows.append(latest[1] if latest else None)
+        return
+    output_keys.append(key)
+    for index, (rows, latest) in enumerate(zip(output_rows, current)):
+        rows.append(latest[1] if latest and latest[0] == key else None)
+        current[index] = None
+
+
+# Pick rows out of a source column into a new .Net array, with NaN or
+# null where rows is None
+def take_rows(cs_column, rows):
+    if column_type_of(cs_column) == COLUMN_TYPE_FLOAT:
+        return Array[float]([cs_column[r] if r is not None else MISSING_FLOAT for r in rows])
+    return Array[str]([cs_column[r] if r is not None else None for r in rows])
+
+
+# Merge date keyed cache entries into one wide columnar entry
+# group: group of the source entries, and default target group
+# sources: cache keys of the sources, as a list or JSON text. Use
+#          group/cache_key for sources in other groups. For asof joins
+#          put the source with the calendar you want first.
+# join: "outer" (default) or "asof"
+# target_group, target_key: where the merged entry goes; target_key
+#          defaults to "merged"
+class MergeCacheEntries(ActionFunction):
+    def implementation(self, cache, group, sources, join="outer", target_group=None, target_key="merged"):
+        if join not in MERGE_JOINS:
+            error = "%s: bad join(%s)" % (self.__class__.__name__, join)
+            Logger.Error(error)
+            return error
+        if isinstance(sources, str):
+            sources = json.loads(sources)
+        start = time.time()
+        merge_sources = []
+        row_key = None
+        for source in sources:
+            source_group, source_key = source.split('/', 1) if '/' in source else (group, source)
+            columns, source_row_key, headers = get_entry_columns(cache, source_group, source_key)
+            if columns is None or not source_row_key:
+                error = "%s: no keyed cache entry %s/%s" % (self.__class__.__name__, source_group, source_key)
+                Logger.Error(error)
+                return error
+            # the output key column is named as the first source's
+            row_key = row_key or source_row_key
+            merge_sources.append(MergeSource(source_key, columns, source_row_key, headers))
+        output_keys, output_rows = merge_rows(merge_sources, join)
+        cs_cache_entry = Dictionary[str, Array]()
+        column_names = List[str]()
+        cs_cache_entry.Add(row_key, Array[str](output_keys))
+        column_names.Add(row_key)
+        for source, names, rows in zip(merge_sources, merge_output_names(merge_sources), output_rows):
+            for header, name in zip(source.headers, names):
+                cs_cache_entry.Add(name, take_rows(source.columns[header], rows))
+                column_names.Add(name)
+        target_group = target_group or group
+        insert_columns(cache, target_group, target_key, cs_cache_entry, row_key, column_names)
+        index_keyed_entry(target_group, target_key, cs_cache_entry, row_key, True)
+        Logger.Info("%s: %s joined %d sources to %d rows in %s/%s in %.3fs" % (
+            self.__class__.__name__, join, len(merge_sources), len(output_keys),
+            target_group, target_key, time.time() - start))
+        return ""
+
+
+param_specs8 = [
+    ('cache', None, False),
+    ('group', str, False),
+    # no type check: sources may be a list or JSON text
+    ('sources', None, False),
+    ('join', str, True),
+    ('target_group', str, True),
+    ('target_key', str, True)
+]
+merge_cache_entries = MergeCacheEntries(param_specs8)
+
+
+# Cache snapshots: save the whole cache, or some groups, to a single binary
+# file, and restore it on startup so a restart doesn't have to reparse every
+# csv. Set "startup_actions": "warm_start" in cfg/config.json to play
+# scripts/actions/warm_start.json on startup. File layout:
+#   MAGIC, uint32 manifest length, JSON manifest, payload
+# The manifest lists each entry's group, cache_key, type, row_key, headers,
+# row count and source fingerprint, and for each column its dtype and the
+# offset and length of its bytes in the payload. f8 columns are packed
+# doubles. str columns are int32 byte lengths, -1 for a missing cell, then
+# the UTF-8 bytes of all the cells. Keyed row entries store their keys as
+# an extra str column. On restore entries whose source csv has changed
+# since the save are skipped, so they get reloaded by the usual actions.
+
+SNAPSHOT_MAGIC = b"BDSNAP01"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_SUFFIX = ".bdsnap"
+DTYPE_F8 = "f8"
+DTYPE_STR = "str"
+
+
+def snapshot_path(name):
+    if os.path.isabs(name):
+        return name
+    return os.path.join(BDRoot, 'data', 'snapshots', name + SNAPSHOT_SUFFIX)
+
+
+# size and mtime of a source file, or None if it's gone
+def source_fingerprint(path):
+    if not path or not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return dict(path=path, size=stat.st_size, mtime=stat.st_mtime)
+
+
+def source_unchanged(source):
+    if source is None:
+        return True
+    current = source_fingerprint(source["path"])
+    return current is not None and current["size"] == source["size"] and current["mtime"] == source["mtime"]
+
+
+def encode_str_column(values):
+    lengths = array('i')
+    chunks = []
+    for value in values:
+        if value is None:
+            lengths.append(-1)
+        else:
+            chunk = value.encode("utf-8")
+            lengths.append(len(chunk))
+            chunks.append(chunk)
+    if sys.byteorder != "little":
+        lengths.byteswap()
+    return lengths.tobytes() + b"".join(chunks)
+
+
+def decode_str_column(data, count):
+    lengths = array('i')
+    lengths.frombytes(data[:count * lengths.itemsize])
+    if sys.byteorder != "little":
+        lengths.byteswap()
+    values = []
+    pos = count * lengths.itemsize
+    for length in lengths:
+        if length < 0:
+            values.append(None)
+        else:
+            values.append(data[pos:pos + length].decode("utf-8"))
+            pos += length
+    return values
+
+
+def encode_f8_column(values):
+    packed = array('d', values)
+    if sys.byteorder != "little":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def decode_f8_column(data):
+    packed = array('d')
+    packed.frombytes(data)
+    if sys.byteorder != "little":
+        packed.byteswap()
+    return packed
+
+
+# A cell of a C# row Dictionary, or None if the row has no such field
+def row_cell(row, name):
+    return row[name] if row.ContainsKey(name) else None
+
+
+# Flatten a cache entry into (name, dtype, values) columns
+def entry_to_columns(entry):
+    entry_type = str(entry.Type)
+    headers = list(entry.Headers)
+    if entry_type == "ColumnarCSV":
+        columns = []
+        for name in headers:
+            cs_column = entry.AsColumns[name]
+            dtype = DTYPE_F8 if column_type_of(cs_column) == COLUMN_TYPE_FLOAT else DTYPE_STR
+            columns.append((name, dtype, list(cs_column)))
+        return columns
+    if entry_type == "PrimaryKeyCSV":
+        keys = list(entry.AsDict.Keys)
+        rows = [entry.AsDict[key_value] for key_value in keys]
+        columns = [(None, DTYPE_STR, keys)]
+    else:
+        rows = list(entry.AsList)
+        columns = []
+    for name in headers:
+        columns.append((name, DTYPE_STR, [row_cell(row, name) for row in rows]))
+    return columns
+
+
+# Rebuild a C# cache entry from the decoded columns of a manifest entry
+def columns_to_entry(entry_type, headers, count, columns):
+    if entry_type == "ColumnarCSV":
+        cs_cache_entry = Dictionary[str, Array]()
+        for name, dtype, values in columns:
+            if dtype == DTYPE_F8:
+                cs_cache_entry.Add(name, Array[float](values))
+            else:
+                cs_cache_entry.Add(name, Array[str](values))
+        return cs_cache_entry
+    named = [(name, values) for name, dtype, values in columns if name is not None]
+    rows = []
+    for index in range(count):
+        row = Dictionary[str, str]()
+        for name, values in named:
+            if values[index] is not None:
+                row.Add(name, values[index])
+        rows.append(row)
+    if entry_type == "PrimaryKeyCSV":
+        keys = columns[0][2]
+        cs_cache_entry = Dictionary[str, Dictionary[str, str]]()
+        for key_value, row in zip(keys, rows):
+            cs_cache_entry.Add(key_value, row)
+        return cs_cache_entry
+    cs_cache_entry = List[Dictionary[str, str]]()
+    for row in rows:
+        cs_cache_entry.Add(row)
+    return cs_cache_entry
+
+
+def write_snapshot(path, cache, groups):
+    manifest_entries = []
+    payload = []
+    offset = 0
+    for group in groups:
+        for cache_key in cache.GetCacheKeys(group):
+            # derived entries are recomputed on access after a restore
+            if (group, cache_key) in derived_entries:
+                continue
+            entry = cache.GetCacheEntry(group, cache_key)
+            if entry is None:
+                continue
+            column_specs = []
+            count = 0
+            for name, dtype, values in entry_to_columns(entry):
+                count = len(values)
+                if dtype == DTYPE_F8:
+                    data = encode_f8_column(values)
+                else:
+                    data = encode_str_column(values)
+                column_specs.append(dict(name=name, dtype=dtype, offset=offset, length=len(data)))
+                payload.append(data)
+                offset += len(data)
+            manifest_entries.append(dict(
+                group=group, cache_key=cache_key, type=str(entry.Type), row_key=entry.RowKey or None,
+                headers=list(entry.Headers), count=count, columns=column_specs,
+                source=source_fingerprint(entry_sources.get((group, cache_key)))))
+    manifest = json.dumps(dict(version=SNAPSHOT_VERSION, byteorder="little",
+                               entries=manifest_entries)).encode("utf-8")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write to a temp file and rename so a crash mid save can't leave
+    # a truncated snapshot for the next warm start
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as snapshot_file:
+        snapshot_file.write(SNAPSHOT_MAGIC)
+        snapshot_file.write(struct.pack("<I", len(manifest)))
+        snapshot_file.write(manifest)
+        for data in payload:
+            snapshot_file.write(data)
+    os.replace(tmp_path, path)
+    return len(manifest_entries)
+
+
+# Returns the manifest and the payload bytes. We read the file in one go
+# rather than mmap it, as IronPython's mmap support is patchy, and we
+# copy every column into .Net containers anyway.
+def read_snapshot(path):
+    with open(path, "rb") as snapshot_file:
+        data = snapshot_file.read()
+    if data[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+        raise ValueError("%s is not a cache snapshot" % path)
+    pos = len(SNAPSHOT_MAGIC)
+    manifest_length = struct.unpack("<I", data[pos:pos + 4])[0]
+    pos += 4
+    manifest = json.loads(data[pos:pos + manifest_length].decode("utf-8"))
+    if manifest.get("version") != SNAPSHOT_VERSION:
+        raise ValueError("%s has snapshot version %s" % (path, manifest.get("version")))
+    return manifest, data[pos + manifest_length:]
+
+
+# Save cache groups to data/snapshots/<name>.bdsnap
+# name: snapshot name, default "cache", or an absolute path
+# groups: group names as a list or JSON text; all groups by default
+class SaveCacheSnapshot(ActionFunction):
+    def implementation(self, cache, name="cache", groups=None):
+        if groups is None:
+            groups = list(cache.GetGroupNames())
+        elif isinstance(groups, str):
+            groups = json.loads(groups)
+        path = snapshot_path(name)
+        start = time.time()
+        try:
+            saved = write_snapshot(path, cache, groups)
+        except Exception as ex:
+            error = "%s: saving %s failed %s" % (self.__class__.__name__, path, ex)
+            Logger.Error(error)
+            return error
+        Logger.Info("%s: saved %d entries to %s in %.3fs" % (
+            self.__class__.__name__, saved, path, time.time() - start))
+        return ""
+
+
+# Restore the entries in a snapshot saved by SaveCacheSnapshot. A missing
+# snapshot isn't an error, as there won't be one on first start. Stale
+# entries, whose source csv has changed since the save, are skipped.
+class LoadCacheSnapshot(ActionFunction):
+    def implementation(self, cache, name="cache"):
+        path = snapshot_path(name)
+        if not os.path.exists(path):
+            Logger.Info("%s: no snapshot at %s" % (self.__class__.__name__, path))
+            return ""
+        start = time.time()
+        try:
+            manifest, payload = read_snapshot(path)
+        except Exception as ex:
+            error = "%s: reading %s failed %s" % (self.__class__.__name__, path, ex)
+            Logger.Error(error)
+            return error
+        restored = 0
+        for spec in manifest["entries"]:
+            group, cache_key = spec["group"], spec["cache_key"]
+            source = spec["source"]
+            if not source_unchanged(source):
+                Logger.Info("%s: skipping stale %s/%s" % (self.__class__.__name__, group, cache_key))
+                continue
+            columns = []
+            for column in spec["columns"]:
+                data = payload[column["offset"]:column["offset"] + column["length"]]
+                if column["dtype"] == DTYPE_F8:
+                    values = decode_f8_column(data)
+                else:
+                    values = decode_str_column(data, spec["count"])
+                columns.append((column["name"], column["dtype"], values))
+            cs_cache_entry = columns_to_entry(spec["type"], spec["headers"], spec["count"], columns)
+            column_names = make_column_names(spec["headers"])
+            row_key = spec["row_key"]
+            source_path = source and source["path"]
+            if spec["type"] == "ColumnarCSV":
+                insert_columns(cache, group, cache_key, cs_cache_entry, row_key, column_names, source_path)
+            else:
+                insert_rows(cache, group, cache_key, cs_cache_entry, row_key, column_names, source_path)
+            index_keyed_entry(group, cache_key, cs_cache_entry, row_key, spec["type"] == "ColumnarCSV")
+            restored += 1
+        Logger.Info("%s: restored %d of %d entries from %s in %.3fs" % (
+            self.__class__.__name__, restored, len(manifest["entries"]), path, time.time() - start))
+        return ""
+
+
+snapshot_param_specs = [
+    ('cache', None, False),
+    ('name', str, True)
+]
+# no type check on groups: may be a list or JSON text
+save_cache_snapshot = SaveCacheSnapshot(snapshot_param_specs + [('groups', None, True)])
+load_cache_snapshot = LoadCacheSnapshot(snapshot_param_specs)
+
+
+
+# Derived cache entries: series like spreads and curve slopes computed from
+# other cache entries. A DerivedEntry is registered with the entries it
+# depends on and a compute function, and is computed when registered. When
+# one of its dependencies is reinserted it's invalidated lazily: marked stale
+# and removed from the cache, along with anything derived from it, so the
+# GUI, /api/cache and /excel, which read the C# DataCache directly, never see
+# values computed from an old source. It's only recomputed when next read
+# through get_cache_entry, or by the materialise_derived_entries action, so
+# reloading a source doesn't pay for derived entries nobody reads. The result
+# is memoized in between. If a compute fails, eg as its source isn't loaded
+# yet, the entry stays stale and out of the cache. Derived entries can depend
+# on other derived entries, as computing one reads its sources through
+# get_cache_entry.
+
+# A compute function takes the cache and returns the columnar entry,
+# row_key and column names to insert
+class DerivedEntry(object):
+    def __init__(self, group, cache_key, depends_on, compute):
+        self.group = group
+        self.cache_key = cache_key
+        self.depends_on = depends_on
+        self.compute = compute
+        self.stale = True
+        self.computations = 0
+
+
+# DerivedEntry keyed on (group, cache_key), and the (group, cache_key)s of
+# the derived entries depending on each entry. RLock as computing one
+# derived entry can access another. computing holds the entries being
+# computed, so a dependency cycle can't recompute forever.
+derived_entries = dict()
+dependents = dict()
+derived_lock = threading.RLock()
+computing = set()
+
+
+def register_derived_entry(group, cache_key, depends_on, compute):
+    with derived_lock:
+        old = derived_entries.get((group, cache_key))
+        if old:
+            for dependency in old.depends_on:
+                dependents.get(dependency, set()).discard((group, cache_key))
+        derived_entries[(group, cache_key)] = DerivedEntry(group, cache_key, depends_on, compute)
+        for dependency in depends_on:
+            dependents.setdefault(dependency, set()).add((group, cache_key))
+
+
+# Mark the derived entries depending on group/cache_key stale, as it has
+# just been inserted or removed, and remove them from the cache, and in turn
+# those depending on them. They're recomputed when next read.
+def invalidate_dependents(cache, group, cache_key, seen=None):
+    seen = seen if seen is not None else set()
+    with derived_lock:
+        for dependent in list(dependents.get((group, cache_key), ())):
+            # an entry being computed reads the new value, and seen stops cycles
+            if dependent in computing or dependent in seen:
+                continue
+            seen.add(dependent)
+            derived_entries[dependent].stale = True
+            cache.Remove(dependent[0], dependent[1])
+            invalidate_dependents(cache, dependent[0], dependent[1], seen)
+
+
+# Compute a stale derived entry and insert it into the cache. If the
+# compute fails, remove any previous result and its dependents from the
+# cache, so nobody reads stale values, and raise. The entry stays stale, so
+# the next read tries again.
+def materialise_derived_entry(cache, derived):
+    with derived_lock:
+        if not derived.stale:
+            return
+        group_key = (derived.group, derived.cache_key)
+        computing.add(group_key)
+        try:
+            cs_cache_entry, row_key, column_names = derived.compute(cache)
+        except Exception:
+            cache.Remove(derived.group, derived.cache_key)
+            # and withdraw whatever was computed from it
+            invalidate_dependents(cache, derived.group, derived.cache_key)
+            raise
+        finally:
+            computing.discard(group_key)
+        derived.stale = False
+        derived.computations += 1
+        insert_columns(cache, derived.group, derived.cache_key, cs_cache_entry, row_key, column_names)
+
+
+# Actions that read the cache go through here, so accessing a derived
+# entry computes it if need be. If that fails we log it and return None,
+# as for a missing entry.
+def get_cache_entry(cache, group, cache_key):
+    derived = derived_entries.get((group, cache_key))
+    if derived is not None:
+        try:
+            materialise_derived_entry(cache, derived)
+        except Exception as ex:
+            Logger.Error("get_cache_entry: computing %s/%s failed %s" % (group, cache_key, ex))
+            return None
+    return cache.GetCacheEntry(group, cache_key)
+
+
+# Series expressions: arithmetic on the columns of a cache entry, eg
+# "10YR - 2YR" or "(10YR - 2YR) / 8". Operands are column names or numbers,
+# and the usual precedence applies. Missing cells are NaN, and propagate.
+EXPRESSION_TOKEN = re.compile(r'\s*(?:([A-Za-z0-9_.]+)|(.))')
+
+
+def tokenize_expression(expression):
+    tokens = []
+    for match in EXPRESSION_TOKEN.finditer(expression.strip()):
+        operand, operator = match.groups()
+        if operator and operator not in "+-*/()":
+            raise ValueError("bad character %s in %s" % (operator, expression))
+        tokens.append(operand or operator)
+    return tokens
+
+
+# Recursive descent parse to a tree of tuples: ("num", value),
+# ("col", name), ("neg", operand) or (operator, left, right)
+def parse_expression(expression):
+    tokens = tokenize_expression(expression)
+    pos = [0]
+
+    def peek():
+        return tokens[pos[0]] if pos[0] < len(tokens) else None
+
+    def take():
+        token = peek()
+        if token is None:
+            raise ValueError("unexpected end of %s" % expression)
+        pos[0] += 1
+        return token
+
+    def parse_sum():
+        node = parse_product()
+        while peek() in ("+", "-"):
+            node = (take(), node, parse_product())
+        return node
+
+    def parse_product():
+        node = parse_unary()
+        while peek() in ("*", "/"):
+            node = (take(), node, parse_unary())
+        return node
+
+    def parse_unary():
+        token = take()
+        if token == "-":
+            return ("neg", parse_unary())
+        if token == "(":
+            node = parse_sum()
+            if take() != ")":
+                raise ValueError("missing ) in %s" % expression)
+            return node
+        if token in "+*/)":
+            raise ValueError("unexpected %s in %s" % (token, expression))
+        try:
+            return ("num", float(token))
+        except ValueError:
+            return ("col", token)
+
+    tree = parse_sum()
+    if peek() is not None:
+        raise ValueError("unexpected %s in %s" % (peek(), expression))
+    return tree
+
+
+def expression_columns(tree):
+    if tree[0] == "col":
+        return [tree[1]]
+    if tree[0] == "num":
+        return []
+    return [name for node in tree[1:] for name in expression_columns(node)]
+
+
+SERIES_OPERATORS = {
+    "+": lambda a, b: a + b,
+    "-": lambda a, b: a - b,
+    "*": lambda a, b: a * b,
+    "/": lambda a, b: a / b if b else MISSING_FLOAT,
+}
+
+
+# Evaluate a parsed expression over columns of count rows. Returns a
+# list of floats, or a float for a constant expression.
+def evaluate_expression(tree, columns, count):
+    kind = tree[0]
+    if kind == "num":
+        return tree[1]
+    if kind == "col":
+        return list(columns[tree[1]])
+    if kind == "neg":
+        operand = evaluate_expression(tree[1], columns, count)
+        return -operand if isinstance(operand, float) else [-v for v in operand]
+    operator = SERIES_OPERATORS[kind]
+    left = evaluate_expression(tree[1], columns, count)
+    right = evaluate_expression(tree[2], columns, count)
+    if isinstance(left, float) and isinstance(right, float):
+        return operator(left, right)
+    if isinstance(left, float):
+        left = [left] * count
+    if isinstance(right, float):
+        right = [right] * count
+    return [operator(a, b) for a, b in zip(left, right)]
+
+
+# The compute function for a DerivedEntry of series from a source entry.
+# The result has the source key column, if any, and one float column per
+# series, in series order.
+def make_series_compute(source_group, source_key, series):
+    trees = [(name, parse_expression(expression)) for name, expression in series]
+
+    def compute(cache):
+        columns, row_key, headers = get_entry_columns(cache, source_group, source_key)
+        if columns is None:
+            raise KeyError("no cache entry %s/%s" % (source_group, source_key))
+        count = len(columns[headers[0]]) if headers else 0
+        cs_cache_entry = Dictionary[str, Array]()
+        column_names = List[str]()
+        if row_key:
+            cs_cache_entry.Add(row_key, columns[row_key])
+            column_names.Add(row_key)
+        for name, tree in trees:
+            for column in expression_columns(tree):
+                if column not in headers:
+                    raise KeyError("no column %s in %s/%s" % (column, source_group, source_key))
+            values = evaluate_expression(tree, columns, count)
+            if isinstance(values, float):
+                values = [values] * count
+            cs_cache_entry.Add(name, Array[float](values))
+            column_names.Add(name)
+        return cs_cache_entry, row_key, column_names
+    return compute
+
+
+# Register a derived entry of series computed from another cache entry. It
+# is computed here if the source is loaded, and otherwise, or after the
+# source is reloaded, on the next read.
+# group, cache_key: where the derived entry goes
+# source_group, source_key: the entry it's computed from eg quandl/yield_csv
+# series: JSON object of series name to expression eg {"spread_10y2y": "10YR - 2YR"}
+class AddDerivedSeries(ActionFunction):
+    def implementation(self, cache, group, cache_key, source_group, source_key, series):
+        if isinstance(series, str):
+            series = json.loads(series)
+        series = list(series.items())
+        try:
+            compute = make_series_compute(source_group, source_key, series)
+        except ValueError as ex:
+            error = "%s: %s" % (self.__class__.__name__, ex)
+            Logger.Error(error)
+            return error
+        register_derived_entry(group, cache_key, [(source_group, source_key)], compute)
+        Logger.Info("%s: registered %s/%s from %s/%s" % (
+            self.__class__.__name__, group, cache_key, source_group, source_key))
+        try:
+            materialise_derived_entry(cache, derived_entries[(group, cache_key)])
+        except Exception as ex:
+            # not an error, as the source may be loaded later
+            Logger.Warn("%s: %s/%s not computed yet %s" % (self.__class__.__name__, group, cache_key, ex))
+        return ""
+
+
+# Compute any stale derived entries, eg after reloading their sources, so
+# the GUI and Excel, which don't go through get_cache_entry, see them again
+# group: only entries in this group; all groups by default
+class MaterialiseDerivedEntries(ActionFunction):
+    def implementation(self, cache, group=None):
+        computed = 0
+        errors = []
+        for derived in list(derived_entries.values()):
+            if group and derived.group != group:
+                continue
+            if not derived.stale:
+                continue
+            try:
+                materialise_derived_entry(cache, derived)
+                computed += 1
+            except Exception as ex:
+                errors.append("%s/%s: %s" % (derived.group, derived.cache_key, ex))
+        Logger.Info("%s: computed %d derived entries" % (self.__class__.__name__, computed))
+        if errors:
+            error = "%s: %s" % (self.__class__.__name__, "; ".join(errors))
+            Logger.Error(error)
+            return error
+        return ""
+
+
+param_specs6 = [
+    ('cache', None, False),
+    ('group', str, False),
+    ('cache_key', str, False),
+    ('source_group', str, False),
+    ('source_key', str, False),
+    # no type check: series may be a dict or JSON text
+    ('series', None, False)
+]
+add_derived_series = AddDerivedSeries(param_specs6)
+materialise_derived_entries = MaterialiseDerivedEntries([
+    ('cache', None, False),
+    ('group', str, True)
+])
+
+
+# The state above outlives each action, and refers to cache entries. When
+# the cache is emptied, eg by /api/reset, BizDeckPython.ResetModuleState
+# calls this so later loads don't trust state for entries that are gone.
+def reset_module_state():
+    with derived_lock:
+        derived_entries.clear()
+        dependents.clear()
+        computing.clear()
+    incremental_loads.clear()
+    change_sets.clear()
+    key_indexes.clear()
+    query_results.clear()
+    entry_sources.clear()
+    encoding_stats.clear()
+    download_stats.clear()
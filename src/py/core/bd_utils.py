@@ -9,7 +9,11 @@ import psutil
 def configure_logging(log_name):
     log_path = f"{log_name}.log"
     bdroot = os.getenv('BDROOT')
-    if bdroot:
+    # BDLOGDIR is set per test module by parallel_runner.py
+    log_dir = os.getenv('BDLOGDIR')
+    if log_dir:
+        log_path = os.path.join(log_dir, log_path)
+    elif bdroot:
         log_path = os.path.join(bdroot, "logs", log_path)
     logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s %(message)s',
@@ -18,7 +22,19 @@ def configure_logging(log_name):
     return logging.getLogger(log_name)
 
 
-def find_bizdeck_process(exe_name="BizDeckServer.exe"):
+# With port, only a BizDeck process listening on that port counts, so
+# parallel test workers on other ports don't trip each other up
+def find_bizdeck_process(exe_name="BizDeckServer.exe", port=None):
+    if port:
+        for conn in psutil.net_connections(kind='tcp'):
+            if conn.status == psutil.CONN_LISTEN and conn.laddr.port == port and conn.pid:
+                try:
+                    proc_info = psutil.Process(conn.pid).as_dict(['pid', 'name', 'username'])
+                except psutil.NoSuchProcess:
+                    continue
+                if proc_info.get('name') == exe_name:
+                    return proc_info
+        return None
     # check there is no running BizDeck process
     for proc in psutil.process_iter(['pid', 'name', 'username']):
         logging.debug(f"ps:{proc.info}")
@@ -27,6 +43,9 @@ def find_bizdeck_process(exe_name="BizDeckServer.exe"):
     return None
 
 
+SHARED_MODES = ("", "session", "module")
+
+
 # Abstract BizDeck env handling code so it can be used
 # in eg twiddling int_test_config to switch default browsers
 # between batches of tests
@@ -34,9 +53,29 @@ class ConfigHelper(object):
     def __init__(self):
         self.bdtree = os.getenv("BDTREE")
         self.bdroot = os.getenv("BDROOT")
-        self.is_deploy_tree = self.bdtree != self.bdroot
         self.start_stop = int(os.getenv("BDSTARTSTOP", "1"))
-        self.log_dir = os.path.join(self.bdroot, "logs")
+        # BDSHARED=session or module shares one BizDeckServer.exe across
+        # tests, resetting it via /api/reset between them. Empty for a
+        # launch per test.
+        self.shared = os.getenv("BDSHARED", "")
+        # BDUPSTREAM=1, or the path of an UpstreamSettings JSON file, serves
+        # upstream downloads and scrapes from upstream_stand_in.py fixtures
+        self.upstream = os.getenv("BDUPSTREAM", "")
+        # secs between resource_sampler.py samples of the server, eg 1.
+        # 0, the default, for none
+        self.sample_secs = float(os.getenv("BDSAMPLESECS", "0"))
+        if self.shared not in SHARED_MODES:
+            raise ValueError(f"BDSHARED must be one of {SHARED_MODES}, not {self.shared}")
+        self.log_dir = os.getenv("BDLOGDIR", os.path.join(self.bdroot, "logs"))
+        # parallel_runner.py workers have their own tree, but share bin
+        self.bin_dir = os.getenv("BDBIN", os.path.join(self.bdtree, 'bin'))
+        self.use_tree(self.bdtree)
+
+    # Point at another copy of the tree, eg the scratch copy the int tests
+    # run against with BDUPSTREAM set. bin stays where it was.
+    def use_tree(self, tree):
+        self.bdtree = tree
+        self.is_deploy_tree = self.bdtree != self.bdroot
         self.launch_cfg_path = os.path.join(self.bdtree, 'cfg', 'int_test_config.json')
         self.backup_cfg_path = os.path.join(self.bdtree, 'cfg', 'int_test_config.json_backup')
         self.csv_dir_path = os.path.join(self.bdtree, 'data', 'csv')
@@ -0,0 +1,141 @@
+"""
+sample a BizDeck server's resource use over a test or soak run
+Records CPU %, RSS, thread count and handle count (fd count off Windows) of
+the server process, plus the count and total RSS of its child processes, eg
+the browsers it launches, at a fixed interval from a background thread. The
+time series is streamed to a CSV, and close() writes a JSON summary of the
+start, end and peak values, and the growth rate per minute of each, as
+leaks show as steady growth. BizDeckIntTestCase samples the server for every
+test when BDSAMPLESECS is set to the secs between samples. For soak runs:
+Usage: python resource_sampler.py [--pid N | --port 9271] [--interval 1] [--name soak]
+"""
+# std pkgs
+import argparse
+import json
+import os
+import threading
+import time
+# 3rd pty
+import psutil
+# bizdeck
+from bd_utils import configure_logging, find_bizdeck_process
+
+SERIES = ("cpu_percent", "rss_bytes", "threads", "handles", "children", "children_rss_bytes")
+
+
+# Least squares slope of ys against xs
+def slope(xs, ys):
+    count = len(xs)
+    if count < 2:
+        return 0.0
+    mean_x = sum(xs) / count
+    mean_y = sum(ys) / count
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    if not var_x:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var_x
+
+
+def handle_count(proc):
+    # num_handles is Windows only, num_fds everywhere else
+    if hasattr(proc, 'num_handles'):
+        return proc.num_handles()
+    return proc.num_fds()
+
+
+class ResourceSampler(object):
+    def __init__(self, pid, csv_path, json_path, interval=1.0, logger=None):
+        self.proc = psutil.Process(pid)
+        self.csv_path = csv_path
+        self.json_path = json_path
+        self.interval = interval
+        self.logger = logger or configure_logging("resource_sampler")
+        # (elapsed secs, sample dict) for the summary; a few numbers a
+        # sample, so even a day at 1s is only a few MB
+        self.samples = []
+        self.stopping = threading.Event()
+        self.start = time.monotonic()
+        # the first cpu_percent call just primes the counters
+        self.proc.cpu_percent(None)
+        self.thread = threading.Thread(target=self.sample_loop, name=f"ResourceSampler({pid})", daemon=True)
+        self.thread.start()
+
+    def sample(self):
+        with self.proc.oneshot():
+            values = dict(cpu_percent=self.proc.cpu_percent(None), rss_bytes=self.proc.memory_info().rss,
+                          threads=self.proc.num_threads(), handles=handle_count(self.proc))
+        children = self.proc.children(recursive=True)
+        children_rss = 0
+        for child in children:
+            try:
+                children_rss += child.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        values.update(children=len(children), children_rss_bytes=children_rss)
+        return values
+
+    def sample_loop(self):
+        with open(self.csv_path, 'wt') as csv_file:
+            csv_file.write(','.join(('elapsed_secs',) + SERIES) + '\n')
+            while not self.stopping.wait(self.interval):
+                try:
+                    values = self.sample()
+                except (psutil.NoSuchProcess, psutil.AccessDenied) as ex:
+                    self.logger.info(f"ResourceSampler: stopped sampling pid {self.proc.pid}: {ex}")
+                    return
+                elapsed = time.monotonic() - self.start
+                self.samples.append((elapsed, values))
+                csv_file.write(','.join(['%.3f' % elapsed] + [str(values[s]) for s in SERIES]) + '\n')
+                csv_file.flush()
+
+    # Stops sampling, writes the summary JSON and returns it
+    def close(self):
+        self.stopping.set()
+        self.thread.join()
+        summary = self.summary()
+        with open(self.json_path, 'wt') as json_file:
+            json_file.write(json.dumps(summary, indent=4))
+        return summary
+
+    def summary(self):
+        summary = dict(pid=self.proc.pid, interval=self.interval, samples=len(self.samples),
+                       seconds=self.samples[-1][0] if self.samples else 0.0, series=dict())
+        if not self.samples:
+            return summary
+        times = [elapsed for elapsed, values in self.samples]
+        for name in SERIES:
+            ys = [values[name] for elapsed, values in self.samples]
+            summary['series'][name] = dict(start=ys[0], end=ys[-1], peak=max(ys),
+                                           growth_per_min=60.0 * slope(times, ys))
+        return summary
+
+
+# Attach to the server by pid, or by the port it listens on, rather
+# than scanning every process for BizDeckServer.exe
+def find_server_pid(pid=None, port=None):
+    if pid:
+        return pid if psutil.pid_exists(pid) else None
+    proc_info = find_bizdeck_process(port=port)
+    return proc_info['pid'] if proc_info else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sample BizDeckServer.exe resource use until it exits")
+    parser.add_argument("--pid", type=int)
+    parser.add_argument("--port", type=int, default=9271)
+    parser.add_argument("--interval", type=float, default=1.0, help="secs between samples")
+    parser.add_argument("--name", default="soak", help="logs/<name>.resources.csv and .json")
+    args = parser.parse_args()
+    main_logger = configure_logging("resource_sampler")
+    server_pid = find_server_pid(args.pid, args.port)
+    if not server_pid:
+        raise SystemExit(f"no BizDeck process for pid {args.pid} or port {args.port}")
+    log_dir = os.getenv("BDLOGDIR", os.path.join(os.getenv("BDROOT", "."), "logs"))
+    sampler = ResourceSampler(server_pid, os.path.join(log_dir, f"{args.name}.resources.csv"),
+                              os.path.join(log_dir, f"{args.name}.resources.json"), args.interval, main_logger)
+    try:
+        while psutil.pid_exists(server_pid) and sampler.thread.is_alive():
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(sampler.close(), indent=4))
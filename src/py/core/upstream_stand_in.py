@@ -0,0 +1,275 @@
+"""
+local stand in for the upstream sites the int tests download and scrape from
+Serves recorded fixtures for the URLs in scripts/actions/*.json and
+scripts/steps/*.json, so those tests run offline, without rate limits, and
+with repeatable timings. https://www.quandl.com/api/v1/datasets/FRED/DED3.csv
+is served from fixtures/upstream/www.quandl.com/api/v1/datasets/FRED/DED3.csv
+as http://localhost:<port>/www.quandl.com/api/v1/datasets/FRED/DED3.csv.
+Query strings, eg auth tokens, are ignored, and a trailing / serves index.html.
+Latency, bandwidth throttling and error responses can be injected to see how
+the download and scrape paths behave against a slow or flaky upstream.
+BizDeckIntTestCase starts one per test when BDUPSTREAM is set, and runs the
+server against a scratch copy of BDTREE with the script URLs pointed at the
+stand in, so the scripts in BDTREE are never touched; see redirect_scripts.
+Usage: python upstream_stand_in.py serve [--port 9400] [--settings settings.json]
+       python upstream_stand_in.py record
+"""
+# std pkgs
+import argparse
+import fnmatch
+import glob
+import json
+import mimetypes
+import os
+import random
+import shutil
+import time
+from urllib.parse import urlsplit
+from urllib.request import urlopen
+# 3rd pty
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.web import Application, HTTPError, RequestHandler
+# bizdeck
+from bd_utils import configure_logging, ConfigHelper
+
+SCRIPT_DIRS = ("actions", "steps")
+# a throttled response is written in chunks this many times a sec
+THROTTLE_CHUNKS_PER_SEC = 10
+
+
+# Faults to inject. errors maps fnmatch patterns on the fixture path, eg
+# "www.quandl.com/*", to an HTTP status that's always returned. error_rate is
+# the chance of error_status for any other request, from a seeded RNG so that
+# runs are repeatable. bytes_per_sec of 0 means no throttling.
+class UpstreamSettings(object):
+    def __init__(self, latency_ms=0, jitter_ms=0, bytes_per_sec=0, error_rate=0.0,
+                 error_status=503, errors=None, seed=42):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.bytes_per_sec = bytes_per_sec
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.errors = errors or dict()
+        self.seed = seed
+
+    # BDUPSTREAM=1 for the defaults, otherwise the path of a settings JSON file
+    @classmethod
+    def from_env_value(cls, value):
+        if value in ("", "1"):
+            return cls()
+        with open(value, "rt") as settings_file:
+            return cls(**json.loads(settings_file.read()))
+
+
+class UpstreamHandler(RequestHandler):
+    def initialize(self, stand_in):
+        self.stand_in = stand_in
+
+    async def get(self, path):
+        start = time.monotonic()
+        stand_in = self.stand_in
+        settings = stand_in.settings
+        if path == "" or path.endswith("/"):
+            path += "index.html"
+        delay_ms = settings.latency_ms + stand_in.rng.uniform(0, settings.jitter_ms)
+        if delay_ms:
+            await gen.sleep(delay_ms / 1000.0)
+        status = stand_in.injected_status(path)
+        if status:
+            stand_in.record(path, status, 0, start)
+            raise HTTPError(status, f"injected for {path}")
+        fixture_path = stand_in.fixture_path(path)
+        if not fixture_path:
+            stand_in.record(path, 404, 0, start)
+            stand_in.logger.error(f"UpstreamHandler: no fixture for {path}")
+            raise HTTPError(404, f"no fixture for {path}")
+        with open(fixture_path, "rb") as fixture_file:
+            body = fixture_file.read()
+        content_type = mimetypes.guess_type(fixture_path)[0] or "application/octet-stream"
+        self.set_header("Content-Type", content_type)
+        if settings.bytes_per_sec:
+            chunk_size = max(1, settings.bytes_per_sec // THROTTLE_CHUNKS_PER_SEC)
+            for offset in range(0, len(body), chunk_size):
+                self.write(body[offset:offset + chunk_size])
+                await self.flush()
+                await gen.sleep(1.0 / THROTTLE_CHUNKS_PER_SEC)
+        else:
+            self.write(body)
+        stand_in.record(path, 200, len(body), start)
+
+
+class UpstreamStandIn(object):
+    def __init__(self, fixture_root, settings=None, logger=None):
+        self.fixture_root = os.path.abspath(fixture_root)
+        self.settings = settings or UpstreamSettings()
+        self.rng = random.Random(self.settings.seed)
+        self.logger = logger or configure_logging("upstream_stand_in")
+        # one dict per request served, for stats
+        self.requests = []
+
+    def application(self):
+        return Application([(r"/(.*)", UpstreamHandler, dict(stand_in=self))])
+
+    # Fixture paths must stay under the fixture root
+    def fixture_path(self, path):
+        fixture_path = os.path.abspath(os.path.join(self.fixture_root, path))
+        if not fixture_path.startswith(self.fixture_root + os.sep) or not os.path.isfile(fixture_path):
+            return None
+        return fixture_path
+
+    def injected_status(self, path):
+        for pattern, status in self.settings.errors.items():
+            if fnmatch.fnmatch(path, pattern):
+                return status
+        if self.settings.error_rate and self.rng.random() < self.settings.error_rate:
+            return self.settings.error_status
+        return None
+
+    def record(self, path, status, nbytes, start):
+        seconds = time.monotonic() - start
+        self.requests.append(dict(path=path, status=status, bytes=nbytes, seconds=seconds))
+        self.logger.info(f"UpstreamStandIn: {status} {path} {nbytes} bytes in {seconds:.3f}s")
+
+    def stats(self):
+        by_path = dict()
+        for request in self.requests:
+            path_stats = by_path.setdefault(request["path"], dict(requests=0, bytes=0, seconds=0.0, statuses=dict()))
+            path_stats["requests"] += 1
+            path_stats["bytes"] += request["bytes"]
+            path_stats["seconds"] += request["seconds"]
+            status = str(request["status"])
+            path_stats["statuses"][status] = path_stats["statuses"].get(status, 0) + 1
+        return dict(requests=len(self.requests), paths=by_path)
+
+
+def is_upstream_url(url):
+    return isinstance(url, str) and url.strip().startswith(("http://", "https://"))
+
+
+# http(s)://host/path?query => base_url/host/path?query
+def redirect_url(url, base_url):
+    parts = urlsplit(url.strip())
+    redirected = f"{base_url}/{parts.netloc}{parts.path or '/'}"
+    return f"{redirected}?{parts.query}" if parts.query else redirected
+
+
+def script_paths(tree):
+    paths = []
+    for script_dir in SCRIPT_DIRS:
+        paths.extend(sorted(glob.glob(os.path.join(tree, "scripts", script_dir, "*.json"))))
+    return paths
+
+
+# Every "url" value in a script, including those in steps assertedEvents
+def find_urls(node, found=None):
+    found = [] if found is None else found
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == "url" and is_upstream_url(value):
+                found.append(value)
+            else:
+                find_urls(value, found)
+    elif isinstance(node, list):
+        for value in node:
+            find_urls(value, found)
+    return found
+
+
+def rewrite_urls(node, base_url):
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == "url" and is_upstream_url(value):
+                node[key] = redirect_url(value, base_url)
+            else:
+                rewrite_urls(value, base_url)
+    elif isinstance(node, list):
+        for value in node:
+            rewrite_urls(value, base_url)
+
+
+# Copy tree into root_dir for the server to run from, minus anything it
+# doesn't need, and return the copy's path
+def copy_tree(tree, root_dir):
+    copy = os.path.join(root_dir, "tree")
+    shutil.copytree(tree, copy, ignore=shutil.ignore_patterns(".git", "bin", "obj", "logs", "venv", "*_backup"))
+    os.makedirs(os.path.join(copy, "logs"))
+    return copy
+
+
+# Write the scripts in source_tree that have upstream URLs to the same
+# paths under target_tree, a copy_tree copy, pointed at the stand in.
+# source_tree is only read. Returns the paths written.
+def redirect_scripts(source_tree, target_tree, base_url):
+    written = []
+    for path in script_paths(source_tree):
+        with open(path, "rt") as script_file:
+            try:
+                script = json.loads(script_file.read())
+            except ValueError:
+                continue
+        if not find_urls(script):
+            continue
+        rewrite_urls(script, base_url)
+        target_path = os.path.join(target_tree, os.path.relpath(path, source_tree))
+        with open(target_path, "wt") as script_file:
+            script_file.write(json.dumps(script, indent=4))
+        written.append(target_path)
+    return written
+
+
+def fixture_relpath(url):
+    parts = urlsplit(url.strip())
+    path = parts.path or "/"
+    if path.endswith("/"):
+        path += "index.html"
+    return parts.netloc + path
+
+
+# Fetch every upstream URL in the scripts under tree that doesn't already
+# have a fixture. Sites that need a login, eg the cargo scraper's, have to
+# be saved from a browser session by hand.
+def record_fixtures(tree, fixture_root, logger):
+    for path in script_paths(tree):
+        with open(path, "rt") as script_file:
+            try:
+                urls = find_urls(json.loads(script_file.read()))
+            except ValueError:
+                continue
+        for url in urls:
+            fixture_path = os.path.join(fixture_root, fixture_relpath(url))
+            if os.path.exists(fixture_path):
+                continue
+            try:
+                with urlopen(url.strip(), timeout=30) as response:
+                    body = response.read()
+            except OSError as ex:
+                logger.error(f"record_fixtures: {url} from {path}: {ex}")
+                continue
+            os.makedirs(os.path.dirname(fixture_path), exist_ok=True)
+            with open(fixture_path, "wb") as fixture_file:
+                fixture_file.write(body)
+            logger.info(f"record_fixtures: {url} saved to {fixture_path}")
+
+
+def default_fixture_root(ch):
+    return os.path.join(ch.bdroot, "src", "py", "tests", "int", "fixtures", "upstream")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve or record upstream fixtures for the int tests")
+    parser.add_argument("command", choices=["serve", "record"])
+    parser.add_argument("--port", type=int, default=9400)
+    parser.add_argument("--settings", default="", help="UpstreamSettings JSON file")
+    parser.add_argument("--fixtures", help="fixture root, defaults to src/py/tests/int/fixtures/upstream")
+    args = parser.parse_args()
+    main_logger = configure_logging("upstream_stand_in")
+    config_helper = ConfigHelper()
+    fixture_dir = args.fixtures or default_fixture_root(config_helper)
+    if args.command == "record":
+        record_fixtures(config_helper.bdroot, fixture_dir, main_logger)
+    else:
+        stand_in = UpstreamStandIn(fixture_dir, UpstreamSettings.from_env_value(args.settings), main_logger)
+        stand_in.application().listen(args.port)
+        main_logger.info(f"upstream_stand_in: serving {fixture_dir} on port {args.port}")
+        IOLoop.current().start()
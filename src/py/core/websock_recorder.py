@@ -0,0 +1,102 @@
+# Streams websock messages to a JSONL file, one {"received": epoch secs,
+# "message": msg} line each, from a background thread, so the IOLoop never
+# waits on disk and nothing is held in memory after it's written. Keeps
+# running counts and bytes per message type, plus log2 histograms of message
+# sizes and inter-arrival times, for soak tests that run for hours.
+# std pkg
+import json
+import queue
+import threading
+import time
+
+WRITE_BUFFER_BYTES = 1 << 16
+FLUSH_SECS = 1.0
+# stops the writer thread
+STOP = object()
+
+
+# Buckets are <=first, <=2*first ... <=first*2**(count-1), and a final
+# bucket for bigger values
+class Log2Histogram(object):
+    def __init__(self, first, count):
+        self.bounds = [first * 2 ** b for b in range(count)]
+        self.counts = [0] * (count + 1)
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        index = next((b for b, bound in enumerate(self.bounds) if value <= bound), len(self.bounds))
+        self.counts[index] += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def to_dict(self):
+        labels = ["<=%g" % bound for bound in self.bounds] + [">%g" % self.bounds[-1]]
+        samples = sum(self.counts)
+        return dict(samples=samples, min=self.min, max=self.max,
+                    mean=self.total / samples if samples else None,
+                    buckets={label: count for label, count in zip(labels, self.counts) if count})
+
+
+class WebsockRecorder(object):
+    def __init__(self, path):
+        self.path = path
+        self.queue = queue.Queue()
+        self.count = 0
+        self.nbytes = 0
+        self.by_type = dict()
+        self.size_bytes = Log2Histogram(64, 19)
+        self.inter_arrival_ms = Log2Histogram(1, 17)
+        self.first_received = None
+        self.last_received = None
+        self.thread = threading.Thread(target=self.write_loop, name=f"WebsockRecorder({path})", daemon=True)
+        self.thread.start()
+
+    # Called on the IOLoop thread with the raw message and its decoded dict
+    def record(self, msg, msg_dict):
+        received = time.time()
+        mtype = msg_dict.get('type', 'notype')
+        type_stats = self.by_type.setdefault(mtype, dict(count=0, bytes=0))
+        type_stats['count'] += 1
+        type_stats['bytes'] += len(msg)
+        self.count += 1
+        self.nbytes += len(msg)
+        self.size_bytes.add(len(msg))
+        if self.last_received is not None:
+            self.inter_arrival_ms.add(1000.0 * (received - self.last_received))
+        else:
+            self.first_received = received
+        self.last_received = received
+        self.queue.put((received, msg_dict))
+
+    def write_loop(self):
+        with open(self.path, 'wt', buffering=WRITE_BUFFER_BYTES) as jsonl_file:
+            last_flush = time.monotonic()
+            while True:
+                try:
+                    item = self.queue.get(timeout=FLUSH_SECS)
+                except queue.Empty:
+                    item = None
+                if item is STOP:
+                    return
+                if item:
+                    received, msg_dict = item
+                    jsonl_file.write(json.dumps(dict(received=received, message=msg_dict)) + '\n')
+                if time.monotonic() - last_flush >= FLUSH_SECS:
+                    jsonl_file.flush()
+                    last_flush = time.monotonic()
+
+    # Drains the queue, closes the file and returns the stats
+    def close(self):
+        self.queue.put(STOP)
+        self.thread.join()
+        return self.stats()
+
+    def stats(self):
+        seconds = self.last_received - self.first_received if self.count > 1 else 0.0
+        return dict(path=self.path, messages=self.count, bytes=self.nbytes, seconds=seconds,
+                    messages_per_sec=(self.count - 1) / seconds if seconds else None,
+                    by_type=self.by_type, size_bytes=self.size_bytes.to_dict(),
+                    inter_arrival_ms=self.inter_arrival_ms.to_dict())
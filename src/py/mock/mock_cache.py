@@ -1,15 +1,231 @@
+# Python reference implementation of the C# DataCache, used by the unit
+# tests and benchmarks, and for prototyping cache policies before they go
+# into the server. Like the C# original it's a dict of groups, each a dict
+# of cache keys to CacheEntry. On top of that it accounts for the bytes
+# each entry would use as .Net objects, and can enforce a byte budget by
+# evicting least recently used entries across all groups. Pinned entries
+# are never evicted. Hit, miss and eviction counts are kept for load tests.
+from array import array
+from collections import OrderedDict
+import threading
+
+
 class CacheEntry(object):
-    def __init__(self, val_dict, row_key, headers):
-        self.type = "PrimaryKeyCSV"
+    def __init__(self, val_dict, row_key, headers, entry_type="PrimaryKeyCSV"):
+        self.type = entry_type
         self.value = val_dict
         self.row_key = row_key
         self.headers = headers
+        # set by DataCache.store when it's accounting for bytes
+        self.nbytes = 0
 
+    # C# CacheEntry accessors, used by actions that read the cache
+    @property
+    def Type(self):
+        return self.type
 
-class DataCache(object):
+    @property
+    def CacheValue(self):
+        return self.value
+
+    @property
+    def RowKey(self):
+        return self.row_key or ""
+
+    @property
+    def Headers(self):
+        return self.headers
+
+    @property
+    def Count(self):
+        if self.type == "ColumnarCSV":
+            return len(next(iter(self.value.values()))) if self.value else 0
+        return len(self.value)
+
+    @property
+    def AsDict(self):
+        return self.value if self.type == "PrimaryKeyCSV" else None
+
+    @property
+    def AsList(self):
+        return self.value if self.type == "RegularCSV" else None
+
+    @property
+    def AsColumns(self):
+        return self.value if self.type == "ColumnarCSV" else None
+
+
+# Approximate .Net x64 sizes. Objects have a 16 byte header and method table
+# pointer. Strings add a 4 byte length and UTF-16 chars with a null, rounded
+# up to 8. Arrays add an 8 byte length. A Dictionary has a 80 byte object,
+# plus a 4 byte bucket and a 24 byte entry per item. A List adds 8 bytes a
+# slot to its 40 bytes. Strings shared within an entry, eg by dictionary
+# encoding, are counted once.
+OBJECT_BYTES = 16
+DICTIONARY_BYTES = 80
+DICTIONARY_ITEM_BYTES = 28
+LIST_BYTES = 40
+REFERENCE_BYTES = 8
+DOUBLE_BYTES = 8
+
+
+def string_bytes(value):
+    return (22 + 2 * len(value) + 7) & ~7
+
+
+class ByteCounter(object):
     def __init__(self):
+        self.nbytes = 0
+        self.seen = set()
+
+    def add_string(self, value):
+        if value is None or id(value) in self.seen:
+            return
+        self.seen.add(id(value))
+        self.nbytes += string_bytes(value)
+
+    def add_dictionary(self, count):
+        self.nbytes += DICTIONARY_BYTES + DICTIONARY_ITEM_BYTES * count
+
+    def add_row(self, row):
+        self.add_dictionary(len(row))
+        for name, value in row.items():
+            self.add_string(name)
+            self.add_string(value)
+
+
+def entry_bytes(entry):
+    counter = ByteCounter()
+    for name in entry.headers or ():
+        counter.add_string(name)
+    value = entry.value
+    if entry.type == "ColumnarCSV":
+        counter.add_dictionary(len(value))
+        for name, column in value.items():
+            counter.add_string(name)
+            counter.nbytes += OBJECT_BYTES + REFERENCE_BYTES
+            if isinstance(column, array) and column.typecode == 'd':
+                counter.nbytes += DOUBLE_BYTES * len(column)
+            else:
+                counter.nbytes += REFERENCE_BYTES * len(column)
+                for cell in column:
+                    counter.add_string(cell)
+    elif entry.type == "PrimaryKeyCSV":
+        counter.add_dictionary(len(value))
+        for key_value, row in value.items():
+            counter.add_string(key_value)
+            counter.add_row(row)
+    else:
+        counter.nbytes += LIST_BYTES + REFERENCE_BYTES * len(value)
+        for row in value:
+            counter.add_row(row)
+    return counter.nbytes
+
+
+class DataCache(object):
+    # budget_bytes: evict LRU entries to stay under this, or None for no limit
+    # on_evict: optional callable(group, cache_key, entry) called on eviction
+    # account_bytes: size entries even with no budget, for Stats. Off by
+    #                default, so loader benchmarks don't pay for it
+    def __init__(self, budget_bytes=None, on_evict=None, account_bytes=False):
         self.cache = dict()
+        self.budget_bytes = budget_bytes
+        self.account_bytes = account_bytes or budget_bytes is not None
+        self.on_evict = on_evict
+        # (group, cache_key) in least to most recently used order
+        self.lru = OrderedDict()
+        self.pinned = set()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.lock = threading.RLock()
 
     def Insert(self, group, cache_key, cs_cache_entry, row_key, column_names):
-        group_dict = self.cache.setdefault(group, dict())
-        group_dict[cache_key] = CacheEntry(cs_cache_entry, row_key, column_names)
+        entry_type = "PrimaryKeyCSV" if row_key else "RegularCSV"
+        self.store(group, cache_key, CacheEntry(cs_cache_entry, row_key, column_names, entry_type))
+
+    def InsertColumns(self, group, cache_key, cs_cache_entry, row_key, column_names):
+        self.store(group, cache_key, CacheEntry(cs_cache_entry, row_key, column_names, "ColumnarCSV"))
+
+    def GetCacheEntry(self, group, cache_key):
+        with self.lock:
+            entry = self.cache.get(group, dict()).get(cache_key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.lru.move_to_end((group, cache_key))
+            return entry
+
+    # copies taken under the lock, so callers can iterate while other
+    # threads insert or evict
+    def GetGroupNames(self):
+        with self.lock:
+            return list(self.cache.keys())
+
+    def GetCacheKeys(self, group):
+        with self.lock:
+            return list(self.cache.get(group, dict()).keys())
+
+    # Pinned entries are never evicted. An entry can be pinned before
+    # it's inserted, eg to protect reference data loaded at startup.
+    def Pin(self, group, cache_key):
+        with self.lock:
+            self.pinned.add((group, cache_key))
+
+    def Unpin(self, group, cache_key):
+        with self.lock:
+            self.pinned.discard((group, cache_key))
+            self.evict()
+
+    def Remove(self, group, cache_key):
+        with self.lock:
+            entry = self.cache.get(group, dict()).pop(cache_key, None)
+            if entry is None:
+                return None
+            if not self.cache[group]:
+                del self.cache[group]
+            del self.lru[(group, cache_key)]
+            self.total_bytes -= entry.nbytes
+            return entry
+
+    def Stats(self):
+        with self.lock:
+            return dict(entries=len(self.lru), bytes=self.total_bytes, budget_bytes=self.budget_bytes,
+                        pinned=len(self.pinned), hits=self.hits, misses=self.misses,
+                        evictions=self.evictions, evicted_bytes=self.evicted_bytes)
+
+    def store(self, group, cache_key, entry):
+        if self.account_bytes:
+            entry.nbytes = entry_bytes(entry)
+        with self.lock:
+            self.Remove(group, cache_key)
+            self.cache.setdefault(group, dict())[cache_key] = entry
+            self.lru[(group, cache_key)] = entry
+            self.total_bytes += entry.nbytes
+            self.evict(keep=(group, cache_key))
+
+    # Evict until we're within budget. keep is the entry being inserted,
+    # which we never evict: an entry bigger than the budget stays, alone.
+    def evict(self, keep=None):
+        if self.budget_bytes is None:
+            return
+        while self.total_bytes > self.budget_bytes:
+            victim = self.choose_victim(keep)
+            if victim is None:
+                return
+            entry = self.Remove(*victim)
+            self.evictions += 1
+            self.evicted_bytes += entry.nbytes
+            if self.on_evict:
+                self.on_evict(victim[0], victim[1], entry)
+
+    # The LRU policy: the least recently used unpinned entry. Override
+    # to prototype other policies.
+    def choose_victim(self, keep=None):
+        for group_key in self.lru:
+            if group_key != keep and group_key not in self.pinned:
+                return group_key
+        return None
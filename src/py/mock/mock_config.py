@@ -0,0 +1,33 @@
+# CPython stand ins for the config BizDeckPython.cs passes to actions.py
+# as the HttpFormatMap and Secrets globals. Loaded the same way as
+# ConfigHelper.LoadConfig loads them.
+import json
+from mock_containers import Dictionary
+
+
+# Mirrors the C# HttpFormat class in ConfigHelper.cs
+class HttpFormat(object):
+    def __init__(self, format, values):
+        self.Format = format
+        self.Values = values
+
+
+def load_http_formats(path):
+    with open(path, "rt") as formats_file:
+        formats = json.loads(formats_file.read())
+    http_format_map = Dictionary[str, Dictionary[str, HttpFormat]]()
+    for url_sub_string, spec_dict in formats.items():
+        spec_map = Dictionary[str, HttpFormat]()
+        for spec_key, spec in spec_dict.items():
+            spec_map.Add(spec_key, HttpFormat(spec["format"], spec["values"]))
+        http_format_map.Add(url_sub_string, spec_map)
+    return http_format_map
+
+
+def load_secrets(path):
+    with open(path, "rt") as secrets_file:
+        secrets = json.loads(secrets_file.read())
+    secrets_dict = Dictionary[str, str]()
+    for key, value in secrets.items():
+        secrets_dict.Add(key, value)
+    return secrets_dict
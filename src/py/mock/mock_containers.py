@@ -0,0 +1,83 @@
+# Plain Python stand ins for the .Net types actions.py marshals into:
+# System.Array and System.Collections.Generic List and Dictionary. They
+# support just the members actions.py and the unit tests use, so the
+# ActionFunction subclasses can run, be profiled and benchmarked under
+# CPython. Generic type args are accepted and ignored, so the IronPython
+# idioms List[str](), Dictionary[str, str]() and Array[float](seq) work.
+from array import array
+
+
+class GenericType(object):
+    def __init__(self, impl_factory):
+        self.impl_factory = impl_factory
+
+    def __getitem__(self, type_args):
+        return self.impl_factory(type_args)
+
+
+class MockList(list):
+    def Add(self, value):
+        self.append(value)
+
+    @property
+    def Count(self):
+        return len(self)
+
+
+class MockDictionary(dict):
+    def Add(self, key, value):
+        if key in self:
+            raise ValueError("An item with the same key has already been added. Key: %s" % key)
+        self[key] = value
+
+    def ContainsKey(self, key):
+        return key in self
+
+    def Remove(self, key):
+        if key not in self:
+            return False
+        del self[key]
+        return True
+
+    @property
+    def Count(self):
+        return len(self)
+
+    # Views, as .Net's KeyCollection and ValueCollection are: no copy per
+    # access, so benchmarks don't time the mock
+    @property
+    def Keys(self):
+        return self.keys()
+
+    @property
+    def Values(self):
+        return self.values()
+
+
+# double[] is backed by a contiguous array('d'), like the .Net original.
+# Other element types get a list.
+class MockDoubleArray(array):
+    def __new__(cls, values=()):
+        return super().__new__(cls, 'd', values)
+
+    @property
+    def Length(self):
+        return len(self)
+
+
+class MockArray(list):
+    @property
+    def Length(self):
+        return len(self)
+
+
+def array_factory(element_type):
+    if element_type is float:
+        return MockDoubleArray
+    return MockArray
+
+
+List = GenericType(lambda type_args: MockList)
+Dictionary = GenericType(lambda type_args: MockDictionary)
+Array = GenericType(array_factory)
+Object = object
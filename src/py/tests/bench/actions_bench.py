@@ -0,0 +1,169 @@
+"""
+benchmark the BizDeck core actions loaders
+Generates synthetic date keyed numeric CSVs of various sizes and widths
+in a scratch BDROOT, and times each loader in actions.py against them.
+Reports rows/sec, peak and retained memory and marshalling cost, where marshalling
+cost is the loader time minus the time to just parse the same rows with
+csv.DictReader. Runs under CPython with the mock containers, or under
+IronPython with .Net containers, where peak memory is not available.
+Usage: python actions_bench.py [--rows 1000,10000] [--cols 13,50] [--json out.json]
+"""
+# std pkgs
+import argparse
+from csv import DictReader
+import datetime
+import gc
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+# tracemalloc is CPython only
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+# src/py/core
+import actions
+# src/py/mock
+from mock_logger import Logger
+from mock_cache import DataCache
+
+DEFAULT_ROWS = "1000,10000,100000"
+DEFAULT_COLS = "13,50"
+DEFAULT_REPEAT = 3
+DATE_ORIGIN = datetime.date(2023, 7, 3)
+
+# name, action function name, extra params. NB params are passed as strings,
+# as ActionsDriver.RunPythonAction does in the server
+LOADERS = [
+    ("dict_keyed", "add_csv_to_cache_as_dict", dict(row_key="Date")),
+    ("dict_list", "add_csv_to_cache_as_dict", dict()),
+    ("dict_encoded", "add_csv_to_cache_as_dict", dict(encode_strings="True")),
+    ("dict_head5", "add_csv_to_cache_as_dict", dict(row_key="Date", max_lines="5")),
+    ("dict_tail5", "add_csv_to_cache_as_dict", dict(row_key="Date", max_lines="5", read_mode="tail")),
+    ("columns", "add_csv_to_cache_as_columns", dict(row_key="Date")),
+    ("columns_schema", "add_csv_to_cache_as_columns", dict(row_key="Date", schema="use")),
+]
+
+
+# Latest row first, like quandl's yield.csv, with a sprinkling of blanks
+def generate_csv(path, rows, cols, seed=42):
+    rng = random.Random(seed)
+    with open(path, "wt") as csv_file:
+        csv_file.write(",".join(["Date"] + ["C%d" % c for c in range(1, cols)]) + "\n")
+        for r in range(rows):
+            date = (DATE_ORIGIN - datetime.timedelta(days=r)).isoformat()
+            cells = ["" if rng.random() < 0.02 else "%.2f" % rng.uniform(0, 8) for c in range(1, cols)]
+            csv_file.write(",".join([date] + cells) + "\n")
+
+
+def rows_loaded(rows, params):
+    return min(rows, int(params.get("max_lines", rows)))
+
+
+def time_parse_only(csv_path, max_rows):
+    start = time.perf_counter()
+    with open(csv_path, "rt") as csv_file:
+        for index, row in enumerate(DictReader(csv_file)):
+            if index + 1 >= max_rows:
+                break
+    return time.perf_counter() - start
+
+
+def run_loader(func_name, group, csv_name, params, trace=False):
+    cache = DataCache()
+    param_dict = actions.Dictionary[str, object]()
+    param_dict.Add("cache", cache)
+    param_dict.Add("group", group)
+    param_dict.Add("csv", csv_name)
+    for key, value in params.items():
+        param_dict.Add(key, value)
+    func = getattr(actions, func_name)
+    gc.collect()
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    rv = func(param_dict)
+    elapsed = time.perf_counter() - start
+    memory = None
+    if trace:
+        # current is what the cache entry retains, as cache is still live
+        memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    if rv:
+        raise Exception("%s failed: %s" % (func_name, rv))
+    return elapsed, memory
+
+
+# tracemalloc slows allocation heavy code a lot, so we take timings
+# and memory from separate runs
+def measure_loader(func_name, group, csv_name, params, repeat):
+    elapsed = min(run_loader(func_name, group, csv_name, params)[0] for r in range(repeat))
+    retained, peak = None, None
+    if tracemalloc:
+        retained, peak = run_loader(func_name, group, csv_name, params, True)[1]
+    return elapsed, retained, peak
+
+
+def run_benchmarks(row_counts, col_counts, repeat):
+    results = []
+    bdroot = tempfile.mkdtemp(prefix="bdbench")
+    csv_dir = os.path.join(bdroot, "data", "csv")
+    os.makedirs(csv_dir)
+    actions.BDRoot = bdroot
+    actions.Logger = Logger()
+    try:
+        for rows in row_counts:
+            for cols in col_counts:
+                csv_name = "bench_%d_%d.csv" % (rows, cols)
+                csv_path = os.path.join(csv_dir, csv_name)
+                generate_csv(csv_path, rows, cols)
+                for name, func_name, params in LOADERS:
+                    loaded = rows_loaded(rows, params)
+                    # best of repeat, as is usual for timing
+                    elapsed, retained, peak = measure_loader(func_name, "bench", csv_name, params, repeat)
+                    parse = min(time_parse_only(csv_path, loaded) for r in range(repeat))
+                    results.append(dict(loader=name, rows=rows, cols=cols, rows_loaded=loaded,
+                                        seconds=elapsed, rows_per_sec=loaded / elapsed if elapsed else 0.0,
+                                        peak_bytes=peak, retained_bytes=retained, parse_seconds=parse,
+                                        marshal_seconds=max(elapsed - parse, 0.0)))
+    finally:
+        shutil.rmtree(bdroot, ignore_errors=True)
+    return results
+
+
+def format_table(results):
+    lines = ["%-14s %8s %5s %8s %10s %12s %10s %12s %10s" % (
+        "loader", "rows", "cols", "loaded", "secs", "rows/sec", "peak_kb", "retained_kb", "marshal%")]
+    for r in results:
+        peak_kb = kb_text(r["peak_bytes"])
+        retained_kb = kb_text(r["retained_bytes"])
+        marshal_pct = 100.0 * r["marshal_seconds"] / r["seconds"] if r["seconds"] else 0.0
+        lines.append("%-14s %8d %5d %8d %10.4f %12.0f %10s %12s %10.1f" % (
+            r["loader"], r["rows"], r["cols"], r["rows_loaded"], r["seconds"],
+            r["rows_per_sec"], peak_kb, retained_kb, marshal_pct))
+    return "\n".join(lines)
+
+
+def kb_text(nbytes):
+    return "%d" % (nbytes // 1024) if nbytes is not None else "n/a"
+
+
+def parse_int_list(text):
+    return [int(t) for t in text.split(",") if t]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the actions.py CSV loaders")
+    parser.add_argument("--rows", default=DEFAULT_ROWS, help="comma separated row counts")
+    parser.add_argument("--cols", default=DEFAULT_COLS, help="comma separated column counts")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--json", help="path to write results as JSON")
+    args = parser.parse_args()
+    bench_results = run_benchmarks(parse_int_list(args.rows), parse_int_list(args.cols), args.repeat)
+    print(format_table(bench_results))
+    if args.json:
+        with open(args.json, "wt") as json_file:
+            json_file.write(json.dumps(bench_results, indent=4))
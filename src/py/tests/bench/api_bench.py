@@ -0,0 +1,218 @@
+"""
+load test the BizDeck HTTP API
+Drives a weighted mix of requests at the status, config, cache, excel and
+run actions endpoints from many concurrent clients, for a fixed duration or
+request count, at each of a list of concurrency levels. Reports throughput
+and p50/p95/p99 latency per endpoint and level, so we can see where the
+server saturates. Uses the int test config to find the server, which must
+be running, unless --start launches BizDeckServer.exe from the deploy tree
+as the int tests do. --setup runs actions first, eg to load the cache
+entry the cache and excel endpoints read.
+Usage: python api_bench.py [--concurrency 1,8,32,128] [--duration 10] [--requests N]
+                           [--mix status=1,cache=4,excel=2] [--setup load_quandl_yield] [--json out.json]
+"""
+# std pkgs
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import subprocess
+import time
+# 3rd pty
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+# bizdeck
+from bd_utils import configure_logging, ConfigHelper
+
+DEFAULT_CONCURRENCY = "1,8,32,128"
+DEFAULT_DURATION = 10.0
+DEFAULT_MIX = "status=1,config=1,cache=4,excel=2"
+DEFAULT_CACHE_KEY = "quandl/yield_csv"
+DEFAULT_ACTIONS = "load_quandl_yield"
+REQUEST_TIMEOUT = 30
+READY_TIMEOUT = 15
+PERCENTILES = (50, 95, 99)
+
+# configured in __main__, so websock_bench can import our helpers
+logger = logging.getLogger("api_bench")
+
+
+def endpoint_paths(cache_key, actions_name):
+    return dict(status="/api/status", config="/api/config", cache=f"/api/cache/{cache_key}",
+                excel=f"/excel/{cache_key}", actions=f"/api/run/actions/{actions_name}")
+
+
+def parse_mix(text, paths):
+    mix = []
+    for item in text.split(","):
+        name, weight = item.split("=")
+        if name not in paths:
+            raise ValueError(f"unknown endpoint {name}, expected one of {sorted(paths)}")
+        mix.append((name, float(weight)))
+    return mix
+
+
+# Nearest rank percentile of sorted values
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class LoadRun(object):
+    def __init__(self, base_url, paths, mix, concurrency, duration, request_count, seed=42):
+        self.base_url = base_url
+        self.paths = paths
+        self.names = [name for name, weight in mix]
+        self.weights = [weight for name, weight in mix]
+        self.concurrency = concurrency
+        self.duration = duration
+        self.request_count = request_count
+        self.rng = random.Random(seed)
+        self.http_client = AsyncHTTPClient(force_instance=True, max_clients=concurrency)
+        self.latencies = {name: [] for name in self.names}
+        self.errors = {name: 0 for name in self.names}
+        self.issued = 0
+
+    def more(self, deadline):
+        if self.request_count:
+            return self.issued < self.request_count
+        return time.monotonic() < deadline
+
+    async def client(self, deadline):
+        while self.more(deadline):
+            self.issued += 1
+            name = self.rng.choices(self.names, self.weights)[0]
+            start = time.monotonic()
+            try:
+                response = await self.http_client.fetch(self.base_url + self.paths[name], raise_error=False,
+                                                        request_timeout=REQUEST_TIMEOUT)
+                ok = response.code == 200
+            except (OSError, HTTPClientError, StreamClosedError):
+                ok = False
+            if ok:
+                self.latencies[name].append(time.monotonic() - start)
+            else:
+                self.errors[name] += 1
+
+    async def run(self):
+        start = time.monotonic()
+        await gen.multi([self.client(start + self.duration) for c in range(self.concurrency)])
+        elapsed = time.monotonic() - start
+        self.http_client.close()
+        return self.results(elapsed)
+
+    def results(self, elapsed):
+        results = []
+        for name in self.names:
+            latencies = sorted(self.latencies[name])
+            result = dict(endpoint=name, concurrency=self.concurrency, seconds=elapsed, ok=len(latencies),
+                          errors=self.errors[name], rps=len(latencies) / elapsed if elapsed else 0.0,
+                          mean_ms=1000.0 * sum(latencies) / len(latencies) if latencies else 0.0,
+                          max_ms=1000.0 * latencies[-1] if latencies else 0.0)
+            for pct in PERCENTILES:
+                result[f"p{pct}_ms"] = 1000.0 * percentile(latencies, pct)
+            results.append(result)
+        return results
+
+
+async def wait_for_status(base_url, timeout=READY_TIMEOUT):
+    http_client = AsyncHTTPClient()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = await http_client.fetch(base_url + "/api/status", request_timeout=1)
+            if response.code == 200:
+                return True
+        except (OSError, HTTPClientError, StreamClosedError):
+            pass
+        await gen.sleep(0.1)
+    return False
+
+
+async def run_setup(base_url, actions_names):
+    http_client = AsyncHTTPClient()
+    for actions_name in actions_names:
+        response = await http_client.fetch(f"{base_url}/api/run/actions/{actions_name}",
+                                           request_timeout=REQUEST_TIMEOUT)
+        logger.info(f"run_setup: {actions_name} retcode[{response.code}]")
+
+
+def server_url(ch):
+    with open(ch.launch_cfg_path, "rt") as config_file:
+        port = json.loads(config_file.read()).get("http_server_port")
+    return f"http://localhost:{port}"
+
+
+def start_server(ch):
+    return subprocess.Popen([os.path.join(ch.bin_dir, "BizDeckServer.exe"), "--config", ch.launch_cfg_path])
+
+
+async def stop_server(proc, base_url):
+    try:
+        await AsyncHTTPClient().fetch(base_url + "/api/shutdown", raise_error=False)
+    except (OSError, StreamClosedError) as ex:
+        logger.info(f"stop_server: BizDeckServer.exe terminated before serving shutdown response: {ex}")
+    proc.wait(timeout=5)
+
+
+async def run_benchmarks(args):
+    ch = ConfigHelper()
+    base_url = server_url(ch)
+    proc = start_server(ch) if args.start else None
+    try:
+        if not await wait_for_status(base_url):
+            raise Exception(f"BizDeck not answering on {base_url}")
+        if args.setup:
+            await run_setup(base_url, args.setup.split(","))
+        paths = endpoint_paths(args.cache_key, args.actions)
+        mix = parse_mix(args.mix, paths)
+        results = []
+        for concurrency in parse_int_list(args.concurrency):
+            load_run = LoadRun(base_url, paths, mix, concurrency, args.duration, args.requests)
+            level_results = await load_run.run()
+            logger.info(f"run_benchmarks: concurrency {concurrency}, {load_run.issued} requests")
+            results.extend(level_results)
+        return results
+    finally:
+        if proc:
+            await stop_server(proc, base_url)
+
+
+def format_table(results):
+    lines = ["%-8s %6s %8s %6s %10s %9s %9s %9s %9s %9s" % (
+        "endpoint", "conc", "ok", "errors", "req/sec", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms")]
+    for r in results:
+        lines.append("%-8s %6d %8d %6d %10.1f %9.1f %9.1f %9.1f %9.1f %9.1f" % (
+            r["endpoint"], r["concurrency"], r["ok"], r["errors"], r["rps"], r["mean_ms"],
+            r["p50_ms"], r["p95_ms"], r["p99_ms"], r["max_ms"]))
+    return "\n".join(lines)
+
+
+def parse_int_list(text):
+    return [int(t) for t in text.split(",") if t]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the BizDeck HTTP API")
+    parser.add_argument("--concurrency", default=DEFAULT_CONCURRENCY, help="comma separated client counts")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION, help="secs per concurrency level")
+    parser.add_argument("--requests", type=int, default=0, help="requests per level, instead of --duration")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="comma separated endpoint=weight")
+    parser.add_argument("--cache-key", default=DEFAULT_CACHE_KEY, help="group/key for cache and excel")
+    parser.add_argument("--actions", default=DEFAULT_ACTIONS, help="actions script for the actions endpoint")
+    parser.add_argument("--setup", default="", help="comma separated actions scripts to run first")
+    parser.add_argument("--start", action="store_true", help="launch BizDeckServer.exe from BDTREE")
+    parser.add_argument("--json", help="path to write results as JSON")
+    args = parser.parse_args()
+    configure_logging("api_bench")
+    bench_results = IOLoop.current().run_sync(lambda: run_benchmarks(args))
+    print(format_table(bench_results))
+    if args.json:
+        with open(args.json, "wt") as json_file:
+            json_file.write(json.dumps(bench_results, indent=4))
@@ -0,0 +1,225 @@
+"""
+stress test BizDeck websocket broadcasts
+For each of a list of client counts, opens that many JSON subprotocol
+websockets on /ws, as GUIs and Excel watchers do, then repeatedly triggers
+a broadcast. By default the trigger runs an actions script that inserts into
+the cache, via /api/run/actions, and each insert is broadcast to every client
+as a cache message. With --mode button the trigger presses a button, via
+/api/run/button, as the StreamDeck does. --wait-type picks the message type
+each round waits for, eg notification for a button whose action notifies
+the GUI rather than inserting. Every message each client receives is
+timestamped, and we report the delivery latency from the trigger, the fan
+out spread from the first client to get the broadcast to the last,
+broadcasts that never arrived, and server and client RSS as the client count
+goes up. Finds and launches the server as api_bench.py does.
+Usage: python websock_bench.py [--clients 10,100,500] [--rounds 10] [--trigger load_quandl_yield]
+                               [--mode actions|button] [--wait-type cache]
+                               [--setup quandl_rates] [--start] [--json out.json]
+"""
+# std pkgs
+import argparse
+import json
+import logging
+import time
+from datetime import timedelta
+# 3rd pty
+import psutil
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.locks import Condition
+from tornado.websocket import websocket_connect
+# bizdeck
+from bd_utils import configure_logging, find_bizdeck_process, ConfigHelper
+from api_bench import (REQUEST_TIMEOUT, percentile, parse_int_list, run_setup, server_url,
+                       start_server, stop_server, wait_for_status)
+
+DEFAULT_CLIENTS = "10,100,500"
+DEFAULT_ROUNDS = 10
+DEFAULT_TRIGGER = "load_quandl_yield"
+DEFAULT_WAIT_TYPE = "cache"
+# --mode to the /api/run route that triggers each round
+TRIGGER_ROUTES = dict(actions="actions", button="button")
+# clients connect in batches, so we don't look like a SYN flood
+CONNECT_BATCH = 50
+CONNECT_TIMEOUT = 30
+DELIVERY_TIMEOUT = 10
+MB = 1024 * 1024
+
+# configured in __main__, as api_bench does
+logger = logging.getLogger("websock_bench")
+
+
+class WebsockClient(object):
+    def __init__(self, arrival):
+        # (monotonic secs, type, chars) for every message received
+        self.messages = []
+        self.arrival = arrival
+        self.conn = None
+
+    async def connect(self, url):
+        self.conn = await websocket_connect(url, on_message_callback=self.on_message, subprotocols=['json'])
+
+    def on_message(self, msg):
+        # None means the connection closed
+        if msg is None:
+            return
+        received = time.monotonic()
+        self.messages.append((received, json.loads(msg).get('type'), len(msg)))
+        self.arrival.notify_all()
+
+    def first(self, mtype, since):
+        return next((m[0] for m in self.messages if m[1] == mtype and m[0] >= since), None)
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+
+
+async def wait_for_all(clients, arrival, mtype, since, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(c.first(mtype, since) is not None for c in clients):
+            return
+        await arrival.wait(timeout=timedelta(seconds=deadline - time.monotonic()))
+
+
+def server_rss(port):
+    proc_info = find_bizdeck_process(port=port)
+    if not proc_info:
+        return None
+    try:
+        return psutil.Process(proc_info['pid']).memory_info().rss
+    except psutil.NoSuchProcess:
+        return None
+
+
+def mb(nbytes):
+    return nbytes / MB if nbytes is not None else None
+
+
+async def connect_clients(count, websock_url, arrival):
+    clients = [WebsockClient(arrival) for c in range(count)]
+    connected = []
+    for offset in range(0, count, CONNECT_BATCH):
+        batch = clients[offset:offset + CONNECT_BATCH]
+        outcomes = await gen.multi([connect_or_none(c, websock_url) for c in batch])
+        connected.extend(c for c, ok in zip(batch, outcomes) if ok)
+    return connected
+
+
+async def connect_or_none(client, websock_url):
+    try:
+        await client.connect(websock_url)
+        return True
+    except (OSError, HTTPClientError, StreamClosedError) as ex:
+        logger.error(f"connect_or_none: {ex}")
+        return False
+
+
+# Trigger one broadcast and wait for every client to get a wait_type message
+async def run_round(clients, arrival, trigger_url, wait_type):
+    start = time.monotonic()
+    response = await AsyncHTTPClient().fetch(trigger_url, raise_error=False, request_timeout=REQUEST_TIMEOUT)
+    if response.code != 200:
+        logger.error(f"run_round: retcode[{response.code}] for {trigger_url}")
+    await wait_for_all(clients, arrival, wait_type, start, DELIVERY_TIMEOUT)
+    arrivals = [c.first(wait_type, start) for c in clients]
+    received = [a for a in arrivals if a is not None]
+    first = min(received) if received else start
+    return ([a - start for a in received], [a - first for a in received], len(arrivals) - len(received))
+
+
+async def run_level(count, base_url, port, trigger_url, wait_type, rounds):
+    websock_url = base_url.replace("http://", "ws://") + "/ws"
+    arrival = Condition()
+    rss_before = server_rss(port)
+    start = time.monotonic()
+    clients = await connect_clients(count, websock_url, arrival)
+    # the connect sequence ends with a cache message
+    await wait_for_all(clients, arrival, 'cache', start, CONNECT_TIMEOUT)
+    connect_seconds = time.monotonic() - start
+    rss_connected = server_rss(port)
+    latencies, spreads, missing = [], [], 0
+    for r in range(rounds):
+        round_latencies, round_spreads, round_missing = await run_round(clients, arrival, trigger_url, wait_type)
+        latencies.extend(round_latencies)
+        spreads.extend(round_spreads)
+        missing += round_missing
+    rss_after = server_rss(port)
+    received = sum(len(c.messages) for c in clients)
+    for client in clients:
+        client.close()
+    latencies.sort()
+    spreads.sort()
+    result = dict(clients=count, connected=len(clients), connect_seconds=connect_seconds, rounds=rounds,
+                  wait_type=wait_type, delivered=len(latencies), missing=missing, messages=received,
+                  max_ms=1000.0 * latencies[-1] if latencies else 0.0,
+                  server_rss_mb_before=mb(rss_before), server_rss_mb_connected=mb(rss_connected),
+                  server_rss_mb_after=mb(rss_after), bench_rss_mb=mb(psutil.Process().memory_info().rss))
+    for pct in (50, 95, 99):
+        result[f"p{pct}_ms"] = 1000.0 * percentile(latencies, pct)
+        result[f"spread_p{pct}_ms"] = 1000.0 * percentile(spreads, pct)
+    logger.info(f"run_level: {count} clients, {len(latencies)} delivered, {missing} missing")
+    return result
+
+
+async def run_benchmarks(args):
+    ch = ConfigHelper()
+    base_url = server_url(ch)
+    port = int(base_url.rsplit(":", 1)[1])
+    proc = start_server(ch) if args.start else None
+    try:
+        if not await wait_for_status(base_url):
+            raise Exception(f"BizDeck not answering on {base_url}")
+        if args.setup:
+            await run_setup(base_url, args.setup.split(","))
+        trigger_url = f"{base_url}/api/run/{TRIGGER_ROUTES[args.mode]}/{args.trigger}"
+        results = []
+        for count in parse_int_list(args.clients):
+            results.append(await run_level(count, base_url, port, trigger_url, args.wait_type, args.rounds))
+        return results
+    finally:
+        if proc:
+            await stop_server(proc, base_url)
+
+
+# srv_mb_0, 1 and 2 are server RSS before connecting, once connected, and
+# after the broadcasts
+def format_table(results):
+    lines = ["%7s %7s %8s %9s %7s %8s %8s %8s %9s %9s %9s %9s" % (
+        "clients", "conn", "conn_s", "delivered", "missing", "p50_ms", "p95_ms", "p99_ms",
+        "spread99", "srv_mb_0", "srv_mb_1", "srv_mb_2")]
+    for r in results:
+        lines.append("%7d %7d %8.2f %9d %7d %8.1f %8.1f %8.1f %9.1f %9s %9s %9s" % (
+            r["clients"], r["connected"], r["connect_seconds"], r["delivered"], r["missing"], r["p50_ms"],
+            r["p95_ms"], r["p99_ms"], r["spread_p99_ms"], mb_text(r["server_rss_mb_before"]),
+            mb_text(r["server_rss_mb_connected"]), mb_text(r["server_rss_mb_after"])))
+    return "\n".join(lines)
+
+
+def mb_text(value):
+    return "%.1f" % value if value is not None else "n/a"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stress test BizDeck websocket broadcasts")
+    parser.add_argument("--clients", default=DEFAULT_CLIENTS, help="comma separated websocket client counts")
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS, help="broadcasts per client count")
+    parser.add_argument("--trigger", default=DEFAULT_TRIGGER,
+                        help="actions script, or button name with --mode button, that triggers each broadcast")
+    parser.add_argument("--mode", choices=sorted(TRIGGER_ROUTES), default="actions",
+                        help="run the trigger as an actions script, or press it as a button")
+    parser.add_argument("--wait-type", default=DEFAULT_WAIT_TYPE,
+                        help="websock message type each round waits for, eg cache or notification")
+    parser.add_argument("--setup", default="", help="comma separated actions scripts to run first")
+    parser.add_argument("--start", action="store_true", help="launch BizDeckServer.exe from BDTREE")
+    parser.add_argument("--json", help="path to write results as JSON")
+    args = parser.parse_args()
+    configure_logging("websock_bench")
+    bench_results = IOLoop.current().run_sync(lambda: run_benchmarks(args))
+    print(format_table(bench_results))
+    if args.json:
+        with open(args.json, "wt") as json_file:
+            json_file.write(json.dumps(bench_results, indent=4))
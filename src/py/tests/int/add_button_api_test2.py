@@ -3,7 +3,6 @@ import json
 import os
 import unittest
 # 3rd pty
-from tornado import gen
 from tornado.testing import gen_test
 from tornado.httpclient import HTTPRequest
 # bizdeck
@@ -35,9 +34,8 @@ class TestAddButtonAPI(BizDeckIntTestCase):
         add_response = await self.http_client.fetch(self.add_button_request)
         self.logger.info(f"test_add_button_api: retcode[{add_response.code}], body[{add_response.body}] for {self.add_button_url}")
         self.assertEqual(add_response.code, 200)
-        # wait a second while the server rewrites and closes config
-        await gen.sleep(1)
-        new_config_dict = self.reload_config()
+        # wait for the server to rewrite and close config
+        new_config_dict = await self.wait_for_config_change()
         self.assertEqual(self.biz_deck_config['default_browser'], new_config_dict['default_browser'])
         old_button_list = self.biz_deck_config['button_list']
         new_button_list = new_config_dict['button_list']
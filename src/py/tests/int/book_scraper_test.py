@@ -4,7 +4,6 @@ import os
 import unittest
 # 3rd pty
 from tornado.testing import gen_test
-from tornado import gen
 # bizdeck
 from async_test_utils import BizDeckIntTestCase
 
@@ -47,8 +46,8 @@ class TestBookScraper(BizDeckIntTestCase):
         # self.assertTrue(b'1MO' in xl_get_response.body)
         iqy_path = os.path.join(self.ch.bdtree, 'scripts', 'excel', 'scraped_books.iqy')
         self.assertTrue(os.path.exists(iqy_path))
-        # wait to allow incoming websock msgs
-        await gen.sleep(2)
+        # wait for the cache msg that ends the websock connect sequence
+        await self.wait_for_websock_message(lambda m: m.get('type') == 'cache', 'connect cache msg')
         await self.stop_biz_deck(biz_deck_proc)
 
 
@@ -4,7 +4,6 @@ import os
 import unittest
 # 3rd pty
 from tornado.testing import gen_test
-from tornado import gen
 # bizdeck
 from async_test_utils import BizDeckIntTestCase
 
@@ -24,8 +23,8 @@ class TestCargoRiskView(BizDeckIntTestCase):
         iter_response = await self.http_client.fetch(self.iterate_url)
         self.logger.info(f"test_cargo_risk_view: retcode[{iter_response.code}], body[{iter_response.body}], for {self.iterate_url}")
         self.assertEqual(iter_response.code, 200)
-        # wait to allow incoming websock msgs
-        await gen.sleep(2)
+        # wait for the cache msg that ends the websock connect sequence
+        await self.wait_for_websock_message(lambda m: m.get('type') == 'cache', 'connect cache msg')
         await self.stop_biz_deck(biz_deck_proc)
 
 
@@ -4,7 +4,6 @@ import os
 import unittest
 # 3rd pty
 from tornado.testing import gen_test
-from tornado import gen
 # bizdeck
 from async_test_utils import BizDeckIntTestCase
 
@@ -54,8 +53,8 @@ class TestCargoScraper(BizDeckIntTestCase):
         cargo_ids = scrape_csv['data']
         cargo_ids = [cid_dict['cargo_id'] for cid_dict in cargo_ids if cid_dict['cargo_id'].startswith('CARG')]
         self.logger.info(cargo_ids)
-        # wait to allow incoming websock msgs
-        await gen.sleep(2)
+        # wait for the cache msg that ends the websock connect sequence
+        await self.wait_for_websock_message(lambda m: m.get('type') == 'cache', 'connect cache msg')
         await self.stop_biz_deck(biz_deck_proc)
 
 
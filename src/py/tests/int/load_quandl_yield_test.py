@@ -4,7 +4,6 @@ import os
 import unittest
 # 3rd pty
 from tornado.testing import gen_test
-from tornado import gen
 # bizdeck
 from async_test_utils import BizDeckIntTestCase
 
@@ -54,8 +53,9 @@ class TestLoadQuandlYield(BizDeckIntTestCase):
         self.assertTrue(b'1MO' in xl_get_response.body)
         iqy_path = os.path.join(self.ch.bdtree, 'scripts', 'excel', 'quandl_yield_csv.iqy')
         self.assertTrue(os.path.exists(iqy_path))
-        # wait to allow incoming websock msgs
-        await gen.sleep(2)
+        # wait for the cache update broadcast to the GUI
+        await self.wait_for_websock_message(lambda m: m.get('type') == 'cache' and 'quandl' in m.get('data', {}),
+                                            'quandl cache msg')
         await self.stop_biz_deck(biz_deck_proc)
 
 
@@ -0,0 +1,183 @@
+"""
+run the BizDeck int tests in parallel
+Each worker gets its own copy of the BDTREE deploy tree, minus bin and logs,
+with int_test_config.json rewritten for its own HTTP port, browser debug port
+and browser user data dir. Workers pull test modules off a shared queue and
+run each in its own interpreter, with BDTREE, BDLOGDIR and BDBIN pointing at
+the worker's tree, a log dir for the module and the shared bin. When all
+modules have run, the logs are merged into BDROOT/logs, prefixed with the
+module name, along with a JSON summary. The cargo_* tests need a login, so
+are excluded by default, as cpyitests.bat leaves them out.
+Usage: python parallel_runner.py [--workers 4] [--base-port 9300] [--pattern *_test*.py]
+                                 [--exclude cargo_*] [--keep]
+"""
+# std pkgs
+import argparse
+import fnmatch
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+# bizdeck
+from bd_utils import configure_logging, ConfigHelper
+
+DEFAULT_WORKERS = 4
+DEFAULT_BASE_PORT = 9300
+DEFAULT_PATTERN = "*_test*.py"
+DEFAULT_EXCLUDE = "cargo_*"
+# ports per worker: HTTP server and browser recorder
+WORKER_PORTS = 2
+INT_TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+SUMMARY_NAME = "parallel_runner.json"
+
+# configured in __main__, so importing this module doesn't set up logging
+logger = logging.getLogger("parallel_runner")
+
+
+def find_test_modules(pattern, exclude=DEFAULT_EXCLUDE):
+    return sorted(n for n in os.listdir(INT_TEST_DIR)
+                  if fnmatch.fnmatch(n, pattern) and not (exclude and fnmatch.fnmatch(n, exclude)))
+
+
+# Copy the deploy tree, give the copy its own ports and browser user data
+# dir, and return the env vars that point the int tests at it
+def make_worker_tree(ch, root_dir, index, base_port):
+    tree = os.path.join(root_dir, f"worker{index}")
+    shutil.copytree(ch.bdtree, tree, ignore=shutil.ignore_patterns("bin", "logs", "venv", "*_backup"))
+    log_dir = os.path.join(tree, "logs")
+    os.makedirs(log_dir)
+    config_path = os.path.join(tree, "cfg", "int_test_config.json")
+    with open(config_path, "rt") as config_file:
+        config = json.loads(config_file.read())
+    config["http_server_port"] = base_port + WORKER_PORTS * index
+    config["browser_recorder_port"] = base_port + WORKER_PORTS * index + 1
+    for browser in config.get("browser_map", {}).values():
+        browser["user_data_dir"] = os.path.join(log_dir, "browser")
+    with open(config_path, "wt") as config_file:
+        config_file.write(json.dumps(config, indent=4))
+    env = dict(os.environ, BDTREE=tree, BDLOGDIR=log_dir, BDBIN=ch.bin_dir)
+    logger.info(f"make_worker_tree: {tree} on port {config['http_server_port']}")
+    return env
+
+
+# unittest's closing lines, eg "Ran 2 tests in 7.1s" and "FAILED (failures=1)"
+RAN_RE = re.compile(r"^Ran (\d+) tests? in", re.MULTILINE)
+VERDICT_RE = re.compile(r"^(?:OK|FAILED)(?: \((.*)\))?$", re.MULTILINE)
+OUTCOME_RE = re.compile(r"(failures|errors|skipped)=(\d+)")
+
+
+# Each module logs to its own dir under the worker's logs, as modules
+# can share test class names, eg add_button_api_test1, 2 and 3
+def run_module(module, env, log_dir):
+    start = time.monotonic()
+    module_name = os.path.splitext(module)[0]
+    module_log_dir = os.path.join(log_dir, module_name)
+    os.makedirs(module_log_dir, exist_ok=True)
+    out_path = os.path.join(module_log_dir, "unittest.out")
+    with open(out_path, "wt") as out_file:
+        retcode = subprocess.call([sys.executable, os.path.join(INT_TEST_DIR, module)],
+                                  env=dict(env, BDLOGDIR=module_log_dir), cwd=INT_TEST_DIR,
+                                  stdout=out_file, stderr=subprocess.STDOUT)
+    with open(out_path, "rt") as out_file:
+        output = out_file.read()
+    ran = RAN_RE.search(output)
+    result = dict(module=module, retcode=retcode, seconds=time.monotonic() - start,
+                  tests=int(ran.group(1)) if ran else 0, failures=0, errors=0, skipped=0)
+    verdicts = VERDICT_RE.findall(output)
+    for outcome, count in OUTCOME_RE.findall(verdicts[-1] if verdicts else ""):
+        result[outcome] = int(count)
+    return result
+
+
+def worker(index, env, modules, results, results_lock):
+    while True:
+        try:
+            module = modules.get_nowait()
+        except queue.Empty:
+            return
+        logger.info(f"worker{index}: running {module}")
+        result = run_module(module, env, env["BDLOGDIR"])
+        result["worker"] = index
+        logger.info(f"worker{index}: {module} retcode:{result['retcode']} in {result['seconds']:.1f}s")
+        with results_lock:
+            results.append(result)
+
+
+# Copy each module's logs to log_dir as <module>.<log name>. Test logs are
+# named for test classes, which aren't unique across modules. The browser
+# user data dirs stay behind.
+def merge_logs(worker_log_dirs, log_dir):
+    for worker_log_dir in worker_log_dirs:
+        for module_name in os.listdir(worker_log_dir):
+            module_log_dir = os.path.join(worker_log_dir, module_name)
+            if module_name == "browser" or not os.path.isdir(module_log_dir):
+                continue
+            for name in os.listdir(module_log_dir):
+                path = os.path.join(module_log_dir, name)
+                if os.path.isfile(path):
+                    shutil.copyfile(path, os.path.join(log_dir, f"{module_name}.{name}"))
+
+
+def run_parallel(worker_count, base_port, pattern, exclude=DEFAULT_EXCLUDE, keep=False):
+    ch = ConfigHelper()
+    test_modules = find_test_modules(pattern, exclude)
+    worker_count = max(1, min(worker_count, len(test_modules)))
+    modules = queue.Queue()
+    for module in test_modules:
+        modules.put(module)
+    results = []
+    results_lock = threading.Lock()
+    root_dir = tempfile.mkdtemp(prefix="bdworkers")
+    start = time.monotonic()
+    try:
+        envs = [make_worker_tree(ch, root_dir, index, base_port) for index in range(worker_count)]
+        threads = [threading.Thread(target=worker, args=(index, env, modules, results, results_lock))
+                   for index, env in enumerate(envs)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        merge_logs([env["BDLOGDIR"] for env in envs], ch.log_dir)
+    finally:
+        if keep:
+            logger.info(f"run_parallel: keeping worker trees in {root_dir}")
+        else:
+            shutil.rmtree(root_dir, ignore_errors=True)
+    results.sort(key=lambda r: r["module"])
+    summary = dict(workers=worker_count, wall_seconds=time.monotonic() - start,
+                   module_seconds=sum(r["seconds"] for r in results), modules=results)
+    with open(os.path.join(ch.log_dir, SUMMARY_NAME), "wt") as summary_file:
+        summary_file.write(json.dumps(summary, indent=4))
+    return summary
+
+
+def format_table(summary):
+    lines = ["%-28s %6s %6s %6s %6s %6s %8s" % ("module", "worker", "tests", "fail", "error", "skip", "secs")]
+    for r in summary["modules"]:
+        lines.append("%-28s %6d %6d %6d %6d %6d %8.1f" % (
+            r["module"], r["worker"], r["tests"], r["failures"], r["errors"], r["skipped"], r["seconds"]))
+    lines.append("%d workers: %.1fs wall clock for %.1fs of modules" % (
+        summary["workers"], summary["wall_seconds"], summary["module_seconds"]))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the BizDeck int tests in parallel")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--base-port", type=int, default=DEFAULT_BASE_PORT,
+                        help="worker N uses base-port+2N for HTTP and base-port+2N+1 for the browser")
+    parser.add_argument("--pattern", default=DEFAULT_PATTERN, help="test module file name pattern")
+    parser.add_argument("--exclude", default=DEFAULT_EXCLUDE, help="pattern of modules to skip, '' for none")
+    parser.add_argument("--keep", action="store_true", help="keep the worker trees for debugging")
+    args = parser.parse_args()
+    configure_logging("parallel_runner")
+    run_summary = run_parallel(args.workers, args.base_port, args.pattern, args.exclude, args.keep)
+    print(format_table(run_summary))
+    sys.exit(0 if all(r["retcode"] == 0 for r in run_summary["modules"]) else 1)
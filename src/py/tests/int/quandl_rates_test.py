@@ -4,7 +4,6 @@ from subprocess import Popen
 import unittest
 # 3rd pty
 from tornado.testing import AsyncTestCase, gen_test, AsyncHTTPClient
-from tornado import gen
 # bizdeck
 from async_test_utils import BizDeckIntTestCase
 
@@ -21,11 +20,9 @@ class TestQuandlRates(BizDeckIntTestCase):
         self.logger.info(f"test_quandl_rates: HTTP GET {self.quandl_rates_url}")
         rates_response = await self.http_client.fetch(self.quandl_rates_url)
         self.assertEqual(rates_response.code, 200)
-        for csv_name in ['yield', 'ded3', 'dswp10']:
-            csv_path = os.path.join(self.csv_dir_path, f'{csv_name}.csv')
-            self.assertEqual(os.path.exists(csv_path), True)
-        # wait to allow async actions in svr to complete
-        await gen.sleep(2)
+        # wait for async actions in svr to complete
+        csv_paths = [os.path.join(self.csv_dir_path, f'{csv_name}.csv') for csv_name in ['yield', 'ded3', 'dswp10']]
+        await self.wait_for_files(csv_paths)
         await self.stop_biz_deck(biz_deck_proc)
 
 
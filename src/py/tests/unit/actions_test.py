@@ -1,9 +1,18 @@
 """
 unit test the BizDeck core actions module
 NB this module is loaded by BizDeckPython.cs in the BizDeck server
+Runs under IronPython with .Net types, or under CPython with the
+plain Python containers from src/py/mock/mock_containers.py
 """
 # std pkgs
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import json
+import math
 import os
+import shutil
+from socketserver import ThreadingMixIn
+import tempfile
+import threading
 import time
 import unittest
 # src/py/core
@@ -11,9 +20,55 @@ import actions
 # src/py/mock
 from mock_logger import Logger
 from mock_cache import DataCache
-# .Net types via IronPython
-from System.Collections.Generic import Dictionary
-from System import Object
+from mock_config import load_http_formats, load_secrets
+# .Net types via IronPython, or their CPython stand ins
+try:
+    from System.Collections.Generic import Dictionary
+    from System import Object
+except ImportError:
+    from mock_containers import Dictionary, Object
+
+
+# Local HTTP stand in for the quandl download server. Serves
+# data/csv/yield.csv for any .csv path, and 404 for anything else.
+# HTTP/1.1 so connections are kept alive, as quandl's are.
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requested_paths.append(self.path)
+        if not self.path.split('?')[0].endswith('.csv'):
+            self.send_error(404)
+            return
+        csv_path = os.path.join(os.environ.get("BDROOT"), "data", "csv", "yield.csv")
+        with open(csv_path, "rb") as csv_file:
+            body = csv_file.read()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/csv")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), StandInHandler)
+        self.requested_paths = []
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def url(self, path):
+        return "http://127.0.0.1:%d%s" % (self.server_address[1], path)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
 
 
 class TestActions(unittest.TestCase):
@@ -24,6 +79,11 @@ class TestActions(unittest.TestCase):
         actions.Logger = Logger()
         self.cache = DataCache()
 
+    def tearDown(self):
+        # actions.py module state outlives each test, as it does the
+        # actions in the server
+        actions.reset_module_state()
+
     def test_python_csv_action1(self):
         # here we're simulating the behaviour of BizDeckPython.RunActionFunction
         param_dict = Dictionary[str, Object]()
@@ -37,6 +97,718 @@ class TestActions(unittest.TestCase):
         rv = func(param_dict)
         self.assertEqual(rv, "")
         self.assertTrue("quandl" in self.cache.cache)
+        cache_entry = self.cache.cache["quandl"]["yield_csv"]
+        self.assertEqual(cache_entry.value.Count, 5)
+        self.assertTrue(cache_entry.value.ContainsKey("2023-07-03"))
+
+    def test_python_csv_action_tail(self):
+        # max_lines from the end of the file, where the oldest rows are
+        param_dict = Dictionary[str, Object]()
+        param_dict.Add("cache", self.cache)
+        param_dict.Add("group", "quandl")
+        param_dict.Add("csv", "yield.csv")
+        param_dict.Add("row_key", "Date")
+        param_dict.Add("max_lines", "3")
+        param_dict.Add("read_mode", "tail")
+        rv = actions.add_csv_to_cache_as_dict(param_dict)
+        self.assertEqual(rv, "")
+        cache_entry = self.cache.cache["quandl"]["yield_csv"]
+        self.assertEqual(cache_entry.value.Count, 3)
+        self.assertTrue(cache_entry.value.ContainsKey("1990-01-02"))
+        self.assertEqual(cache_entry.headers[0], "Date")
+
+    def test_python_csv_columns_action(self):
+        param_dict = Dictionary[str, Object]()
+        param_dict.Add("cache", self.cache)
+        param_dict.Add("group", "quandl")
+        param_dict.Add("csv", "yield.csv")
+        param_dict.Add("row_key", "Date")
+        rv = actions.add_csv_to_cache_as_columns(param_dict)
+        self.assertEqual(rv, "")
+        cache_entry = self.cache.cache["quandl"]["yield_csv"]
+        self.assertEqual(cache_entry.type, "ColumnarCSV")
+        self.assertEqual(cache_entry.row_key, "Date")
+        # one typed array per column, all the same length
+        self.assertEqual(cache_entry.value["Date"][0], "2023-07-03")
+        self.assertEqual(cache_entry.value["1MO"][0], 5.27)
+        self.assertEqual(cache_entry.value["1MO"].Length, cache_entry.value["30YR"].Length)
+        # blanks in the oldest rows are NaN
+        last = cache_entry.value["1MO"].Length - 1
+        self.assertTrue(math.isnan(cache_entry.value["1MO"][last]))
+
+    def test_python_csv_incremental_action(self):
+        param_dict = Dictionary[str, Object]()
+        param_dict.Add("cache", self.cache)
+        param_dict.Add("group", "quandl")
+        param_dict.Add("csv", "yield.csv")
+        param_dict.Add("row_key", "Date")
+        param_dict.Add("incremental", "True")
+        rv = actions.add_csv_to_cache_as_dict(param_dict)
+        self.assertEqual(rv, "")
+        change_set = actions.last_change_set("quandl", "yield_csv")
+        self.assertTrue("2023-07-03" in change_set.added)
+        # reload of an unchanged file changes nothing
+        rv = actions.add_csv_to_cache_as_dict(param_dict)
+        self.assertEqual(rv, "")
+        change_set = actions.last_change_set("quandl", "yield_csv")
+        self.assertTrue(change_set.is_empty())
+        # reload after the entry was evicted is a full load
+        self.cache.Remove("quandl", "yield_csv")
+        rv = actions.add_csv_to_cache_as_dict(param_dict)
+        self.assertEqual(rv, "")
+        self.assertTrue("yield_csv" in self.cache.cache["quandl"])
+        self.assertEqual(len(actions.last_change_set("quandl", "yield_csv").added), 8383)
+
+    def test_python_reset_module_state(self):
+        # as /api/reset does: reset actions.py state, then clear the cache
+        param_dict = Dictionary[str, Object]()
+        param_dict.Add("cache", self.cache)
+        param_dict.Add("group", "quandl")
+        param_dict.Add("csv", "yield.csv")
+        param_dict.Add("row_key", "Date")
+        param_dict.Add("incremental", "True")
+        self.assertEqual(actions.add_csv_to_cache_as_dict(param_dict), "")
+        actions.reset_module_state()
+        self.cache = DataCache()
+        param_dict["cache"] = self.cache
+        self.assertEqual(actions.last_change_set("quandl", "yield_csv"), None)
+        self.assertEqual(actions.key_indexes, dict())
+        self.assertEqual(actions.add_csv_to_cache_as_dict(param_dict), "")
+        self.assertEqual(self.cache.cache["quandl"]["yield_csv"].value.Count, 8383)
+
+    # A scratch BDROOT holding rates.csv, newest first as yield.csv is
+    def make_rates_root(self, lines):
+        bdroot = tempfile.mkdtemp(prefix="bdincr")
+        os.makedirs(os.path.join(bdroot, "data", "csv"))
+        self.write_rates(bdroot, lines)
+        actions.BDRoot = bdroot
+        return bdroot
+
+    def write_rates(self, bdroot, lines):
+        with open(os.path.join(bdroot, "data", "csv", "rates.csv"), "wt") as csv_file:
+            csv_file.writelines(["Date,1MO,2MO\n"] + [line + "\n" for line in lines])
+
+    def rates_params(self):
+        param_dict = Dictionary[str, Object]()
+        param_dict.Add("cache", self.cache)
+        param_dict.Add("group", "rates")
+        param_dict.Add("csv", "rates.csv")
+        param_dict.Add("row_key", "Date")
+        param_dict.Add("incremental", "True")
+        return param_dict
+
+    def test_python_csv_incremental_prepend_append(self):
+        rows = ["2023-07-03,5.27,5.44", "2023-06-30,5.24,5.43", "2023-06-29,5.25,5.46"]
+        bdroot = self.make_rates_root(rows)
+        try:
+            param_dict = self.rates_params()
+            self.assertEqual(actions.add_csv_to_cache_as_dict(param_dict), "")
+            first_entry = self.cache.cache["rates"]["rates_csv"].value
+            # newest rows prepended
+            self.write_rates(bdroot, ["2023-07-05,5.28,5.45"] + rows)
+            self.assertEqual(actions.add_csv_to_cache_as_dict(param_dict), "")
+            change_set = actions.last_change_set("rates", "rates_csv")
+            self.assertTrue(change_set.incremental)
+            self.assertEqual((change_set.added, change_set.changed, change_set.removed), (["2023-07-05"], [], []))
+            entry = self.cache.cache["rates"]["rates_csv"].value
+            self.assertEqual(entry.Count, 4)
+            self.assertEqual(entry["2023-07-05"]["1MO"], "5.28")
+            # merged into a copy
+            self.assertEqual(first_entry.Count, 3)
+            # oldest rows appended
+            self.write_rates(bdroot, ["2023-07-05,5.28,5.45"] + rows + ["2023-06-28,5.17,5.38"])
+            self.assertEqual(actions.add_csv_to_cache_as_dict(param_dict), "")
+            change_set = actions.last_change_set("rates", "rates_csv")
+            self.assertTrue(change_set.incremental)
+            self.assertEqual(change_set.added, ["2023-06-28"])
+            self.assertEqual(self.cache.cache["rates"]["rates_csv"].value.Count, 5)
+        finally:
+            shutil.rmtree(bdroot, ignore_errors=True)
+
+    def test_python_csv_incremental_full_reload(self):
+        rows = ["2023-07-03,5.27,5.44", "2023-06-30,2.76,5.43", "2023-06-29,5.25,5.46"]
+        bdroot = self.make_rates_root(rows)
+        try:
+            param_dict = self.rates_params()
+            self.assertEqual(actions.add_csv_to_cache_as_dict(param_dict), "")
+            # a row revised in the middle, plus a prepended row
+            revised = ["2023-07-05,5.28,5.45", rows[0], "2023-06-30,9.76,5.43", rows[2]]
+            self.write_rates(bdroot, revised)
+            self.assertEqual(actions.add_csv_to_cache_as_dict(param_dict), "")
+            change_set = actions.last_change_set("rates", "rates_csv")
+            self.assertFalse(change_set.incremental)
+            self.assertEqual((change_set.added, change_set.changed, change_set.removed),
+                             (["2023-07-05"], ["2023-06-30"], []))
+            self.assertEqual(self.cache.cache["rates"]["rates_csv"].value["2023-06-30"]["1MO"], "9.76")
+            # truncated
+            self.write_rates(bdroot, revised[:2])
+            self.assertEqual(actions.add_csv_to_cache_as_dict(param_dict), "")
+            change_set = actions.last_change_set("rates", "rates_csv")
+            self.assertFalse(change_set.incremental)
+            self.assertEqual(sorted(change_set.removed), ["2023-06-29", "2023-06-30"])
+            self.assertEqual(self.cache.cache["rates"]["rates_csv"].value.Count, 2)
+            # rewritten with the same rows: nothing to insert
+            self.write_rates(bdroot, revised[:2])
+            entry = self.cache.cache["rates"]["rates_csv"]
+            self.assertEqual(actions.add_csv_to_cache_as_dict(param_dict), "")
+            self.assertTrue(actions.last_change_set("rates", "rates_csv").is_empty())
+            self.assertTrue(self.cache.cache["rates"]["rates_csv"] is entry)
+            # a schema means a full, non incremental, load
+            param_dict.Add("schema", "use")
+            self.write_rates(bdroot, revised)
+            self.assertEqual(actions.add_csv_to_cache_as_dict(param_dict), "")
+            self.assertEqual(actions.last_change_set("rates", "rates_csv"), None)
+            self.assertEqual(self.cache.cache["rates"]["rates_csv"].value.Count, 4)
+        finally:
+            shutil.rmtree(bdroot, ignore_errors=True)
+
+    def test_python_csv_group_action(self):
+        param_dict = Dictionary[str, Object]()
+        param_dict.Add("cache", self.cache)
+        param_dict.Add("group", "curves")
+        # JSON array text, as ActionsDriver passes a list param
+        param_dict.Add("csvs", '["yield.csv", "no_such.csv"]')
+        param_dict.Add("row_key", "Date")
+        rv = actions.add_csv_group_to_cache(param_dict)
+        # one error for the missing file, but yield.csv still loads
+        self.assertTrue("no_such.csv" in rv)
+        self.assertFalse("yield.csv:" in rv)
+        self.assertTrue("yield_csv" in self.cache.cache["curves"])
+        # glob form, as columns
+        param_dict["csvs"] = "yield*.csv"
+        param_dict.Add("entry_type", "columns")
+        # padded, as add_csv_to_cache_as_columns accepts
+        param_dict["row_key"] = " Date "
+        rv = actions.add_csv_group_to_cache(param_dict)
+        self.assertEqual(rv, "")
+        self.assertEqual(self.cache.cache["curves"]["yield_csv"].type, "ColumnarCSV")
+        self.assertEqual(self.cache.cache["curves"]["yield_csv"].row_key, "Date")
+
+    def test_python_download_csvs_action(self):
+        bdroot = os.environ.get("BDROOT")
+        actions.HttpFormatMap = load_http_formats(os.path.join(bdroot, "cfg", "http_formats.json"))
+        actions.Secrets = load_secrets(os.path.join(bdroot, "cfg", "secrets.json"))
+        server = StandInServer()
+        try:
+            downloads = [
+                dict(url=server.url("/quandl/USTREASURY/YIELD.csv"), target="yield.csv"),
+                dict(url=server.url("/quandl/FRED/DED3.csv"), target="ded3.csv"),
+                dict(url=server.url("/missing"), target="missing.csv")
+            ]
+            param_dict = Dictionary[str, Object]()
+            param_dict.Add("cache", self.cache)
+            param_dict.Add("group", "quandl")
+            param_dict.Add("downloads", json.dumps(downloads))
+            param_dict.Add("row_key", "Date")
+            param_dict.Add("max_per_host", "1")
+            rv = actions.download_csvs_to_cache(param_dict)
+        finally:
+            server.stop()
+            actions.HttpFormatMap = None
+            actions.Secrets = None
+        # one error, for the 404
+        self.assertTrue("/missing" in rv)
+        self.assertFalse(".csv" in rv)
+        group = self.cache.cache["quandl"]
+        self.assertEqual(group["yield_csv"].value.Count, 8383)
+        self.assertTrue("ded3_csv" in group)
+        # http_formats.json quandl url expansion added the token
+        self.assertTrue("/quandl/FRED/DED3.csv?auth_token=unit_test_token" in server.requested_paths)
+        # indexed at load, for the range, as-of and last-N queries
+        self.assertTrue(actions.key_indexes[("quandl", "yield_csv")].cs_cache_entry is group["yield_csv"].value)
+        # up to 8 workers, but the one host's connections were reused
+        stats = actions.last_download_stats("quandl")
+        self.assertEqual(stats["requests"], 3)
+        self.assertTrue(stats["connections"] <= 3)
+        # one worker: one keep alive connection for all three
+        server = StandInServer()
+        try:
+            param_dict["downloads"] = json.dumps([dict(url=server.url("/%d.csv" % n), target="%d.csv" % n)
+                                                  for n in range(3)])
+            param_dict["max_connections"] = "1"
+            self.assertEqual(actions.download_csvs_to_cache(param_dict), "")
+        finally:
+            server.stop()
+        self.assertEqual(actions.last_download_stats("quandl"), dict(requests=3, connections=1))
+
+    def test_python_bootstrap_action(self):
+        param_dict = Dictionary[str, Object]()
+        param_dict.Add("cache", self.cache)
+        param_dict.Add("group", "quandl")
+        param_dict.Add("csv", "yield.csv")
+        param_dict.Add("row_key", "Date")
+        rv = actions.add_csv_to_cache_as_columns(param_dict)
+        self.assertEqual(rv, "")
+        param_dict = Dictionary[str, Object]()
+        param_dict.Add("cache", self.cache)
+        param_dict.Add("group", "quandl")
+        param_dict.Add("cache_key", "yield_csv")
+        param_dict.Add("target_group", "quandl_ycb")
+        rv = actions.bootstrap_yield_curves(param_dict)
+        self.assertEqual(rv, "")
+        ycb = self.cache.cache["quandl_ycb"]
+        dfs = ycb["yield_csv_discount"].value
+        zeros = ycb["yield_csv_zero"].value
+        self.assertEqual(dfs["Date"][0], "2023-07-03")
+        # 6MO is a bill: 1 / (1 + 5.53% / 2)
+        self.assertAlmostEqual(dfs["6MO"][0], 1.0 / (1.0 + 0.0553 / 2), 10)
+        # 1YR par bond: 1 = c/2 * DF(0.5) + (1 + c/2) * DF(1)
+        c = 0.0543
+        self.assertAlmostEqual(c / 2 * dfs["6MO"][0] + (1 + c / 2) * dfs["1YR"][0], 1.0, 10)
+        # DFs fall with tenor, and zeros are close to par yields
+        self.assertTrue(dfs["30YR"][0] < dfs["10YR"][0] < dfs["1YR"][0] < 1.0)
+        self.assertAlmostEqual(zeros["10YR"][0], 3.86, 0)
+        # the oldest date has no 1MO quote, so it's extrapolated, not NaN
+        last = dfs["1MO"].Length - 1
+        self.assertFalse(math.isnan(dfs["1MO"][last]))
+        # curves are keyed by Date, so the key index queries work on them
+        rv = actions.query_cache_last(self.query_params("yield_csv_zero", group="quandl_ycb", count="1"))
+        self.assertEqual(rv, "")
+        self.assertEqual(list(ycb["yield_csv_zero_last"].value["Date"]), ["2023-07-03"])
+
+    def query_params(self, cache_key, group="quandl", **query):
+        param_dict = Dictionary[str, Object]()
+        param_dict.Add("cache", self.cache)
+        param_dict.Add("group", group)
+        param_dict.Add("cache_key", cache_key)
+        for name, value in query.items():
+            param_dict.Add(name, value)
+        return param_dict
+
+    def test_python_key_index_queries(self):
+        param_dict = Dictionary[str, Object]()
+        param_dict.Add("cache", self.cache)
+        param_dict.Add("group", "quandl")
+        param_dict.Add("csv", "yield.csv")
+        param_dict.Add("row_key", "Date")
+        rv = actions.add_csv_to_cache_as_dict(param_dict)
+        self.assertEqual(rv, "")
+        rv = actions.query_cache_range(self.query_params("yield_csv", start="2023-06-26", end="2023-06-30"))
+        self.assertEqual(rv, "")
+        result = self.cache.cache["quandl"]["yield_csv_range"].value
+        self.assertEqual(list(result.Keys), ["2023-06-26", "2023-06-27", "2023-06-28", "2023-06-29", "2023-06-30"])
+        # as of a Sunday gives the Friday
+        rv = actions.query_cache_as_of(self.query_params("yield_csv", as_of="2023-07-02", target_key="latest"))
+        self.assertEqual(rv, "")
+        result = self.cache.cache["quandl"]["latest"].value
+        self.assertEqual(list(result.Keys), ["2023-06-30"])
+        # columnar entries slice the same way
+        rv = actions.add_csv_to_cache_as_columns(param_dict)
+        self.assertEqual(rv, "")
+        rv = actions.query_cache_last(self.query_params("yield_csv", count="3"))
+        self.assertEqual(rv, "")
+        result = self.cache.cache["quandl"]["yield_csv_last"]
+        self.assertEqual(result.type, "ColumnarCSV")
+        self.assertEqual(list(result.value["Date"]), ["2023-06-29", "2023-06-30", "2023-07-03"])
+        self.assertEqual(result.value["1MO"][2], 5.27)
+        # the same rows again leave the result entry alone: no insert, no broadcast
+        rv = actions.query_cache_last(self.query_params("yield_csv", count="3"))
+        self.assertEqual(rv, "")
+        self.assertTrue(self.cache.cache["quandl"]["yield_csv_last"] is result)
+        # different rows replace it, in the same fixed entry
+        keys = len(self.cache.GetCacheKeys("quandl"))
+        rv = actions.query_cache_last(self.query_params("yield_csv", count="2"))
+        self.assertEqual(rv, "")
+        self.assertEqual(list(self.cache.cache["quandl"]["yield_csv_last"].value["Date"]), ["2023-06-30", "2023-07-03"])
+        self.assertEqual(len(self.cache.GetCacheKeys("quandl")), keys)
+        rv = actions.query_cache_as_of(self.query_params("no_such", as_of="2023-07-02"))
+        self.assertTrue("no keyed cache entry" in rv)
+        # numeric keys sort and compare as numbers, not strings
+        numbers = actions.Dictionary[str, actions.Array]()
+        numbers.Add("Tenor", actions.Array[float]([10.0, 9.0, 100.0, 2.0]))
+        numbers.Add("Rate", actions.Array[float]([5.0, 4.9, 4.0, 5.4]))
+        actions.insert_columns(self.cache, "quandl", "numbers", numbers, "Tenor", ["Tenor", "Rate"])
+        rv = actions.query_cache_range(self.query_params("numbers", start="5", end="20"))
+        self.assertEqual(rv, "")
+        self.assertEqual(list(self.cache.cache["quandl"]["numbers_range"].value["Tenor"]), [9.0, 10.0])
+        rv = actions.query_cache_as_of(self.query_params("numbers", as_of="50"))
+        self.assertEqual(rv, "")
+        self.assertEqual(list(self.cache.cache["quandl"]["numbers_as_of"].value["Rate"]), [5.0])
+        rv = actions.query_cache_last(self.query_params("numbers", count="1"))
+        self.assertEqual(list(self.cache.cache["quandl"]["numbers_last"].value["Tenor"]), [100.0])
+        rv = actions.query_cache_as_of(self.query_params("numbers", as_of="abc"))
+        self.assertTrue("bad query" in rv)
+
+    def test_python_cache_snapshot(self):
+        param_dict = Dictionary[str, Object]()
+        param_dict.Add("cache", self.cache)
+        param_dict.Add("group", "quandl")
+        param_dict.Add("csv", "yield.csv")
+        rv = actions.add_csv_to_cache_as_dict(param_dict)
+        self.assertEqual(rv, "")
+        listed = self.cache.Remove("quandl", "yield_csv")
+        self.cache.Insert("quandl", "yield_list", listed.value, None, listed.headers)
+        param_dict.Add("row_key", "Date")
+        rv = actions.add_csv_to_cache_as_dict(param_dict)
+        self.assertEqual(rv, "")
+        param_dict["group"] = "columns"
+        rv = actions.add_csv_to_cache_as_columns(param_dict)
+        self.assertEqual(rv, "")
+        # an entry whose source we can change after the save
+        snapshot_dir = tempfile.mkdtemp(prefix="bdsnap")
+        try:
+            source_path = os.path.join(snapshot_dir, "yield.csv")
+            shutil.copy(os.path.join(actions.BDRoot, "data", "csv", "yield.csv"), source_path)
+            keyed = self.cache.cache["quandl"]["yield_csv"]
+            actions.insert_rows(self.cache, "stale", "yield_csv", keyed.value, "Date", keyed.headers, source_path)
+            snapshot_path = os.path.join(snapshot_dir, "test.bdsnap")
+            save_dict = Dictionary[str, Object]()
+            save_dict.Add("cache", self.cache)
+            save_dict.Add("name", snapshot_path)
+            rv = actions.save_cache_snapshot(save_dict)
+            self.assertEqual(rv, "")
+            with open(source_path, "at") as csv_file:
+                csv_file.write("2023-07-04,,,,,,,,,,,,\n")
+            restored = DataCache()
+            save_dict["cache"] = restored
+            rv = actions.load_cache_snapshot(save_dict)
+            self.assertEqual(rv, "")
+            self.assertFalse("stale" in restored.cache)
+            for group, cache_key in [("quandl", "yield_csv"), ("quandl", "yield_list"), ("columns", "yield_csv")]:
+                original = self.cache.cache[group][cache_key]
+                copy = restored.cache[group][cache_key]
+                self.assertEqual(copy.type, original.type)
+                self.assertEqual(list(copy.headers), list(original.headers))
+                self.assertEqual(copy.Count, original.Count)
+            self.assertEqual(restored.cache["quandl"]["yield_csv"].value["2023-07-03"]["1MO"], "5.27")
+            self.assertEqual(list(restored.cache["quandl"]["yield_list"].value), list(self.cache.cache["quandl"]["yield_list"].value))
+            columns = restored.cache["columns"]["yield_csv"].value
+            self.assertEqual(list(columns["1MO"])[:3], list(self.cache.cache["columns"]["yield_csv"].value["1MO"])[:3])
+            # no snapshot is not an error, as on first start
+            save_dict["name"] = os.path.join(snapshot_dir, "none.bdsnap")
+            self.assertEqual(actions.load_cache_snapshot(save_dict), "")
+        finally:
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+    def test_python_csv_encoded_strings(self):
+        param_dict = Dictionary[str, Object]()
+        param_dict.Add("cache", self.cache)
+        param_dict.Add("group", "plain")
+        param_dict.Add("csv", "yield.csv")
+        rv = actions.add_csv_to_cache_as_dict(param_dict)
+        self.assertEqual(rv, "")
+        param_dict["group"] = "encoded"
+        param_dict.Add("encode_strings", "True")
+        rv = actions.add_csv_to_cache_as_dict(param_dict)
+        self.assertEqual(rv, "")
+        plain = self.cache.cache["plain"]["yield_csv"].value
+        encoded = self.cache.cache["encoded"]["yield_csv"].value
+        # consumers see the same values
+        self.assertEqual([dict(row) for row in encoded], [dict(row) for row in plain])
+        stats = actions.last_encoding_stats("encoded", "yield_csv")
+        self.assertTrue(stats.shared > 0)
+        self.assertTrue(stats.saved_bytes > 0)
+        # repeated values in a column are one shared string
+        cells = [row["10YR"] for row in encoded if row["10YR"] == "1.43"]
+        self.assertTrue(len(cells) > 1)
+        self.assertTrue(all(cell is cells[0] for cell in cells))
+        # Date is all distinct, so isn't low cardinality
+        encoder = actions.StringEncoder(max_distinct=10)
+        for index in range(20):
+            encoder.encode("Date", "2023-01-%02d" % index)
+        self.assertEqual(encoder.encoded_columns(), [])
+
+    def test_python_derived_entries(self):
+        param_dict = Dictionary[str, Object]()
+        param_dict.Add("cache", self.cache)
+        param_dict.Add("group", "quandl")
+        param_dict.Add("csv", "yield.csv")
+        param_dict.Add("row_key", "Date")
+        rv = actions.add_csv_to_cache_as_dict(param_dict)
+        self.assertEqual(rv, "")
+        derived_dict = Dictionary[str, Object]()
+        derived_dict.Add("cache", self.cache)
+        derived_dict.Add("group", "derived")
+        derived_dict.Add("cache_key", "spreads")
+        derived_dict.Add("source_group", "quandl")
+        derived_dict.Add("source_key", "yield_csv")
+        derived_dict.Add("series", '{"spread_10y2y": "10YR - 2YR", "slope": "(10YR - 2YR) / 8"}')
+        rv = actions.add_derived_series(derived_dict)
+        self.assertEqual(rv, "")
+        # a derived entry of a derived entry
+        derived_dict["cache_key"] = "spreads_bp"
+        derived_dict["source_group"] = "derived"
+        derived_dict["source_key"] = "spreads"
+        derived_dict["series"] = '{"spread_bp": "spread_10y2y * 100"}'
+        rv = actions.add_derived_series(derived_dict)
+        self.assertEqual(rv, "")
+        # computed at registration, so the GUI and /excel see them
+        spreads = actions.derived_entries[("derived", "spreads")]
+        spreads_bp = actions.derived_entries[("derived", "spreads_bp")]
+        self.assertFalse(spreads.stale)
+        self.assertAlmostEqual(self.cache.cache["derived"]["spreads"].value["slope"][0], (3.86 - 4.94) / 8)
+        self.assertAlmostEqual(self.cache.cache["derived"]["spreads_bp"].value["spread_bp"][0], (3.86 - 4.94) * 100)
+        rv = actions.query_cache_last(self.query_params("spreads_bp", count="1", group="derived"))
+        self.assertEqual(rv, "")
+        result = self.cache.cache["derived"]["spreads_bp_last"].value
+        self.assertEqual(list(result["Date"]), ["2023-07-03"])
+        # memoized
+        actions.get_cache_entry(self.cache, "derived", "spreads_bp")
+        self.assertEqual((spreads.computations, spreads_bp.computations), (1, 1))
+        # reinserting the source only invalidates, all the way down: both are
+        # out of the cache, and an unread derived entry isn't recomputed
+        rv = actions.add_csv_to_cache_as_dict(param_dict)
+        self.assertEqual(rv, "")
+        self.assertTrue(spreads.stale and spreads_bp.stale)
+        self.assertFalse("spreads" in self.cache.cache["derived"] or "spreads_bp" in self.cache.cache["derived"])
+        self.assertEqual((spreads.computations, spreads_bp.computations), (1, 1))
+        # reading spreads computes it, but not spreads_bp
+        actions.get_cache_entry(self.cache, "derived", "spreads")
+        self.assertEqual((spreads.computations, spreads_bp.computations), (2, 1))
+        self.assertTrue(spreads_bp.stale)
+        # and reading spreads_bp computes it from the new spreads
+        entry = actions.get_cache_entry(self.cache, "derived", "spreads_bp")
+        self.assertAlmostEqual(entry.value["spread_bp"][0], (3.86 - 4.94) * 100)
+        self.assertEqual((spreads.computations, spreads_bp.computations), (2, 2))
+        # a source that can't be computed from leaves them stale and out of the cache
+        cols = actions.Dictionary[str, actions.Array]()
+        cols.Add("Date", actions.Array[str](["2023-07-03"]))
+        actions.insert_columns(self.cache, "quandl", "yield_csv", cols, "Date", ["Date"])
+        self.assertEqual(actions.get_cache_entry(self.cache, "derived", "spreads_bp"), None)
+        self.assertTrue(spreads.stale and spreads_bp.stale)
+        self.assertFalse("spreads" in self.cache.cache["derived"])
+        rv = actions.add_csv_to_cache_as_dict(param_dict)
+        self.assertEqual(rv, "")
+        self.assertTrue(actions.get_cache_entry(self.cache, "derived", "spreads") is not None)
+        self.assertFalse(spreads.stale)
+        # registered before its source is loaded
+        derived_dict["cache_key"] = "early"
+        derived_dict["source_group"] = "later"
+        derived_dict["source_key"] = "yield_csv"
+        derived_dict["series"] = '{"spread_10y2y": "10YR - 2YR"}'
+        self.assertEqual(actions.add_derived_series(derived_dict), "")
+        self.assertTrue(actions.derived_entries[("derived", "early")].stale)
+        materialise_dict = Dictionary[str, Object]()
+        materialise_dict.Add("cache", self.cache)
+        self.assertTrue("later/yield_csv" in actions.materialise_derived_entries(materialise_dict))
+        param_dict["group"] = "later"
+        rv = actions.add_csv_to_cache_as_dict(param_dict)
+        self.assertEqual(rv, "")
+        self.assertTrue(actions.derived_entries[("derived", "early")].stale)
+        # materialising puts the stale entries back in the cache for the GUI and /excel
+        self.assertEqual(actions.materialise_derived_entries(materialise_dict), "")
+        self.assertFalse(actions.derived_entries[("derived", "early")].stale)
+        self.assertTrue("early" in self.cache.cache["derived"])
+        self.assertTrue("spreads_bp" in self.cache.cache["derived"])
+        derived_dict["series"] = '{"bad": "spread_10y2y +"}'
+        self.assertTrue("unexpected end" in actions.add_derived_series(derived_dict))
+
+    def test_python_resample_action(self):
+        param_dict = Dictionary[str, Object]()
+        param_dict.Add("cache", self.cache)
+        param_dict.Add("group", "quandl")
+        param_dict.Add("csv", "yield.csv")
+        param_dict.Add("row_key", "Date")
+        rv = actions.add_csv_to_cache_as_dict(param_dict)
+        self.assertEqual(rv, "")
+        rv = actions.resample_cache_entry(self.query_params("yield_csv", frequency="monthly"))
+        self.assertEqual(rv, "")
+        monthly = self.cache.cache["quandl"]["yield_csv_monthly_last"]
+        self.assertEqual(monthly.type, "ColumnarCSV")
+        # keyed on the last date in each month
+        self.assertEqual(list(monthly.value["Date"])[-2:], ["2023-06-30", "2023-07-03"])
+        self.assertEqual(monthly.value["1MO"][-1], 5.27)
+        self.assertTrue(monthly.Count * 15 < self.cache.cache["quandl"]["yield_csv"].Count)
+        rv = actions.resample_cache_entry(self.query_params("yield_csv", frequency="weekly", aggregation="max"))
+        self.assertEqual(rv, "")
+        weekly = self.cache.cache["quandl"]["yield_csv_weekly_max"]
+        # week of 2023-06-26 to 2023-06-30
+        week = [float(self.cache.cache["quandl"]["yield_csv"].value["2023-06-%02d" % d]["1MO"]) for d in range(26, 31)]
+        self.assertEqual(weekly.value["1MO"][-2], max(week))
+        rv = actions.resample_cache_entry(self.query_params("yield_csv", frequency="quarterly", aggregation="mean"))
+        self.assertEqual(rv, "")
+        self.assertEqual(list(self.cache.cache["quandl"]["yield_csv_quarterly_mean"].value["Date"])[-1], "2023-07-03")
+        rv = actions.resample_cache_entry(self.query_params("yield_csv", frequency="daily"))
+        self.assertTrue("bad frequency" in rv)
+        # numeric keys, as a key column inferred as float has
+        numbers = actions.Dictionary[str, actions.Array]()
+        numbers.Add("Tenor", actions.Array[float]([1.0, 2.0]))
+        numbers.Add("Rate", actions.Array[float]([5.2, 5.4]))
+        actions.insert_columns(self.cache, "quandl", "numbers", numbers, "Tenor", ["Tenor", "Rate"])
+        rv = actions.resample_cache_entry(self.query_params("numbers", frequency="monthly"))
+        self.assertTrue("keys aren't ISO dates" in rv)
+
+    def test_python_csv_schema(self):
+        # a scratch BDROOT, as the schema is saved next to the csv
+        bdroot = tempfile.mkdtemp(prefix="bdschema")
+        try:
+            csv_dir = os.path.join(bdroot, "data", "csv")
+            os.makedirs(csv_dir)
+            csv_path = os.path.join(csv_dir, "yield.csv")
+            shutil.copy(os.path.join(actions.BDRoot, "data", "csv", "yield.csv"), csv_path)
+            actions.BDRoot = bdroot
+            param_dict = Dictionary[str, Object]()
+            param_dict.Add("cache", self.cache)
+            param_dict.Add("group", "quandl")
+            param_dict.Add("csv", "yield.csv")
+            param_dict.Add("row_key", "Date")
+            param_dict.Add("schema", "use")
+            rv = actions.add_csv_to_cache_as_columns(param_dict)
+            self.assertEqual(rv, "")
+            schema = actions.CsvSchema.load(os.path.join(csv_dir, "yield.schema.json"))
+            self.assertEqual(schema.names[:3], ["Date", "1 MO", "2 MO"])
+            self.assertEqual(schema.column("Date"), dict(name="Date", type="str", nullable=False))
+            self.assertEqual(schema.column("1 MO")["type"], "float")
+            # second load uses the saved schema
+            rv = actions.add_csv_to_cache_as_dict(param_dict)
+            self.assertEqual(rv, "")
+            self.assertEqual(list(self.cache.cache["quandl"]["yield_csv"].headers)[:2], ["Date", "1MO"])
+            # a bad cell fails fast
+            with open(csv_path, "rt") as csv_file:
+                lines = csv_file.readlines()
+            lines[1] = lines[1].replace("5.27", "n/a", 1)
+            with open(csv_path, "wt") as csv_file:
+                csv_file.writelines(lines)
+            rv = actions.add_csv_to_cache_as_columns(param_dict)
+            self.assertTrue("1 MO(n/a) is not a float" in rv)
+            # vendor drops a column
+            with open(csv_path, "wt") as csv_file:
+                csv_file.writelines([line.rsplit(",", 1)[0] + "\n" for line in lines])
+            rv = actions.add_csv_to_cache_as_dict(param_dict)
+            self.assertTrue("schema drift" in rv)
+            self.assertTrue("30 YR" in rv)
+            param_dict["schema"] = "refresh"
+            rv = actions.add_csv_to_cache_as_dict(param_dict)
+            self.assertEqual(rv, "")
+        finally:
+            shutil.rmtree(bdroot, ignore_errors=True)
+
+    def test_python_merge_action(self):
+        param_dict = Dictionary[str, Object]()
+        param_dict.Add("cache", self.cache)
+        param_dict.Add("group", "quandl")
+        param_dict.Add("csv", "yield.csv")
+        param_dict.Add("row_key", "Date")
+        rv = actions.add_csv_to_cache_as_dict(param_dict)
+        self.assertEqual(rv, "")
+        rv = actions.query_cache_range(self.query_params("yield_csv", start="2023-06-29", target_key="recent"))
+        self.assertEqual(rv, "")
+        # a FRED style series on another calendar, which clashes on 1MO
+        swaps = actions.Dictionary[str, actions.Array]()
+        swaps.Add("DATE", actions.Array[str](["2023-07-04", "2023-06-28", "2023-07-01"]))
+        swaps.Add("VALUE", actions.Array[float]([4.1, 3.9, 4.0]))
+        swaps.Add("1MO", actions.Array[float]([1.0, 2.0, 3.0]))
+        actions.insert_columns(self.cache, "fred", "dswp10", swaps, "DATE", ["DATE", "VALUE", "1MO"])
+        merge_dict = Dictionary[str, Object]()
+        merge_dict.Add("cache", self.cache)
+        merge_dict.Add("group", "quandl")
+        merge_dict.Add("sources", '["recent", "fred/dswp10"]')
+        rv = actions.merge_cache_entries(merge_dict)
+        self.assertEqual(rv, "")
+        merged = self.cache.cache["quandl"]["merged"].value
+        self.assertEqual(list(merged["Date"]), ["2023-06-28", "2023-06-29", "2023-06-30",
+                                               "2023-07-01", "2023-07-03", "2023-07-04"])
+        self.assertEqual(merged["dswp10_1MO"][5], 1.0)
+        self.assertTrue(math.isnan(merged["dswp10_1MO"][4]))
+        self.assertEqual(merged["VALUE"][3], 4.0)
+        self.assertEqual(merged["recent_1MO"][4], 5.27)
+        self.assertTrue(math.isnan(merged["recent_1MO"][0]))
+        # asof: yield's calendar, swaps carried forward over their holidays
+        merge_dict.Add("join", "asof")
+        merge_dict.Add("target_key", "curve")
+        rv = actions.merge_cache_entries(merge_dict)
+        self.assertEqual(rv, "")
+        curve = self.cache.cache["quandl"]["curve"].value
+        self.assertEqual(list(curve["Date"]), ["2023-06-29", "2023-06-30", "2023-07-03"])
+        self.assertEqual(list(curve["VALUE"]), [3.9, 3.9, 4.0])
+        merge_dict["join"] = "inner"
+        self.assertTrue("bad join" in actions.merge_cache_entries(merge_dict))
+
+    def test_python_columnar_file_errors(self):
+        param_dict = Dictionary[str, Object]()
+        param_dict.Add("cache", self.cache)
+        param_dict.Add("group", "quandl")
+        param_dict.Add("file", "csv/yield.csv")
+        rv = actions.add_columnar_file_to_cache(param_dict)
+        self.assertTrue("not a Parquet or Arrow IPC file" in rv)
+        if actions.ColumnarFileReader is None and actions.pyarrow is None:
+            param_dict["file"] = "parquet/yield.parquet"
+            rv = actions.add_columnar_file_to_cache(param_dict)
+            self.assertTrue("no Parquet/Arrow reader" in rv)
+
+    @unittest.skipUnless(actions.pyarrow, "needs pyarrow")
+    def test_python_columnar_file_action(self):
+        bdroot = tempfile.mkdtemp(prefix="bdcolumnar")
+        try:
+            os.makedirs(os.path.join(bdroot, "data", "parquet"))
+            table = actions.pyarrow.table({
+                "Date": ["2023-06-29", "2023-06-30", "2023-07-03", "2023-07-05"],
+                "1 MO": [5.2, 5.24, 5.27, None],
+                "10 YR": [3.85, 3.81, 3.86, 3.94],
+            })
+            actions.pyarrow.parquet.write_table(table, os.path.join(bdroot, "data", "parquet", "yield.parquet"),
+                                                row_group_size=2)
+            with actions.pyarrow.ipc.new_file(os.path.join(bdroot, "data", "parquet", "yield.arrow"),
+                                              table.schema) as writer:
+                for batch in table.to_batches(max_chunksize=2):
+                    writer.write_batch(batch)
+            actions.BDRoot = bdroot
+            param_dict = Dictionary[str, Object]()
+            param_dict.Add("cache", self.cache)
+            param_dict.Add("group", "quandl")
+            param_dict.Add("file", "parquet/yield.parquet")
+            param_dict.Add("row_key", "Date")
+            param_dict.Add("headers", '["1 MO"]')
+            param_dict.Add("row_groups", '[1]')
+            rv = actions.add_columnar_file_to_cache(param_dict)
+            self.assertEqual(rv, "")
+            entry = self.cache.cache["quandl"]["yield_parquet"]
+            self.assertEqual(entry.type, "ColumnarCSV")
+            self.assertEqual(list(entry.headers), ["Date", "1MO"])
+            self.assertEqual(list(entry.value["Date"]), ["2023-07-03", "2023-07-05"])
+            self.assertTrue(math.isnan(entry.value["1MO"][1]))
+            param_dict["file"] = "parquet/yield.arrow"
+            param_dict.Add("entry_type", "dict")
+            rv = actions.add_columnar_file_to_cache(param_dict)
+            self.assertEqual(rv, "")
+            entry = self.cache.cache["quandl"]["yield_arrow"]
+            self.assertEqual(entry.type, "PrimaryKeyCSV")
+            self.assertEqual(dict(entry.value["2023-07-03"]), {"Date": "2023-07-03", "1MO": "5.27"})
+        finally:
+            shutil.rmtree(bdroot, ignore_errors=True)
+
+    def test_python_json_action(self):
+        bdroot = tempfile.mkdtemp(prefix="bdjson")
+        try:
+            json_dir = os.path.join(bdroot, "data", "json")
+            os.makedirs(json_dir)
+            records = [{"date": "2023-07-0%d" % d, "price": {"close": 100.5 + d, "volume": 1000 * d},
+                        "live": d % 2 == 0, "note": None} for d in range(1, 8)]
+            with open(os.path.join(json_dir, "prices.json"), "wt") as json_file:
+                json_file.write(json.dumps(records, indent=2))
+            with open(os.path.join(json_dir, "prices.ndjson"), "wt") as json_file:
+                json_file.write("\n".join(json.dumps(record) for record in records) + "\n")
+            actions.BDRoot = bdroot
+            # tiny chunks, so records and numbers straddle chunk boundaries
+            actions.JSON_CHUNK_SIZE = 7
+            param_dict = Dictionary[str, Object]()
+            param_dict.Add("cache", self.cache)
+            param_dict.Add("group", "prices")
+            param_dict.Add("file", "prices.json")
+            param_dict.Add("row_key", "date")
+            rv = actions.add_json_to_cache(param_dict)
+            self.assertEqual(rv, "")
+            entry = self.cache.cache["prices"]["prices_json"]
+            self.assertEqual(list(entry.headers), ["date", "price_close", "price_volume", "live", "note"])
+            self.assertEqual(dict(entry.value["2023-07-03"]), {"date": "2023-07-03", "price_close": "103.5",
+                                                               "price_volume": "3000", "live": "false", "note": ""})
+            # NDJSON, with selected and renamed fields, as a list
+            param_dict["file"] = "prices.ndjson"
+            param_dict.Remove("row_key")
+            param_dict.Add("fields", '{"Date": "date", "Close": "price.close"}')
+            rv = actions.add_json_to_cache(param_dict)
+            self.assertEqual(rv, "")
+            entry = self.cache.cache["prices"]["prices_ndjson"]
+            self.assertEqual(entry.type, "RegularCSV")
+            self.assertEqual(len(entry.value), 7)
+            self.assertEqual(dict(entry.value[6]), {"Date": "2023-07-07", "Close": "107.5"})
+            with open(os.path.join(json_dir, "bad.json"), "wt") as json_file:
+                json_file.write('[{"date": "2023-07-01"} {"date": "2023-07-02"}]')
+            param_dict["file"] = "bad.json"
+            self.assertTrue("expected , or ]" in actions.add_json_to_cache(param_dict))
+        finally:
+            actions.JSON_CHUNK_SIZE = 65536
+            shutil.rmtree(bdroot, ignore_errors=True)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,82 @@
+"""
+unit test the reference DataCache in src/py/mock/mock_cache.py
+Runs under CPython with src/py/mock on PYTHONPATH
+"""
+# std pkgs
+import unittest
+# src/py/mock
+from mock_cache import DataCache, string_bytes
+from mock_containers import Array, Dictionary, List
+
+
+def make_rows(count, width=4):
+    rows = List[Dictionary[str, str]]()
+    for r in range(count):
+        row = Dictionary[str, str]()
+        for c in range(width):
+            row.Add("C%d" % c, "%d.%d" % (r, c))
+        rows.Add(row)
+    return rows
+
+
+class TestDataCache(unittest.TestCase):
+
+    def test_entry_bytes(self):
+        cache = DataCache(account_bytes=True)
+        cache.Insert("g", "small", make_rows(10), None, ["C0", "C1", "C2", "C3"])
+        cache.Insert("g", "big", make_rows(100), None, ["C0", "C1", "C2", "C3"])
+        small = cache.GetCacheEntry("g", "small").nbytes
+        big = cache.GetCacheEntry("g", "big").nbytes
+        self.assertTrue(0 < small < big)
+        self.assertEqual(cache.Stats()["bytes"], small + big)
+        # doubles are 8 bytes a cell, strings far more
+        columns = Dictionary[str, Array]()
+        columns.Add("F", Array[float]([1.0] * 1000))
+        cache.InsertColumns("g", "cols", columns, None, ["F"])
+        self.assertTrue(cache.GetCacheEntry("g", "cols").nbytes < 1000 * string_bytes("1.0"))
+        # shared strings are counted once
+        shared = "".join(["a"] * 100)
+        for cache_key, make_cell in [("shared", lambda: shared), ("copies", lambda: "".join(["a"] * 100))]:
+            rows = List[Dictionary[str, str]]()
+            for r in range(10):
+                row = Dictionary[str, str]()
+                row.Add("S", make_cell())
+                rows.Add(row)
+            cache.Insert("g", cache_key, rows, None, ["S"])
+        saved = cache.GetCacheEntry("g", "copies").nbytes - cache.GetCacheEntry("g", "shared").nbytes
+        self.assertEqual(saved, 9 * string_bytes(shared))
+
+    def test_lru_eviction(self):
+        evicted = []
+        probe = DataCache(account_bytes=True)
+        probe.Insert("g", "k", make_rows(10), None, [])
+        entry_size = probe.Stats()["bytes"]
+        cache = DataCache(budget_bytes=3 * entry_size, on_evict=lambda g, k, e: evicted.append((g, k)))
+        cache.Insert("g1", "a", make_rows(10), None, [])
+        cache.Insert("g2", "b", make_rows(10), None, [])
+        cache.Insert("g1", "c", make_rows(10), None, [])
+        # touch a, so b is the LRU across groups
+        self.assertTrue(cache.GetCacheEntry("g1", "a") is not None)
+        cache.Insert("g2", "d", make_rows(10), None, [])
+        self.assertEqual(evicted, [("g2", "b")])
+        self.assertEqual(cache.GetCacheKeys("g2"), ["d"])
+        self.assertTrue(cache.GetCacheEntry("g2", "b") is None)
+        # pinned entries survive
+        cache.Pin("g1", "c")
+        cache.Insert("g3", "e", make_rows(10), None, [])
+        cache.Insert("g3", "f", make_rows(10), None, [])
+        self.assertTrue(cache.GetCacheEntry("g1", "c") is not None)
+        stats = cache.Stats()
+        self.assertEqual(stats["evictions"], 3)
+        self.assertEqual(stats["misses"], 1)
+        self.assertTrue(stats["bytes"] <= stats["budget_bytes"])
+        # reinserting replaces, and doesn't double count
+        cache.Insert("g3", "f", make_rows(10), None, [])
+        self.assertEqual(cache.Stats()["bytes"], 3 * entry_size)
+        # an entry over budget on its own stays, and evicts everything unpinned
+        cache.Insert("g4", "huge", make_rows(100), None, [])
+        self.assertEqual(sorted(cache.lru.keys()), [("g1", "c"), ("g4", "huge")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+"""
+unit test the int test upstream stand in, src/py/core/upstream_stand_in.py
+Runs under CPython with src/py/core on PYTHONPATH
+"""
+# std pkgs
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+# 3rd pty
+from tornado.testing import AsyncHTTPTestCase
+# src/py/core
+from upstream_stand_in import (UpstreamSettings, UpstreamStandIn, copy_tree, find_urls,
+                               redirect_scripts, redirect_url)
+
+BASE_URL = "http://localhost:9400"
+QUANDL_URL = "https://www.quandl.com/api/v1/datasets/FRED/DED3.csv?auth_token=abc"
+
+
+def write_json(path, value):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wt") as json_file:
+        json_file.write(json.dumps(value))
+
+
+class TestRedirectScripts(unittest.TestCase):
+
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp(prefix="bdupstream")
+        self.tree = os.path.join(self.root_dir, "src_tree")
+        write_json(os.path.join(self.tree, "scripts", "actions", "quandl.json"),
+                   dict(actions=[dict(type="http_get", url=QUANDL_URL, target="ded3.csv")]))
+        write_json(os.path.join(self.tree, "scripts", "steps", "books.json"),
+                   dict(steps=[dict(type="navigate", url="https://books.toscrape.com",
+                                    assertedEvents=[dict(type="navigation", url="https://books.toscrape.com/")])]))
+        write_json(os.path.join(self.tree, "scripts", "actions", "local.json"),
+                   dict(actions=[dict(type="python_action", func="add_csv_to_cache_as_dict")]))
+        os.makedirs(os.path.join(self.tree, "bin"))
+        with open(os.path.join(self.tree, "scripts", "actions", "quandl.json"), "rt") as script_file:
+            self.quandl_text = script_file.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir, ignore_errors=True)
+
+    def test_redirect_url(self):
+        self.assertEqual(redirect_url(QUANDL_URL, BASE_URL),
+                         BASE_URL + "/www.quandl.com/api/v1/datasets/FRED/DED3.csv?auth_token=abc")
+        self.assertEqual(redirect_url(" https://books.toscrape.com", BASE_URL), BASE_URL + "/books.toscrape.com/")
+
+    def test_redirect_scripts(self):
+        copy = copy_tree(self.tree, self.root_dir)
+        self.assertFalse(os.path.exists(os.path.join(copy, "bin")))
+        self.assertTrue(os.path.isdir(os.path.join(copy, "logs")))
+        written = redirect_scripts(self.tree, copy, BASE_URL)
+        self.assertEqual(sorted(os.path.basename(p) for p in written), ["books.json", "quandl.json"])
+        # the source tree is only read
+        with open(os.path.join(self.tree, "scripts", "actions", "quandl.json"), "rt") as script_file:
+            self.assertEqual(script_file.read(), self.quandl_text)
+        with open(os.path.join(copy, "scripts", "steps", "books.json"), "rt") as script_file:
+            urls = find_urls(json.loads(script_file.read()))
+        # including those in assertedEvents
+        self.assertEqual(urls, [BASE_URL + "/books.toscrape.com/", BASE_URL + "/books.toscrape.com/"])
+
+
+class TestUpstreamStandIn(AsyncHTTPTestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="bdfixtures")
+        self.fixture_root = os.path.join(self.temp_dir, "upstream")
+        os.makedirs(os.path.join(self.fixture_root, "example.com", "data"))
+        with open(os.path.join(self.fixture_root, "example.com", "data", "rates.csv"), "wt") as csv_file:
+            csv_file.write("Date,Value\n2023-07-03,5.27\n")
+        with open(os.path.join(self.fixture_root, "example.com", "index.html"), "wt") as html_file:
+            html_file.write("<html></html>")
+        # outside the fixture root, so never served
+        with open(os.path.join(self.temp_dir, "secret.txt"), "wt") as secret_file:
+            secret_file.write("secret")
+        settings = UpstreamSettings(errors={"flaky.example.com/*": 503})
+        self.stand_in = UpstreamStandIn(self.fixture_root, settings, logging.getLogger("upstream_stand_in_test"))
+        # super().setUp calls get_app
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def get_app(self):
+        return self.stand_in.application()
+
+    def test_fixtures(self):
+        # query strings, eg auth tokens, are ignored
+        response = self.fetch("/example.com/data/rates.csv?auth_token=abc")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, b"Date,Value\n2023-07-03,5.27\n")
+        self.assertTrue(response.headers["Content-Type"].startswith("text/csv"))
+        response = self.fetch("/example.com/")
+        self.assertEqual(response.body, b"<html></html>")
+        self.assertEqual(self.fetch("/example.com/missing.csv").code, 404)
+        stats = self.stand_in.stats()
+        self.assertEqual(stats["requests"], 3)
+        self.assertEqual(stats["paths"]["example.com/missing.csv"]["statuses"], {"404": 1})
+
+    def test_injected_errors(self):
+        self.assertEqual(self.fetch("/flaky.example.com/data.csv").code, 503)
+        self.stand_in.settings.error_rate = 1.0
+        self.stand_in.settings.error_status = 500
+        self.assertEqual(self.fetch("/example.com/data/rates.csv").code, 500)
+
+    def test_fixture_path(self):
+        self.assertEqual(self.stand_in.fixture_path("example.com/data/../index.html"),
+                         os.path.join(os.path.abspath(self.fixture_root), "example.com", "index.html"))
+        self.assertEqual(self.stand_in.fixture_path("../secret.txt"), None)
+        self.assertEqual(self.stand_in.fixture_path("example.com/../../secret.txt"), None)
+
+
+if __name__ == '__main__':
+    unittest.main()